@@ -1,27 +1,20 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns 
 import os
+import sys
 from sklearn.preprocessing import MinMaxScaler
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Segment_Comparison_Analysis'))
+from dtw import pairwise_dtw, to_square_matrix
+from profile_cube import load_cube, select, hourly_profile
+import series_store
+from instrument import stage
+
 # Folders configuration
 BASELINE_FOLDER = 'Season_Comparison/weighted_baseline'
 HOLIDAY_FOLDER = 'Season_Comparison/weighted_holiday'
 
-def simple_dtw_distance(s1, s2):
-    """Calculates DTW distance to measure temporal rhythm drift."""
-    n, m = len(s1), len(s2)
-    dtw_matrix = np.zeros((n+1, m+1))
-    dtw_matrix.fill(np.inf)
-    dtw_matrix[0, 0] = 0
-    for i in range(1, n+1):
-        for j in range(1, m+1):
-            cost = abs(s1[i-1] - s2[j-1])
-            last_min = min(dtw_matrix[i-1, j], dtw_matrix[i, j-1], dtw_matrix[i-1, j-1])
-            dtw_matrix[i, j] = cost + last_min
-    return dtw_matrix[n, m]
-
 def get_aggregate_profile(folder_path, date_filter=None, normalize=True):
     """
     Combines segments into a master profile.
@@ -29,28 +22,28 @@ def get_aggregate_profile(folder_path, date_filter=None, normalize=True):
     normalize=False: Returns raw vehicle density.
     """
     all_profiles = []
-    if not os.path.exists(folder_path):
-        print(f"Directory not found: {folder_path}")
+    # Segments from the series store of the weighting stage if there is one, else the cube
+    stored = series_store.stored_segments(folder_path)
+    cube = None if stored else load_cube(folder_path)
+    if cube is None and not stored:
         return None
-    files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
     
-    for f in files:
-        df = pd.read_csv(os.path.join(folder_path, f))
-        df['DATE_TIME'] = pd.to_datetime(df['DATE_TIME'])
-        
-        if date_filter:
-            df = df[df['DATE_TIME'].dt.date.astype(str).isin(date_filter)]
+    for segment in stored or cube['SEGMENT'].unique():
+        if stored:
+            hourly = series_store.hourly_profile(folder_path, segment, value='mean', dates=date_filter or None)
+            if hourly is None: continue
+        else:
+            rows = select(cube, segment=segment, dates=date_filter or None)
             
-        if df.empty: continue
+            if rows.empty: continue
             
-        hourly = df.groupby(df['DATE_TIME'].dt.hour)['NUMBER_OF_VEHICLES'].mean()
-        hourly = hourly.reindex(range(24), fill_value=0)
+            hourly = hourly_profile(rows, value='mean')
         
         if normalize:
             scaler = MinMaxScaler()
-            data = scaler.fit_transform(hourly.values.reshape(-1, 1)).flatten()
+            data = scaler.fit_transform(hourly.reshape(-1, 1)).flatten()
         else:
-            data = hourly.values
+            data = hourly
             
         all_profiles.append(data)
     
@@ -65,13 +58,14 @@ def main():
 }
 
     # 1. EXTRACT DATA
-    sig_norm = {'Baseline': get_aggregate_profile(BASELINE_FOLDER, normalize=True)}
-    sig_raw = {'Baseline': get_aggregate_profile(BASELINE_FOLDER, normalize=False)}
+    with stage('season profiles'):
+        sig_norm = {'Baseline': get_aggregate_profile(BASELINE_FOLDER, normalize=True)}
+        sig_raw = {'Baseline': get_aggregate_profile(BASELINE_FOLDER, normalize=False)}
 
-    for name, dates in holiday_targets.items():
-        print(f"Processing {name}...")
-        sig_norm[name] = get_aggregate_profile(HOLIDAY_FOLDER, date_filter=dates, normalize=True)
-        sig_raw[name] = get_aggregate_profile(HOLIDAY_FOLDER, date_filter=dates, normalize=False)
+        for name, dates in holiday_targets.items():
+            print(f"Processing {name}...")
+            sig_norm[name] = get_aggregate_profile(HOLIDAY_FOLDER, date_filter=dates, normalize=True)
+            sig_raw[name] = get_aggregate_profile(HOLIDAY_FOLDER, date_filter=dates, normalize=False)
 
     labels = [k for k, v in sig_norm.items() if v is not None]
     colors = ['red', 'blue', 'green']
@@ -106,10 +100,9 @@ def main():
 
     # --- PLOT 3: DTW DISTANCE MATRIX ---
     n = len(labels)
-    dist_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            dist_matrix[i, j] = simple_dtw_distance(sig_norm[labels[i]], sig_norm[labels[j]])
+    with stage('season dtw', profiles=n):
+        condensed = pairwise_dtw(np.stack([sig_norm[label] for label in labels]))
+    dist_matrix = to_square_matrix(condensed, n)
     plt.figure(figsize=(9, 7))
     sns.heatmap(dist_matrix, annot=True, fmt=".2f", cmap="YlOrRd", xticklabels=labels, yticklabels=labels)
     plt.title("Analysis 3: Behavioral Similarity Matrix (DTW Score)", fontsize=14)
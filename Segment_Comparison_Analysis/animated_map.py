@@ -0,0 +1,317 @@
+# Time-sliced traffic map: one frame per hour (or day) with a slider and play button.
+# Frames come from a cell x hour aggregate, which is stored next to the raw cache (one
+# Parquet file per day, keyed by the raw file's fingerprint and the frequency), so a
+# day of a month is only aggregated once. Frames are delta-encoded: every
+# KEYFRAME_EVERY frames the full state is stored, in between only the cells whose
+# (rounded) speed or vehicle count changed. The page decodes the frames itself and
+# recolors one canvas marker per cell, so a week of hourly frames for the whole
+# grid stays a single HTML file of a few MB.
+
+import pandas as pd
+import numpy as np
+import os
+import json
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+from pandas.tseries.frequencies import to_offset
+from raw_cache import iter_chunks, cache_path_for, SOURCE_MARKER, pa
+from manifest import fingerprint
+from grid_filter import chunk_cell_ids
+from instrument import stage
+
+KEYFRAME_EVERY = 24         # Full state once per day of hourly frames, allows seeking
+SPEED_STEP = 1              # km/h, speeds are rounded to this before encoding
+VEHICLE_STEP = 1
+MISSING = -1                # Encoded value of a cell without data in a frame
+OUTPUT_FILE = 'maps/hourly_traffic.html'
+AGGREGATE_MARKER = '_aggregate.json'
+
+
+def _partial_aggregate(df, freq):
+    time = pd.to_datetime(df['DATE_TIME']).dt.floor(freq)
+    part = pd.DataFrame({
+        'TIME': time.to_numpy(),
+        'CELL': chunk_cell_ids(df),
+        'LATITUDE': df['LATITUDE'].to_numpy(dtype=np.float64),
+        'LONGITUDE': df['LONGITUDE'].to_numpy(dtype=np.float64),
+        'SPEED_SUM': df['AVERAGE_SPEED'].to_numpy(dtype=np.float64),
+        'VEH_SUM': df['NUMBER_OF_VEHICLES'].to_numpy(dtype=np.float64),
+    })
+    return part.groupby(['TIME', 'CELL']).agg(
+        LATITUDE=('LATITUDE', 'first'), LONGITUDE=('LONGITUDE', 'first'),
+        SPEED_SUM=('SPEED_SUM', 'sum'), VEH_SUM=('VEH_SUM', 'sum'),
+        COUNT=('SPEED_SUM', 'count'),
+    )
+
+def _finish_aggregate(parts):
+    if len(parts) > 1:
+        merged = pd.concat(parts).groupby(level=[0, 1]).agg(
+            LATITUDE=('LATITUDE', 'first'), LONGITUDE=('LONGITUDE', 'first'),
+            SPEED_SUM=('SPEED_SUM', 'sum'), VEH_SUM=('VEH_SUM', 'sum'),
+            COUNT=('COUNT', 'sum'),
+        )
+    else:
+        merged = parts[0]
+    merged['AVG_SPEED'] = merged['SPEED_SUM'] / merged['COUNT']
+    merged['AVG_VEHICLES'] = merged['VEH_SUM'] / merged['COUNT']
+    return merged.reset_index()[['TIME', 'CELL', 'LATITUDE', 'LONGITUDE', 'AVG_SPEED', 'AVG_VEHICLES']]
+
+def cell_time_aggregate(df, freq='h'):
+    """Average speed and vehicle count per (time slot, cell) of a traffic frame."""
+    return _finish_aggregate([_partial_aggregate(df, freq)])
+
+def aggregate_file(input_csv, dates=None, freq='h', chunk_size=100000):
+    """Same as cell_time_aggregate for a whole raw file (optionally only some days), read in chunks."""
+    columns = ['DATE_TIME', 'LATITUDE', 'LONGITUDE', 'AVERAGE_SPEED', 'NUMBER_OF_VEHICLES']
+    parts = [_partial_aggregate(chunk, freq)
+             for chunk in iter_chunks(input_csv, chunk_size=chunk_size, columns=columns, dates=dates)]
+    if not parts:
+        return None
+    return _finish_aggregate(parts)
+
+def aggregate_path(input_csv, freq='h'):
+    return cache_path_for(input_csv) + f'_cells_{freq}'
+
+def _source_key(input_csv):
+    """Fingerprint of the raw file, or of its Parquet cache once the CSV is gone."""
+    key = fingerprint(input_csv)
+    if key is None:
+        marker_path = os.path.join(cache_path_for(input_csv), SOURCE_MARKER)
+        if os.path.exists(marker_path):
+            with open(marker_path) as f:
+                key = json.load(f)
+    return key
+
+def load_aggregate(input_csv, dates=None, freq='h'):
+    """
+    aggregate_file() through the stored per-day aggregate: only days not stored
+    yet are read from the raw file. Frequencies that do not divide a day (e.g. '2D')
+    and setups without pyarrow are aggregated directly.
+    """
+    source = _source_key(input_csv)
+    if pa is None or source is None or pd.Timedelta(days=1).value % to_offset(freq).nanos:
+        return aggregate_file(input_csv, dates=dates, freq=freq)
+
+    folder = aggregate_path(input_csv, freq)
+    marker_path = os.path.join(folder, AGGREGATE_MARKER)
+    marker = None
+    if os.path.exists(marker_path):
+        with open(marker_path) as f:
+            marker = json.load(f)
+    if marker is None or marker['source'] != source or marker['freq'] != freq:
+        # New or changed raw file, start over
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+        marker = {'source': source, 'freq': freq, 'days': [], 'complete': False}
+
+    known = set(marker['days'])
+    if dates is None:
+        missing = None if not marker['complete'] else []
+    else:
+        missing = sorted(set(dates) - known)
+
+    if missing is None or missing:
+        print(f"Aggregating {input_csv} per cell ({'all days' if missing is None else f'{len(missing)} days'})")
+        computed = aggregate_file(input_csv, dates=missing, freq=freq)
+        os.makedirs(folder, exist_ok=True)
+        if computed is not None:
+            day_of = computed['TIME'].dt.strftime('%Y-%m-%d')
+            for day, part in computed.groupby(day_of):
+                part.to_parquet(os.path.join(folder, f'{day}.parquet'), index=False)
+                known.add(day)
+        # Requested days without rows are remembered as well, they have no file
+        known |= set(missing or [])
+        marker['days'] = sorted(known)
+        marker['complete'] = marker['complete'] or missing is None
+        with open(marker_path + '.tmp', 'w') as f:
+            json.dump(marker, f, indent=2)
+        os.replace(marker_path + '.tmp', marker_path)
+
+    wanted = sorted(known) if dates is None else sorted(set(dates))
+    paths = [os.path.join(folder, f'{day}.parquet') for day in wanted]
+    parts = [pd.read_parquet(path) for path in paths if os.path.exists(path)]
+    if not parts:
+        return None
+    return pd.concat(parts, ignore_index=True)
+
+def _quantize(values, step):
+    return np.where(np.isnan(values), MISSING, np.round(values / step) * step).astype(np.int64)
+
+def encode_frames(aggregate, keyframe_every=KEYFRAME_EVERY, speed_step=SPEED_STEP, vehicle_step=VEHICLE_STEP):
+    """
+    Delta-encodes a cell x time aggregate.
+    Returns a dict with the frame times, the cell coordinates, the speed range
+    over all frames (for the marker radius) and one entry per frame: keyframes
+    hold the full speed and vehicle arrays ('s', 'v'), other frames a flat list
+    'd' of [index gap, speed change, vehicle change] for every cell that changed
+    since the previous frame.
+    """
+    times, time_index = np.unique(aggregate['TIME'].to_numpy(), return_inverse=True)
+    cells, first_row, cell_index = np.unique(aggregate['CELL'].to_numpy(), return_index=True, return_inverse=True)
+
+    # Dense time x cell matrices, NaN where a cell has no data in a slot
+    shape = (len(times), len(cells))
+    speed = np.full(shape, np.nan)
+    vehicles = np.full(shape, np.nan)
+    speed[time_index, cell_index] = aggregate['AVG_SPEED'].to_numpy()
+    vehicles[time_index, cell_index] = aggregate['AVG_VEHICLES'].to_numpy()
+    speed = _quantize(speed, speed_step)
+    vehicles = _quantize(vehicles, vehicle_step)
+    # Delta frames may go outside the keyframes' range, the scale covers every frame
+    present = speed[speed != MISSING]
+    speed_range = [int(present.min()), int(present.max())] if len(present) else [0, 0]
+
+    frames = []
+    for t in range(len(times)):
+        if t % keyframe_every == 0:
+            frames.append({'s': speed[t].tolist(), 'v': vehicles[t].tolist()})
+            continue
+
+        changed = np.flatnonzero((speed[t] != speed[t-1]) | (vehicles[t] != vehicles[t-1]))
+        gaps = np.diff(changed, prepend=-1)
+        deltas = np.column_stack([gaps, speed[t, changed] - speed[t-1, changed],
+                                  vehicles[t, changed] - vehicles[t-1, changed]])
+        frames.append({'d': deltas.ravel().tolist()})
+
+    return {
+        'times': pd.DatetimeIndex(times).strftime('%Y-%m-%d %H:%M').tolist(),
+        'lats': np.round(aggregate['LATITUDE'].to_numpy()[first_row], 6).tolist(),
+        'lons': np.round(aggregate['LONGITUDE'].to_numpy()[first_row], 6).tolist(),
+        'keyframe_every': keyframe_every,
+        'missing': MISSING,
+        'speed_range': speed_range,
+        'frames': frames,
+    }
+
+class TimeSliderLayer(MacroElement):
+    """Canvas circle markers per cell with a time slider that decodes the delta frames."""
+
+    _template = Template("""
+        {% macro html(this, kwargs) %}
+        <div id="{{ this.get_name() }}" style="position: fixed; bottom: 20px; left: 50%;
+             transform: translateX(-50%); z-index: 9999; background: white; padding: 8px 12px;
+             border: 2px solid grey; border-radius: 5px; font-size: 14px; width: 60%;">
+            <button type="button">&#9654;</button>
+            <input type="range" min="0" max="0" value="0" style="width: 70%; vertical-align: middle;">
+            <span></span>
+        </div>
+        {% endmacro %}
+
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var data = {{ this.data_json }};
+            var radiusRange = {{ this.radius_range }};
+            var n = data.lats.length;
+            var renderer = L.canvas();
+            var speed = new Array(n), vehicles = new Array(n), decoded = -1;
+            function tooltip(i) {
+                // Evaluated when the tooltip opens, always shows the current frame
+                return function() { return 'Speed: ' + speed[i] + ' km/h<br>Vehicles: ' + vehicles[i]; };
+            }
+            var markers = [];
+            for (var i = 0; i < n; i++) {
+                markers.push(L.circleMarker([data.lats[i], data.lons[i]], {
+                    renderer: renderer, radius: radiusRange[0], color: 'black', weight: 1, fillOpacity: 0.8
+                }).bindTooltip(tooltip(i)).addTo(map));
+            }
+
+            function decode(frame) {
+                // Start from the last keyframe unless we are stepping forward from the current frame
+                var start = frame - frame % data.keyframe_every;
+                if (decoded < start || decoded > frame) {
+                    speed = data.frames[start].s.slice();
+                    vehicles = data.frames[start].v.slice();
+                    decoded = start;
+                }
+                for (var f = decoded + 1; f <= frame; f++) {
+                    var d = data.frames[f].d, idx = -1;
+                    for (var k = 0; k < d.length; k += 3) {
+                        idx += d[k];
+                        speed[idx] += d[k+1];
+                        vehicles[idx] += d[k+2];
+                    }
+                }
+                decoded = frame;
+            }
+
+            // Radius scale over all frames, like the static map's min/max over all cells
+            var minSpeed = data.speed_range[0], maxSpeed = data.speed_range[1];
+
+            function color(s) { return s < 30 ? 'red' : s < 50 ? 'orange' : s < 70 ? 'yellow' : 'green'; }
+            function radius(s) {
+                if (maxSpeed === minSpeed) { return radiusRange[0]; }
+                return radiusRange[0] + (1 - (s - minSpeed) / (maxSpeed - minSpeed)) * (radiusRange[1] - radiusRange[0]);
+            }
+
+            var box = document.getElementById('{{ this.get_name() }}');
+            var slider = box.querySelector('input'), label = box.querySelector('span'), button = box.querySelector('button');
+            slider.max = data.frames.length - 1;
+
+            function show(frame) {
+                decode(frame);
+                for (var i = 0; i < n; i++) {
+                    var s = speed[i];
+                    if (s === data.missing) {
+                        markers[i].setStyle({opacity: 0, fillOpacity: 0});
+                        continue;
+                    }
+                    markers[i].setStyle({opacity: 1, fillOpacity: 0.8, fillColor: color(s)});
+                    markers[i].setRadius(Math.min(Math.max(radius(s), radiusRange[0]), radiusRange[1]));
+                }
+                label.textContent = data.times[frame];
+            }
+
+            var timer = null;
+            slider.addEventListener('input', function() { show(+slider.value); });
+            button.addEventListener('click', function() {
+                if (timer) { clearInterval(timer); timer = null; button.innerHTML = '&#9654;'; return; }
+                button.innerHTML = '&#10074;&#10074;';
+                timer = setInterval(function() {
+                    slider.value = (+slider.value + 1) % data.frames.length;
+                    show(+slider.value);
+                }, {{ this.interval_ms }});
+            });
+            show(0);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, encoded, radius_range=(4, 10), interval_ms=500):
+        super().__init__()
+        self._name = 'TimeSliderLayer'
+        self.data_json = json.dumps(encoded, separators=(',', ':'))
+        self.radius_range = json.dumps(list(radius_range))
+        self.interval_ms = interval_ms
+
+def add_time_slider(m, aggregate, radius_range=(4, 10), keyframe_every=KEYFRAME_EVERY):
+    """Encodes a cell x time aggregate and adds the animated layer to m."""
+    encoded = encode_frames(aggregate, keyframe_every)
+    layer = TimeSliderLayer(encoded, radius_range)
+    print(f"  {len(encoded['frames'])} frames x {len(encoded['lats']):,} cells, "
+          f"{len(layer.data_json) / 1e6:.1f} MB encoded")
+    layer.add_to(m)
+    return encoded
+
+@stage('map animated')
+def create_animated_grid_map(input_csv, dates=None, freq='h', output_file=OUTPUT_FILE, zoom_start=11):
+    """Animated map of every cell in a raw file, optionally limited to some days ('YYYY-MM-DD')."""
+    aggregate = load_aggregate(input_csv, dates=dates, freq=freq)
+    if aggregate is None:
+        print(f"No data in {input_csv}")
+        return None
+
+    center = [aggregate['LATITUDE'].mean(), aggregate['LONGITUDE'].mean()]
+    m = folium.Map(location=center, zoom_start=zoom_start, tiles='OpenStreetMap', prefer_canvas=True)
+    add_time_slider(m, aggregate, radius_range=(3, 8))
+
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    m.save(output_file)
+    print(f"Saved {output_file}")
+    return m
+
+if __name__ == '__main__':
+    # One week (Monday to Sunday) of hourly frames for the whole grid
+    create_animated_grid_map('raw_data/September.csv', dates=[f'2024-09-{day:02d}' for day in range(2, 9)])
@@ -0,0 +1,199 @@
+# Finds unusual days (holidays, closures, events) without listing them by hand.
+# Every (segment, day) hourly volume profile from the profile cube is compared with a
+# rolling baseline: the hour-by-hour median of the same segment's previous
+# BASELINE_DAYS days of the same kind (weekday or weekend). A day scores
+#   SHAPE_DTW: DTW distance between the min-max scaled day and baseline (rhythm change,
+#              like Analysis 3 in Season_Comparison/compare.py)
+#   VOLUME_RATIO: day total / baseline total (load change, like Analysis 4)
+#   SCORE = SHAPE_DTW + VOLUME_WEIGHT * |ln VOLUME_RATIO|
+# An hour without records had no traffic, so days with up to MAX_MISSING_HOURS empty
+# hours are scored with 0 vehicles in them; a segment's most recent day waits until
+# its last hour is in (it may still be filling up).
+# Scores are added to SCORES_FILENAME in the data folder and the last scored day of
+# each segment is kept in STATE_FILENAME, so a run only scores the days added since.
+
+import pandas as pd
+import numpy as np
+import os
+import json
+from profile_cube import load_cube, day_tensor, minmax_scale
+from dtw import batched_distances
+from instrument import stage
+
+DATA_FOLDER = 'weighted_data'
+SCORES_FILENAME = '_anomaly_scores.csv'
+STATE_FILENAME = '_anomaly_state.json'
+
+BASELINE_DAYS = 28          # Calendar days looked back for the baseline
+MIN_BASELINE_DAYS = 4       # Days of the same kind needed before a day is scored
+VOLUME_WEIGHT = 4.0         # Weight of |ln volume ratio| against the DTW shape distance
+DTW_WINDOW = 3              # Sakoe-Chiba band in hours, rush hours may shift a little
+MAX_MISSING_HOURS = 6       # Empty hours a day may have before it is left out
+SCORE_COLUMNS = ['SEGMENT', 'DATE', 'SHAPE_DTW', 'VOLUME_RATIO', 'SCORE', 'BASELINE_DAYS']
+
+
+def settings():
+    """Everything the scores depend on; a change rescores all days."""
+    return {'baseline_days': BASELINE_DAYS, 'min_baseline_days': MIN_BASELINE_DAYS,
+            'volume_weight': VOLUME_WEIGHT, 'dtw_window': DTW_WINDOW,
+            'max_missing_hours': MAX_MISSING_HOURS}
+
+def score_days(cube, since=None, segments=None):
+    """
+    Scores the days of every segment after since[segment] ('YYYY-MM-DD', all days
+    if missing). Empty hours count as 0 vehicles; days with more than
+    MAX_MISSING_HOURS of them are skipped. The segment's most recent day is left
+    for a later run until its last hour has records.
+    Returns (scores DataFrame, {segment: last processed date}).
+    """
+    since = since or {}
+    rows = cube
+    if since and segments is None and all(seg in since for seg in cube['SEGMENT'].unique()):
+        # Only the days to score and the baseline window before them are needed
+        earliest = pd.Timestamp(min(since.values())) - pd.Timedelta(days=BASELINE_DAYS)
+        rows = cube[(cube['DATE'] > earliest).to_numpy()]
+    if rows.empty:
+        return pd.DataFrame(columns=SCORE_COLUMNS), {}
+
+    tensor, names, days = day_tensor(rows, value='VEH_SUM', segments=segments)
+    weekend = days.dayofweek.to_numpy() >= 5
+    missing = np.isnan(tensor)
+    complete = missing.sum(axis=2) <= MAX_MISSING_HOURS
+    has_data = ~missing.all(axis=2)
+    tensor = np.where(missing, 0.0, tensor)
+    window = pd.Timedelta(days=BASELINE_DAYS)
+
+    pair_segment, pair_day, baselines, baseline_counts = [], [], [], []
+    processed = {}
+
+    for s, name in enumerate(names):
+        if not has_data[s].any():
+            continue
+        last_day = np.flatnonzero(has_data[s])[-1]
+        start = pd.Timestamp(since[name]) if name in since else None
+
+        for d in np.flatnonzero(has_data[s]):
+            if start is not None and days[d] <= start:
+                continue
+            if d == last_day and missing[s, d, -1]:
+                break
+            if not complete[s, d]:
+                processed[name] = days[d]
+                continue
+            processed[name] = days[d]
+
+            history = (days >= days[d] - window) & (days < days[d])
+            history &= (weekend == weekend[d]) & complete[s]
+            if history.sum() < MIN_BASELINE_DAYS:
+                continue
+
+            pair_segment.append(s)
+            pair_day.append(d)
+            baselines.append(np.median(tensor[s, history], axis=0))
+            baseline_counts.append(int(history.sum()))
+
+    processed = {name: f"{date:%Y-%m-%d}" for name, date in processed.items()}
+    if not pair_segment:
+        return pd.DataFrame(columns=SCORE_COLUMNS), processed
+
+    profiles = tensor[pair_segment, pair_day]
+    baselines = np.array(baselines)
+    shape = batched_distances(minmax_scale(profiles), minmax_scale(baselines), window=DTW_WINDOW)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = profiles.sum(axis=1) / baselines.sum(axis=1)
+        log_ratio = np.abs(np.log(ratio))
+    # A day with traffic against an empty baseline (or the reverse) is as unusual as it gets
+    log_ratio[~np.isfinite(log_ratio)] = np.log(10.0)
+
+    scores = pd.DataFrame({
+        'SEGMENT': [names[s] for s in pair_segment],
+        'DATE': days[pair_day].strftime('%Y-%m-%d'),
+        'SHAPE_DTW': shape.round(4),
+        'VOLUME_RATIO': ratio.round(4),
+        'SCORE': (shape + VOLUME_WEIGHT * log_ratio).round(4),
+        'BASELINE_DAYS': baseline_counts,
+    })
+    return scores, processed
+
+def _load_state(folder):
+    path = os.path.join(folder, STATE_FILENAME)
+    scores_path = os.path.join(folder, SCORES_FILENAME)
+    if not (os.path.exists(path) and os.path.exists(scores_path)):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return state if state.get('settings') == settings() else None
+
+def _save_state(folder, state):
+    path = os.path.join(folder, STATE_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def update_scores(folder=DATA_FOLDER, cube=None):
+    """
+    Scores the days added to the folder's profile cube since the last run and
+    appends them to the scores file. Returns the new scores.
+    """
+    if cube is None:
+        cube = load_cube(folder)
+    if cube is None:
+        return None
+
+    state = _load_state(folder)
+    scores_path = os.path.join(folder, SCORES_FILENAME)
+    if state is None:
+        print("Scoring all days from scratch")
+        state = {'settings': settings(), 'scored_through': {}}
+        if os.path.exists(scores_path):
+            os.remove(scores_path)
+
+    with stage('anomaly scores', folder=folder) as s:
+        scores, processed = score_days(cube, since=state['scored_through'])
+        s.count(rows_in=len(processed), rows_out=len(scores))
+
+    if len(scores):
+        # Rewritten whole and swapped in; days scored again after a crash between
+        # this and the state update replace their earlier rows
+        all_scores = pd.concat([load_scores(folder), scores], ignore_index=True)
+        all_scores = all_scores.drop_duplicates(['SEGMENT', 'DATE'], keep='last')
+        all_scores.to_csv(scores_path + '.tmp', index=False)
+        os.replace(scores_path + '.tmp', scores_path)
+    state['scored_through'].update(processed)
+    _save_state(folder, state)
+    print(f"Scored {len(scores):,} new segment days in {folder}")
+    return scores
+
+def load_scores(folder=DATA_FOLDER):
+    path = os.path.join(folder, SCORES_FILENAME)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    return pd.read_csv(path).drop_duplicates(['SEGMENT', 'DATE'], keep='last', ignore_index=True)
+
+def top_anomalies(folder=DATA_FOLDER, n=20, since=None):
+    """The n highest scoring segment days, optionally only from since ('YYYY-MM-DD') on."""
+    scores = load_scores(folder)
+    if since is not None:
+        scores = scores[scores['DATE'] >= since]
+    return scores.sort_values('SCORE', ascending=False).head(n).reset_index(drop=True)
+
+def anomalous_dates(folder=DATA_FOLDER, min_segments=3, threshold=None):
+    """
+    Dates that are unusual on many segments at once (city-wide events such as holidays).
+    threshold defaults to the 95th percentile of all scores. Returns a Series
+    date -> number of segments above it, largest first.
+    """
+    scores = load_scores(folder)
+    if scores.empty:
+        return pd.Series(dtype=np.int64)
+    if threshold is None:
+        threshold = scores['SCORE'].quantile(0.95)
+    counts = scores[scores['SCORE'] > threshold].groupby('DATE').size()
+    return counts[counts >= min_segments].sort_values(ascending=False)
+
+if __name__ == '__main__':
+    update_scores(DATA_FOLDER)
+    print("\n--- Top anomalous segment days ---")
+    print(top_anomalies(DATA_FOLDER).to_string(index=False))
+    print("\n--- Dates unusual on several segments ---")
+    print(anomalous_dates(DATA_FOLDER).to_string())
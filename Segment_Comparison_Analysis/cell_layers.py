@@ -0,0 +1,105 @@
+# Vectorized GeoJSON layers for the folium maps.
+# Grid cells are built as one FeatureCollection from NumPy arrays and added to the
+# map as a single layer, instead of one folium.Polygon / CircleMarker object (and
+# one block of generated JavaScript) per cell.
+
+import numpy as np
+import folium
+
+# IBB grid spacing, used when there are too few cells to measure it
+DEFAULT_LAT_SPACING = 0.0054931641
+DEFAULT_LON_SPACING = 0.0109863281
+
+
+def _median_step(values):
+    diffs = np.diff(np.unique(values))
+    diffs = diffs[diffs > 0]
+    return float(np.median(diffs)) if len(diffs) else None
+
+def grid_spacing(lats, lons):
+    """(lat_spacing, lon_spacing) of a set of cell centers, the IBB default if unknown."""
+    lat_spacing = _median_step(np.asarray(lats, dtype=np.float64))
+    lon_spacing = _median_step(np.asarray(lons, dtype=np.float64))
+    if lat_spacing is None or lon_spacing is None:
+        return DEFAULT_LAT_SPACING, DEFAULT_LON_SPACING
+    return lat_spacing, lon_spacing
+
+def unique_cells(lats, lons):
+    """Unique (lat, lon) cell centers as two float64 arrays, sorted by lat then lon."""
+    points = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)])
+    points = np.unique(points, axis=0)
+    return points[:, 0], points[:, 1]
+
+def _feature_properties(n, properties):
+    if not properties:
+        return [{} for _ in range(n)]
+    names = list(properties)
+    columns = [np.asarray(properties[name]).tolist() for name in names]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+def cell_polygons(lats, lons, lat_half, lon_half, properties=None):
+    """
+    FeatureCollection with one square Polygon per cell center.
+    properties: optional {name: array} with one value per cell.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    # Closed ring of 5 corners per cell, GeoJSON wants [lon, lat]
+    lat_offsets = np.array([-1, -1, 1, 1, -1]) * lat_half
+    lon_offsets = np.array([-1, 1, 1, -1, -1]) * lon_half
+    rings = np.stack([lons[:, None] + lon_offsets, lats[:, None] + lat_offsets], axis=-1)
+
+    features = [
+        {'type': 'Feature', 'properties': props, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+        for ring, props in zip(rings.tolist(), _feature_properties(len(lats), properties))
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def cell_points(lats, lons, properties=None):
+    """FeatureCollection with one Point per cell center."""
+    coords = np.column_stack([np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64)])
+
+    features = [
+        {'type': 'Feature', 'properties': props, 'geometry': {'type': 'Point', 'coordinates': point}}
+        for point, props in zip(coords.tolist(), _feature_properties(len(coords), properties))
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def _tooltip(fields, aliases):
+    if not fields:
+        return None
+    return folium.GeoJsonTooltip(fields=fields, aliases=aliases or fields)
+
+def add_polygon_layer(m, collection, style, tooltip_fields=None, tooltip_aliases=None, name=None):
+    """Adds a polygon FeatureCollection as one layer with a shared style dict."""
+    folium.GeoJson(
+        collection,
+        name=name,
+        style_function=lambda feature: style,
+        tooltip=_tooltip(tooltip_fields, tooltip_aliases),
+    ).add_to(m)
+
+def add_point_layer(m, collection, style, tooltip_fields=None, tooltip_aliases=None,
+                    popup_fields=None, popup_aliases=None, name=None):
+    """
+    Adds a point FeatureCollection as one layer of circle markers.
+    Per-feature 'radius' and 'fillColor' properties override the shared style
+    (folium emits one style case per distinct style, so keep them coarse).
+    """
+    def style_function(feature):
+        props = feature['properties']
+        return {'fill': True, **style, **{key: props[key] for key in ('radius', 'fillColor') if key in props}}
+
+    popup = None
+    if popup_fields:
+        popup = folium.GeoJsonPopup(fields=popup_fields, aliases=popup_aliases or popup_fields)
+
+    folium.GeoJson(
+        collection,
+        name=name,
+        marker=folium.CircleMarker(),
+        style_function=style_function,
+        tooltip=_tooltip(tooltip_fields, tooltip_aliases),
+        popup=popup,
+    ).add_to(m)
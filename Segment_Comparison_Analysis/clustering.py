@@ -0,0 +1,248 @@
+# Clustering straight on DTW distances, for anything from the named segments to every
+# cell of the city grid. k-medoids works on the condensed distance vector of
+# dtw.pairwise_dtw (no N x N matrix, no 2-D projection), and k can be picked by the
+# silhouette score over a range of k, with each k tried in its own worker process.
+# The condensed vector grows with N^2 (50k grid cells would need ~10 GB), so above
+# MAX_EXACT_ITEMS profiles cluster_profiles switches to CLARA: k-medoids on random
+# samples, every profile assigned to the nearest medoid of the best sample.
+
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dtw import pairwise_dtw, batched_distances
+
+K_RANGE = range(2, 11)
+BLOCK_ROWS = 1024           # Rows of the distance matrix expanded at a time
+MAX_EXACT_ITEMS = 5000      # Condensed vector of ~100 MB, larger inputs are sampled
+SAMPLE_ITEMS = 1000         # Profiles per CLARA sample
+N_SAMPLES = 5
+
+
+def n_items(condensed):
+    """N of a condensed vector of N * (N - 1) / 2 distances."""
+    n = int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+    if n * (n - 1) // 2 != len(condensed):
+        raise ValueError(f"{len(condensed)} is not the length of a condensed distance vector")
+    return n
+
+def distance_block(condensed, n, rows, cols=None):
+    """
+    Rows x cols block of the square distance matrix, read from the condensed
+    vector (scipy pdist order). cols defaults to all N items.
+    """
+    rows = np.asarray(rows, dtype=np.int64)[:, None]
+    cols = np.arange(n, dtype=np.int64) if cols is None else np.asarray(cols, dtype=np.int64)
+    low = np.minimum(rows, cols)
+    high = np.maximum(rows, cols)
+    diagonal = low == high
+    index = n * low - low * (low + 1) // 2 + high - low - 1
+    block = condensed[np.where(diagonal, 0, index)]
+    block[diagonal] = 0.0
+    return block
+
+def _blocks(n, block_rows=BLOCK_ROWS):
+    for start in range(0, n, block_rows):
+        yield np.arange(start, min(start + block_rows, n))
+
+def _init_medoids(condensed, n, k, rng):
+    """k-medoids++: later medoids are drawn with probability proportional to the squared distance."""
+    medoids = [int(rng.integers(n))]
+    nearest = distance_block(condensed, n, medoids)[0]
+    for _ in range(1, k):
+        weights = nearest ** 2
+        total = weights.sum()
+        if total == 0:
+            # Fewer distinct profiles than k, fill with unused items
+            candidate = int(np.setdiff1d(np.arange(n), medoids)[0])
+        else:
+            candidate = int(rng.choice(n, p=weights / total))
+        medoids.append(candidate)
+        nearest = np.minimum(nearest, distance_block(condensed, n, [candidate])[0])
+    return np.array(medoids)
+
+def _best_member(condensed, n, members):
+    """Member with the smallest sum of distances to the other members."""
+    costs = np.empty(len(members))
+    for block in _blocks(len(members)):
+        costs[block] = distance_block(condensed, n, members[block], members).sum(axis=1)
+    return members[np.argmin(costs)]
+
+def kmedoids(condensed, k, n_init=4, max_iter=100, seed=0):
+    """
+    k-medoids (alternating assignment / medoid update) on a condensed distance vector.
+    The best of n_init k-medoids++ starts is kept.
+    Returns (labels, medoid indices, total distance of the items to their medoid).
+    """
+    condensed = np.asarray(condensed, dtype=np.float64)
+    n = n_items(condensed)
+    if not 1 <= k <= n:
+        raise ValueError(f"k={k} needs 1 to {n} items")
+    rng = np.random.default_rng(seed)
+    best = None
+
+    for _ in range(n_init):
+        medoids = _init_medoids(condensed, n, k, rng)
+        for _ in range(max_iter):
+            labels = distance_block(condensed, n, medoids).argmin(axis=0)
+            # Each medoid belongs to its own cluster, even when duplicates tie
+            labels[medoids] = np.arange(k)
+            updated = medoids.copy()
+            for c in range(k):
+                updated[c] = _best_member(condensed, n, np.flatnonzero(labels == c))
+            if np.array_equal(updated, medoids):
+                break
+            medoids = updated
+
+        to_medoids = distance_block(condensed, n, medoids)
+        labels = to_medoids.argmin(axis=0)
+        labels[medoids] = np.arange(k)
+        cost = float(to_medoids[labels, np.arange(n)].sum())
+        if best is None or cost < best[2]:
+            best = (labels, medoids, cost)
+
+    return best
+
+def silhouette(condensed, labels):
+    """Mean silhouette coefficient of a labelling, from a condensed distance vector."""
+    condensed = np.asarray(condensed, dtype=np.float64)
+    labels = np.asarray(labels)
+    n = len(labels)
+    k = labels.max() + 1
+    counts = np.bincount(labels, minlength=k)
+    if k < 2 or k >= n:
+        raise ValueError(f"silhouette needs 2 to {n - 1} clusters, got {k}")
+
+    # Sum of distances from every item to every cluster, one block of rows at a time
+    onehot = np.zeros((n, k))
+    onehot[np.arange(n), labels] = 1.0
+    sums = np.empty((n, k))
+    for block in _blocks(n):
+        sums[block] = distance_block(condensed, n, block) @ onehot
+
+    own = counts[labels]
+    a = sums[np.arange(n), labels] / np.maximum(own - 1, 1)
+    others = sums / np.maximum(counts, 1)
+    others[np.arange(n), labels] = np.inf
+    others[:, counts == 0] = np.inf
+    b = others.min(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = (b - a) / np.maximum(a, b)
+    # Items alone in their cluster score 0, as in scikit-learn
+    scores[(own == 1) | ~np.isfinite(scores)] = 0.0
+    return float(scores.mean())
+
+# The distance vector is sent to each worker process once, work units only carry k
+_worker_condensed = None
+_worker_settings = None
+
+def _init_k_worker(condensed, settings):
+    global _worker_condensed, _worker_settings
+    _worker_condensed = condensed
+    _worker_settings = settings
+
+def _try_k(k):
+    labels, medoids, cost = kmedoids(_worker_condensed, k, **_worker_settings)
+    return k, labels, medoids, cost, silhouette(_worker_condensed, labels)
+
+def choose_k(condensed, k_range=K_RANGE, n_jobs=None, n_init=4, seed=0):
+    """
+    Runs k-medoids for every k in k_range (2 <= k < N) and keeps the k with the
+    best silhouette score.
+    Returns {'k', 'labels', 'medoids', 'cost', 'silhouette', 'scores': {k: silhouette}}.
+    With fewer than 3 items all of them form one cluster.
+    """
+    condensed = np.asarray(condensed, dtype=np.float64)
+    n = n_items(condensed)
+    ks = [k for k in k_range if 2 <= k < n]
+    if not ks:
+        labels, medoids, cost = kmedoids(condensed, 1, n_init=1, seed=seed)
+        return {'k': 1, 'labels': labels, 'medoids': medoids, 'cost': cost, 'silhouette': None, 'scores': {}}
+
+    settings = {'n_init': n_init, 'seed': seed}
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(ks))
+
+    if n_jobs == 1:
+        _init_k_worker(condensed, settings)
+        results = [_try_k(k) for k in ks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_k_worker,
+                                 initargs=(condensed, settings)) as pool:
+            results = list(pool.map(_try_k, ks))
+
+    k, labels, medoids, cost, score = max(results, key=lambda r: r[4])
+    return {'k': k, 'labels': labels, 'medoids': medoids, 'cost': cost, 'silhouette': score,
+            'scores': {r[0]: r[4] for r in results}}
+
+def assign_to_medoids(profiles, medoid_profiles, window=None, n_jobs=None):
+    """Label and DTW distance of the nearest medoid for every row of profiles."""
+    profiles = np.ascontiguousarray(profiles, dtype=np.float64)
+    distances = np.empty((len(medoid_profiles), len(profiles)))
+    for c, medoid in enumerate(np.asarray(medoid_profiles, dtype=np.float64)):
+        distances[c] = batched_distances(profiles, np.broadcast_to(medoid, profiles.shape),
+                                         window=window, n_jobs=n_jobs)
+    labels = distances.argmin(axis=0)
+    return labels, distances[labels, np.arange(len(profiles))]
+
+def clara(profiles, k=None, k_range=K_RANGE, window=None, n_jobs=None, seed=0,
+          sample_items=SAMPLE_ITEMS, n_samples=N_SAMPLES):
+    """
+    CLARA: k-medoids on n_samples random samples of the profiles (each one also
+    holding the best medoids so far), all profiles assigned to the nearest medoid,
+    the sample with the smallest total distance is kept. k=None picks k by
+    silhouette on the first sample. Same dict as cluster_profiles, with the
+    silhouette of the best sample and 'distances' None.
+    """
+    profiles = np.ascontiguousarray(profiles, dtype=np.float64)
+    n = len(profiles)
+    rng = np.random.default_rng(seed)
+    best, scores = None, {}
+
+    for _ in range(n_samples):
+        sample = rng.choice(n, size=min(sample_items, n), replace=False)
+        if best is not None:
+            sample = np.union1d(sample, best['medoids'])
+        condensed = pairwise_dtw(profiles[sample], window=window, n_jobs=n_jobs)
+        if k is None:
+            result = choose_k(condensed, k_range, n_jobs=n_jobs, seed=seed)
+            k, scores = result['k'], result['scores']
+            labels, medoids, score = result['labels'], result['medoids'], result['silhouette']
+        else:
+            labels, medoids, _ = kmedoids(condensed, k, seed=seed)
+            score = silhouette(condensed, labels) if 2 <= k < len(labels) else None
+
+        medoids = sample[medoids]
+        all_labels, to_medoid = assign_to_medoids(profiles, profiles[medoids], window, n_jobs)
+        all_labels[medoids] = np.arange(k)
+        cost = float(to_medoid.sum())
+        if best is None or cost < best['cost']:
+            best = {'k': k, 'labels': all_labels, 'medoids': medoids, 'cost': cost, 'silhouette': score,
+                    'scores': scores or {k: score}}
+
+    best['distances'] = None
+    return best
+
+def cluster_profiles(profiles, k=None, k_range=K_RANGE, window=None, n_jobs=None, seed=0):
+    """
+    Clusters the rows of a stacked (N, L) profile array by DTW distance.
+    k=None picks k by silhouette (see choose_k). Returns the choose_k dict plus
+    the condensed DTW distances under 'distances'. Above MAX_EXACT_ITEMS rows the
+    medoids come from samples (see clara) and 'distances' is None.
+    """
+    if len(profiles) > MAX_EXACT_ITEMS:
+        print(f"{len(profiles):,} profiles, too many for all pairwise distances: "
+              f"sampling {N_SAMPLES} x {SAMPLE_ITEMS:,} profiles (CLARA)")
+        return clara(profiles, k, k_range, window, n_jobs, seed)
+
+    condensed = pairwise_dtw(profiles, window=window, n_jobs=n_jobs)
+    if k is None:
+        result = choose_k(condensed, k_range, n_jobs=n_jobs, seed=seed)
+    else:
+        labels, medoids, cost = kmedoids(condensed, k, seed=seed)
+        score = silhouette(condensed, labels) if 2 <= k < len(labels) else None
+        result = {'k': k, 'labels': labels, 'medoids': medoids, 'cost': cost, 'silhouette': score,
+                  'scores': {k: score}}
+    result['distances'] = condensed
+    return result
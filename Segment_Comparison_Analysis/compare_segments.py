@@ -1,74 +1,137 @@
-## Compare road segments based on daily traffic volume profiles using DTW distance and MDS with K-Means clustering.
+## Compare road segments based on daily traffic volume profiles using DTW distance and k-medoids clustering.
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
-from sklearn.manifold import MDS
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+import sys
 from sklearn.preprocessing import MinMaxScaler
 from main import ROAD_SEGMENTS
+from dtw import pairwise_dtw, to_square_matrix, day_distances
+from clustering import choose_k, kmedoids, silhouette, cluster_profiles
+from animated_map import load_aggregate
+from profile_cube import load_cube, select, hourly_profile, day_tensor, minmax_scale
+import series_store
+from instrument import stage
 
 DATA_FOLDER = 'weighted_data'
-
-def simple_dtw_distance(s1, s2):
-
-    n, m = len(s1), len(s2)
-    dtw_matrix = np.zeros((n+1, m+1))
-    
-    # Initialize with infinity
-    dtw_matrix.fill(np.inf)
-    dtw_matrix[0, 0] = 0
-    
-    for i in range(1, n+1):
-        for j in range(1, m+1):
-            # Euclidean distance between points
-            cost = abs(s1[i-1] - s2[j-1])
-            
-            # Take the minimum of insertion, deletion, or match
-            last_min = min(dtw_matrix[i-1, j],    # Insertion
-                           dtw_matrix[i, j-1],    # Deletion
-                           dtw_matrix[i-1, j-1])  # Match
-            
-            dtw_matrix[i, j] = cost + last_min
-            
-    return dtw_matrix[n, m]
+DTW_WINDOW = None  # Sakoe-Chiba band in hours, None compares the full day
+CLUSTER_K = None   # Number of clusters, None picks the best silhouette in K_RANGE
+K_RANGE = range(2, 9)
+GRID_INPUT = 'raw_data/September.csv'
+GRID_CLUSTERS_FILE = 'maps/grid_clusters.csv'
 
 def get_daily_volume_profile(segment_key, mode='weekday'):
     segment = ROAD_SEGMENTS[segment_key]
     filename = segment['output_filename']
+    weekdays = range(5) if mode == 'weekday' else [5, 6]
     
-    # Prefer weighted data if it exists
-    weighted_path = os.path.join(DATA_FOLDER, f"weighted_{filename}")
-    original_path = os.path.join(DATA_FOLDER, filename)
+    # The weighting stage's series store is read without parsing, if there is one
+    if series_store.read_header(DATA_FOLDER, filename) is not None:
+        return series_store.hourly_profile(DATA_FOLDER, filename, weekdays=weekdays)
     
-    if os.path.exists(weighted_path):
-        path = weighted_path
-    elif os.path.exists(original_path):
-        path = original_path
-    else:
+    # Otherwise hourly aggregates come from the profile cube (weighted data preferred)
+    cube = load_cube(DATA_FOLDER)
+    
+    if cube is None or not (cube['SEGMENT'] == filename).any():
         print(f"Data not found for {segment['name']}")
         return None
-        
-    df = pd.read_csv(path)
-    df['DATE_TIME'] = pd.to_datetime(df['DATE_TIME'])
-    df['HOUR'] = df['DATE_TIME'].dt.hour
-    df['DAY_OF_WEEK'] = df['DATE_TIME'].dt.dayofweek
 
     # Separate Weekdays
-    if mode == 'weekday':
-        df = df[df['DAY_OF_WEEK'] < 5]
-    else:
-        df = df[df['DAY_OF_WEEK'] >= 5] 
-    if df.empty:
+    rows = select(cube, segment=filename, weekdays=weekdays)
+    if rows.empty:
         return None
     # Group and normalize
-    hourly_profile = df.groupby('HOUR')['NUMBER_OF_VEHICLES'].sum()
-    hourly_profile = hourly_profile.reindex(range(24), fill_value=0)
+    return hourly_profile(rows)
+
+def get_day_profiles(mode='weekday', normalize=True):
+    """
+    One profile per segment and day instead of one summed curve per segment.
+    Returns (segment x day x hour tensor, segment file names, dates), or None.
+    Hours without data are NaN; normalize=True min-max scales every day.
+    """
+    weekdays = range(5) if mode == 'weekday' else [5, 6]
+    if series_store.stored_segments(DATA_FOLDER):
+        tensor, segments, days = series_store.day_tensor(DATA_FOLDER, weekdays=weekdays)
+    else:
+        cube = load_cube(DATA_FOLDER)
+        if cube is None:
+            return None
+        tensor, segments, days = day_tensor(cube, weekdays=weekdays)
+    if normalize:
+        tensor = minmax_scale(tensor)
+    return tensor, segments, days
+
+def unusual_days(mode='weekday', top=3):
+    """Prints the days of each segment furthest (DTW) from the segment's median day."""
+    day_profiles = get_day_profiles(mode)
+    if day_profiles is None:
+        return None
+    tensor, segments, days = day_profiles
+    
+    with stage('compare days', segments=len(segments), days=len(days)) as s:
+        reference = np.nanmedian(tensor, axis=1)
+        distances = day_distances(tensor, reference, window=DTW_WINDOW)
+        s.count(rows_in=tensor.shape[0] * tensor.shape[1], rows_out=int(np.isfinite(distances).sum()))
     
-    return hourly_profile.values
+    names = {info['output_filename']: info['name'] for info in ROAD_SEGMENTS.values()}
+    print(f"\n--- Most unusual {mode}s (DTW to the median day) ---")
+    for i, segment in enumerate(segments):
+        finite = np.flatnonzero(np.isfinite(distances[i]))
+        worst = finite[np.argsort(distances[i, finite])[::-1][:top]]
+        listed = ', '.join(f"{days[d]:%Y-%m-%d} ({distances[i, d]:.2f})" for d in worst)
+        print(f"{names.get(segment, segment)}: {listed}")
+    return distances
+
+def get_cell_profiles(input_csv=GRID_INPUT, dates=None, mode='weekday'):
+    """
+    Min-max scaled 24-hour vehicle profile of every grid cell in a raw file, from
+    the stored hour x cell aggregate of animated_map. Cells missing an hour of
+    the day are left out. Returns (N x 24 profiles, cells DataFrame with CELL,
+    LATITUDE, LONGITUDE), or None without data.
+    """
+    aggregate = load_aggregate(input_csv, dates)
+    if aggregate is None:
+        return None
+    weekdays = range(5) if mode == 'weekday' else [5, 6]
+    aggregate = aggregate[aggregate['TIME'].dt.dayofweek.isin(weekdays)]
+
+    profiles = (aggregate.groupby(['CELL', aggregate['TIME'].dt.hour])['AVG_VEHICLES'].mean()
+                .unstack().reindex(columns=range(24)).dropna())
+    if profiles.empty:
+        return None
+    cells = (aggregate.groupby('CELL')[['LATITUDE', 'LONGITUDE']].first()
+             .loc[profiles.index].reset_index())
+    return minmax_scale(profiles.to_numpy()), cells
+
+def cluster_grid(input_csv=GRID_INPUT, dates=None, mode='weekday', output_file=GRID_CLUSTERS_FILE):
+    """
+    Clusters every grid cell by its daily profile, like main() does for the segments.
+    Large grids are clustered from samples (see clustering.cluster_profiles).
+    Saves CELL, LATITUDE, LONGITUDE, CLUSTER and MEDOID per cell to output_file.
+    """
+    cell_profiles = get_cell_profiles(input_csv, dates, mode)
+    if cell_profiles is None or len(cell_profiles[0]) < 2:
+        print("Not enough grid cells to compare.")
+        return None
+    profiles, cells = cell_profiles
+
+    print(f"Clustering {len(cells):,} grid cells...")
+    with stage('compare grid clustering', cells=len(cells)):
+        result = cluster_profiles(profiles, k=CLUSTER_K, k_range=K_RANGE, window=DTW_WINDOW)
+
+    cells['CLUSTER'] = result['labels']
+    cells['MEDOID'] = False
+    cells.loc[result['medoids'], 'MEDOID'] = True
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    cells.to_csv(output_file, index=False)
+
+    print(f"k={result['k']}, silhouette "
+          f"{'n/a' if result['silhouette'] is None else format(result['silhouette'], '.3f')}")
+    print(cells['CLUSTER'].value_counts().sort_index().to_string())
+    print(f"Saved grid clusters to {output_file}")
+    return cells
 
 def main():
     print("Extracting daily volume profiles for all segments...")
@@ -76,15 +139,17 @@ def main():
     profiles = {}
     names = []
     
-    for key, info in ROAD_SEGMENTS.items():
-        profile = get_daily_volume_profile(key)
-        if profile is not None:
-            # Normalize profile (0-1)
-            scaler = MinMaxScaler()
-            profile_norm = scaler.fit_transform(profile.reshape(-1, 1)).flatten()
-            
-            profiles[key] = profile_norm
-            names.append(info['name'])
+    with stage('compare profiles') as s:
+        for key, info in ROAD_SEGMENTS.items():
+            profile = get_daily_volume_profile(key)
+            if profile is not None:
+                # Normalize profile (0-1)
+                scaler = MinMaxScaler()
+                profile_norm = scaler.fit_transform(profile.reshape(-1, 1)).flatten()
+                
+                profiles[key] = profile_norm
+                names.append(info['name'])
+        s.rows_out = len(profiles)
     
     keys = list(profiles.keys())
     n_segments = len(keys)
@@ -94,18 +159,13 @@ def main():
         return
 
     print(f"Computing DTW Distance Matrix for {n_segments} segments...")
-    dist_matrix = np.zeros((n_segments, n_segments))
+    profile_stack = np.stack([profiles[key] for key in keys])
     
-    for i in range(n_segments):
-        for j in range(n_segments):
-            if i == j:
-                dist_matrix[i, j] = 0
-            elif i > j:
-                # Matrix is symmetric
-                dist_matrix[i, j] = dist_matrix[j, i]
-            else:
-                d = simple_dtw_distance(profiles[keys[i]], profiles[keys[j]])
-                dist_matrix[i, j] = d
+    # Only the upper triangle is computed, the matrix is symmetric
+    with stage('compare dtw', segments=n_segments) as s:
+        condensed = pairwise_dtw(profile_stack, window=DTW_WINDOW)
+        s.count(rows_in=n_segments, rows_out=len(condensed))
+    dist_matrix = to_square_matrix(condensed, n_segments)
 
     # 1. Visualize the Distance Matrix
     plt.figure(figsize=(12, 10))
@@ -117,30 +177,34 @@ def main():
     print("Saved matrix heatmap to maps/dtw_distance_matrix.png")
     plt.show()
 
-    # 2. K-Means Clustering
-    # Since K-Means needs coordinates, we use MDS to project the Distance Matrix into 2D space
-    print("Applying MDS and K-Means...")
-    mds = MDS(n_components=2, dissimilarity="precomputed", random_state=42)
-    coords = mds.fit_transform(dist_matrix)
-    
-    # Determine K (Number of clusters)
-    k = 4
-    kmeans = KMeans(n_clusters=k, random_state=42)
-    clusters = kmeans.fit_predict(coords)
+    # 2. K-Medoids Clustering
+    # Works on the DTW distances directly, no 2-D projection needed
+    print("Applying k-medoids...")
+    with stage('compare clustering', segments=n_segments):
+        if CLUSTER_K is None:
+            result = choose_k(condensed, K_RANGE)
+            k, clusters, medoids, score = result['k'], result['labels'], result['medoids'], result['silhouette']
+            for k_tried, k_score in result['scores'].items():
+                print(f"  k={k_tried}: silhouette {k_score:.3f}")
+        else:
+            k = CLUSTER_K
+            clusters, medoids, _ = kmedoids(condensed, k)
+            score = silhouette(condensed, clusters) if 2 <= k < n_segments else None
     
-    # Visualize Clusters
-    plt.figure(figsize=(10, 8))
-    
-    colors = ['red', 'blue', 'green', 'purple', 'orange']
-    
-    for i in range(n_segments):
-        plt.scatter(coords[i, 0], coords[i, 1], c=colors[clusters[i]], s=100, edgecolors='black')
-        plt.text(coords[i, 0]+0.02, coords[i, 1]+0.02, names[i], fontsize=9)
-        
-    plt.title(f"Road Segment Grouping (MDS + K-Means, k={k})")
-    plt.xlabel("Dimension 1 (MDS)")
-    plt.ylabel("Dimension 2 (MDS)")
-    plt.grid(True, linestyle='--', alpha=0.6)
+    # Visualize Clusters: distance matrix ordered by cluster, medoid first
+    order = np.concatenate([
+        [medoids[c]] + [i for i in np.flatnonzero(clusters == c) if i != medoids[c]] for c in range(k)
+    ]).astype(int)
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(dist_matrix[np.ix_(order, order)], cmap="viridis",
+                xticklabels=[names[i] for i in order], yticklabels=[names[i] for i in order])
+    boundaries = np.cumsum(np.bincount(clusters, minlength=k))[:-1]
+    for b in boundaries:
+        plt.axhline(b, color='white', linewidth=2)
+        plt.axvline(b, color='white', linewidth=2)
+    plt.title(f"Road Segment Grouping (DTW k-medoids, k={k})")
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
     plt.savefig('maps/segment_clusters.png', dpi=300)
     print("Saved cluster plot to maps/segment_clusters.png")
     plt.show()
@@ -149,24 +213,26 @@ def main():
     print("\n--- Groupings ---")
     df_results = pd.DataFrame({'Segment': names, 'Cluster': clusters})
     for c in range(k):
-        print(f"\nCluster {c}:")
+        print(f"\nCluster {c} (medoid: {names[medoids[c]]}):")
         group = df_results[df_results['Cluster'] == c]['Segment'].tolist()
         for g in group:
             print(f" - {g}")
             
-    # 3. Validation: Silhouette Score
-    score = silhouette_score(coords, clusters)
+    # 3. Validation: Silhouette Score (on the DTW distances)
     print(f"\n--- Validation ---")
-    print(f"Silhouette Score: {score:.3f}")
+    if score is None:
+        print("Silhouette Score: n/a (needs 2 to N-1 clusters)")
+    else:
+        print(f"Silhouette Score: {score:.3f}")
     print("(A score close to 1.0 indicates well-separated clusters, near 0 indicates overlapping.)")
 
     # 4. Visual Validation: Cluster Profiles
     print("\nGenerating cluster profile plots for visual inspection...")
-    fig, axes = plt.subplots(k, 1, figsize=(10, 3*k), sharex=True)
+    fig, axes = plt.subplots(k, 1, figsize=(10, 3*k), sharex=True, squeeze=False)
     
     hours = range(24)
     for c in range(k):
-        ax = axes[c]
+        ax = axes[c, 0]
         indices = [i for i, x in enumerate(clusters) if x == c]
         
         for idx in indices:
@@ -184,5 +250,11 @@ def main():
     print("Saved cluster profiles to maps/cluster_profiles.png")
     plt.show()
 
+    # 5. Day-level profiles: which days break each segment's usual pattern
+    unusual_days()
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['grid']:
+        cluster_grid()
+    else:
+        main()
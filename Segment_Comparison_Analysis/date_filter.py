@@ -0,0 +1,94 @@
+# Date filtering on the raw DATE_TIME column without a full datetime parse.
+# Only the 'YYYY-MM-DD' prefix of each value is read and turned into an integer day
+# number (days since 1970-01-01), which is then compared with the wanted days.
+
+import pandas as pd
+import numpy as np
+import datetime
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def days_from_civil(year, month, day):
+    """Vectorized day number of a (year, month, day) date (proleptic Gregorian)."""
+    year = np.asarray(year, dtype=np.int64) - (np.asarray(month) <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    mp = (np.asarray(month, dtype=np.int64) + 9) % 12
+    doy = (153 * mp + 2) // 5 + np.asarray(day, dtype=np.int64) - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def year_from_days(days):
+    """Vectorized calendar year of a day number."""
+    z = np.asarray(days, dtype=np.int64) + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    # Years start in March in this algorithm, January and February belong to the next one
+    return yoe + era * 400 + (mp >= 10)
+
+def iso_weeks(days):
+    """Vectorized ISO-8601 week number of day numbers."""
+    days = np.asarray(days, dtype=np.int64)
+    weekday = (days + 3) % 7                 # 1970-01-01 was a Thursday, Monday = 0
+    thursday = days - weekday + 3            # The ISO year is the year of the week's Thursday
+    jan_first = days_from_civil(year_from_days(thursday), 1, 1)
+    return (thursday - jan_first) // 7 + 1
+
+def day_numbers(date_time):
+    """
+    Day numbers of a DATE_TIME column. Datetime columns (e.g. from the Parquet
+    cache) are converted directly, string columns only through their date prefix.
+    """
+    if pd.api.types.is_datetime64_any_dtype(date_time):
+        return date_time.to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    prefix = date_time.to_numpy(dtype='U10')
+    digits = prefix.view(np.uint32).reshape(-1, 10).astype(np.int64) - ord('0')
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    return days_from_civil(year, month, day)
+
+def dates_to_days(dates):
+    """Sorted day numbers of 'YYYY-MM-DD' strings."""
+    return np.unique([(datetime.date.fromisoformat(d) - EPOCH).days for d in dates]).astype(np.int64)
+
+def wanted_days(first_day, last_day, dates=None, weeks=None):
+    """Day numbers in [first_day, last_day] that pass the dates and/or ISO weeks filter."""
+    days = np.arange(first_day, last_day + 1, dtype=np.int64)
+    keep = np.ones(len(days), dtype=bool)
+    if dates is not None:
+        keep &= np.isin(days, dates_to_days(dates))
+    if weeks is not None:
+        keep &= np.isin(iso_weeks(days), list(weeks))
+    return days[keep]
+
+def filter_chunks(chunks, dates=None, weeks=None, assume_sorted=False):
+    """
+    Yields only the rows of each chunk whose DATE_TIME day is in dates
+    ('YYYY-MM-DD' strings) and/or in the given ISO weeks.
+    assume_sorted: the input is ordered by DATE_TIME, so each chunk is first
+    checked through its first and last row only. Chunks with no wanted day in
+    that range are skipped and chunks fully inside it are kept without a per-row test.
+    """
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+
+        if assume_sorted:
+            first_day, last_day = day_numbers(chunk['DATE_TIME'].iloc[[0, -1]])
+            wanted = wanted_days(first_day, last_day, dates, weeks)
+            if len(wanted) == 0:
+                continue
+            if len(wanted) == last_day - first_day + 1:
+                yield chunk
+                continue
+
+        days = day_numbers(chunk['DATE_TIME'])
+        mask = np.isin(days, wanted_days(days.min(), days.max(), dates, weeks))
+        if mask.any():
+            yield chunk[mask]
@@ -0,0 +1,263 @@
+# Shared Dynamic Time Warping engine used by compare_segments and Season_Comparison/compare.
+# Uses a numba-compiled kernel when numba is installed, otherwise a NumPy kernel that
+# fills the cost matrix one anti-diagonal at a time.
+
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Memory the NumPy kernel may use per batch of pairs, in bytes
+BATCH_MEMORY = 256 * 2**20
+
+
+def _band(n, m, window):
+    """Sakoe-Chiba half-width, widened so the end cell (n, m) stays reachable."""
+    if window is None:
+        return max(n, m)
+    return max(int(window), abs(n - m))
+
+def _dtw_antidiagonal(s1, s2, window):
+    """Batched kernel: s1 is (P, n), s2 is (P, m), returns P distances."""
+    n, m = s1.shape[1], s2.shape[1]
+    cost = np.abs(s1[:, :, None] - s2[:, None, :])
+
+    if window < max(n, m):
+        rows, cols = np.indices((n, m))
+        cost[:, np.abs(rows - cols) > window] = np.inf
+
+    dtw_matrix = np.full((len(s1), n+1, m+1), np.inf)
+    dtw_matrix[:, 0, 0] = 0
+
+    # Cells with the same i + j only depend on the two previous anti-diagonals
+    for d in range(2, n + m + 1):
+        i = np.arange(max(1, d - m), min(n, d - 1) + 1)
+        j = d - i
+        last_min = np.minimum(np.minimum(dtw_matrix[:, i-1, j],    # Insertion
+                                         dtw_matrix[:, i, j-1]),   # Deletion
+                              dtw_matrix[:, i-1, j-1])             # Match
+        dtw_matrix[:, i, j] = cost[:, i-1, j-1] + last_min
+
+    return dtw_matrix[:, n, m]
+
+if njit is not None:
+    @njit(cache=True)
+    def _dtw_compiled(s1, s2, window):
+        n, m = len(s1), len(s2)
+        dtw_matrix = np.full((n+1, m+1), np.inf)
+        dtw_matrix[0, 0] = 0
+
+        for i in range(1, n+1):
+            for j in range(max(1, i - window), min(m, i + window) + 1):
+                cost = abs(s1[i-1] - s2[j-1])
+                last_min = min(dtw_matrix[i-1, j], dtw_matrix[i, j-1], dtw_matrix[i-1, j-1])
+                dtw_matrix[i, j] = cost + last_min
+
+        return dtw_matrix[n, m]
+
+    @njit(cache=True)
+    def _dtw_pairs_compiled(s1, s2, window):
+        distances = np.empty(len(s1))
+        for k in range(len(s1)):
+            distances[k] = _dtw_compiled(s1[k], s2[k], window)
+        return distances
+else:
+    _dtw_compiled = None
+    _dtw_pairs_compiled = None
+
+def dtw_distance(s1, s2, window=None):
+    """
+    DTW distance with absolute-difference cost between two 1-D profiles.
+    window: optional Sakoe-Chiba band half-width (in samples).
+    """
+    s1 = np.asarray(s1, dtype=np.float64)
+    s2 = np.asarray(s2, dtype=np.float64)
+    band = _band(len(s1), len(s2), window)
+
+    if _dtw_compiled is not None:
+        return float(_dtw_compiled(s1, s2, band))
+    return float(_dtw_antidiagonal(s1[None, :], s2[None, :], band)[0])
+
+def _batch_size(n, m, memory=BATCH_MEMORY):
+    """Pairs per NumPy batch: each pair holds an n x m cost and an (n+1) x (m+1) float64 matrix."""
+    return max(1, memory // ((n * m + (n + 1) * (m + 1)) * 8))
+
+def dtw_pairs(s1, s2, window=None, batch_size=None):
+    """
+    Row-wise DTW distances between two stacked profile arrays of shape (P, L).
+    batch_size: pairs per NumPy batch, by default as many as fit in BATCH_MEMORY.
+    """
+    s1 = np.ascontiguousarray(s1, dtype=np.float64)
+    s2 = np.ascontiguousarray(s2, dtype=np.float64)
+    band = _band(s1.shape[1], s2.shape[1], window)
+
+    if _dtw_pairs_compiled is not None:
+        return _dtw_pairs_compiled(s1, s2, band)
+
+    if batch_size is None:
+        batch_size = _batch_size(s1.shape[1], s2.shape[1])
+    distances = np.empty(len(s1))
+    for start in range(0, len(s1), batch_size):
+        stop = start + batch_size
+        distances[start:stop] = _dtw_antidiagonal(s1[start:stop], s2[start:stop], band)
+    return distances
+
+# Profiles are sent to each worker process once, work units only carry pair indices
+_worker_profiles = None
+_worker_window = None
+
+def _init_pair_worker(profiles, window):
+    global _worker_profiles, _worker_window
+    _worker_profiles = profiles
+    _worker_window = window
+
+def _pair_chunk(pairs):
+    rows, cols = pairs
+    return dtw_pairs(_worker_profiles[rows], _worker_profiles[cols], _worker_window)
+
+def pairwise_dtw(profiles, window=None, n_jobs=None, chunk_pairs=5000):
+    """
+    DTW distances between all rows of a stacked (N, L) profile array.
+    Only the upper triangle is computed; the result is the condensed vector in
+    the same order as scipy's pdist (use to_square_matrix for an N x N matrix).
+    n_jobs: worker processes (None = all cores, 1 = run in this process).
+    """
+    profiles = np.ascontiguousarray(profiles, dtype=np.float64)
+    rows, cols = np.triu_indices(len(profiles), k=1)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1 or len(rows) <= chunk_pairs:
+        return dtw_pairs(profiles[rows], profiles[cols], window)
+
+    work_units = [(rows[start:start + chunk_pairs], cols[start:start + chunk_pairs])
+                  for start in range(0, len(rows), chunk_pairs)]
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_pair_worker,
+                             initargs=(profiles, window)) as pool:
+        results = list(pool.map(_pair_chunk, work_units))
+
+    return np.concatenate(results)
+
+def _euclidean_pairs(s1, s2):
+    return np.sqrt(np.sum((s1 - s2) ** 2, axis=1))
+
+def _distance_chunk(args):
+    s1, s2, metric, window = args
+    if metric == 'euclidean':
+        return _euclidean_pairs(s1, s2)
+    return dtw_pairs(s1, s2, window)
+
+def batched_distances(s1, s2, metric='dtw', window=None, n_jobs=1, chunk_pairs=200000):
+    """
+    Row-wise distances between two (P, L) profile arrays, metric 'dtw' or 'euclidean'.
+    Rows with a NaN give NaN. n_jobs > 1 (None = all cores) splits the rows
+    over worker processes.
+    """
+    if metric not in ('dtw', 'euclidean'):
+        raise ValueError(f"Unknown metric {metric!r}")
+    s1 = np.ascontiguousarray(s1, dtype=np.float64)
+    s2 = np.ascontiguousarray(s2, dtype=np.float64)
+    distances = np.full(len(s1), np.nan)
+    valid = np.flatnonzero(~(np.isnan(s1).any(axis=1) | np.isnan(s2).any(axis=1)))
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    chunks = [(s1[valid[start:start + chunk_pairs]], s2[valid[start:start + chunk_pairs]], metric, window)
+              for start in range(0, len(valid), chunk_pairs)]
+
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = [_distance_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_distance_chunk, chunks))
+
+    if results:
+        distances[valid] = np.concatenate(results)
+    return distances
+
+def day_distances(tensor, reference, metric='dtw', window=None, n_jobs=1):
+    """
+    Distance of every day profile in a (S, D, L) segment x day tensor to its
+    segment's (S, L) reference profile (e.g. a baseline). Returns an (S, D) array,
+    NaN for days with missing hours.
+    """
+    tensor = np.asarray(tensor, dtype=np.float64)
+    n_segments, n_days, length = tensor.shape
+    references = np.broadcast_to(np.asarray(reference, dtype=np.float64)[:, None, :], tensor.shape)
+    distances = batched_distances(tensor.reshape(-1, length), references.reshape(-1, length),
+                                  metric, window, n_jobs)
+    return distances.reshape(n_segments, n_days)
+
+def pairwise_day_distances(profiles, metric='dtw', window=None, n_jobs=None):
+    """
+    Condensed all-pairs distances (pdist order) between the rows of an (N, L)
+    array, e.g. every day of one segment. Euclidean runs as one vectorized
+    product, DTW goes through pairwise_dtw.
+    """
+    profiles = np.ascontiguousarray(profiles, dtype=np.float64)
+    if metric == 'dtw':
+        return pairwise_dtw(profiles, window=window, n_jobs=n_jobs)
+    if metric != 'euclidean':
+        raise ValueError(f"Unknown metric {metric!r}")
+    squared = np.sum(profiles ** 2, axis=1)
+    gram = squared[:, None] + squared[None, :] - 2 * profiles @ profiles.T
+    rows, cols = np.triu_indices(len(profiles), k=1)
+    return np.sqrt(np.clip(gram[rows, cols], 0, None))
+
+def to_square_matrix(condensed, n):
+    """Expands a condensed upper-triangle vector into a symmetric N x N matrix."""
+    matrix = np.zeros((n, n))
+    rows, cols = np.triu_indices(n, k=1)
+    matrix[rows, cols] = condensed
+    matrix[cols, rows] = condensed
+    return matrix
+
+def envelope(series, window):
+    """Upper and lower Keogh envelope of a series for a band half-width."""
+    series = np.asarray(series, dtype=np.float64)
+    window = len(series) if window is None else int(window)
+    width = 2 * window + 1
+
+    upper_padded = np.pad(series, window, constant_values=-np.inf)
+    lower_padded = np.pad(series, window, constant_values=np.inf)
+    upper = np.lib.stride_tricks.sliding_window_view(upper_padded, width).max(axis=1)
+    lower = np.lib.stride_tricks.sliding_window_view(lower_padded, width).min(axis=1)
+    return upper, lower
+
+def lb_keogh(query, candidate, window=None, candidate_envelope=None):
+    """
+    LB_Keogh lower bound of dtw_distance(query, candidate, window).
+    Only valid for equal-length series; pass candidate_envelope to reuse it.
+    """
+    query = np.asarray(query, dtype=np.float64)
+    if candidate_envelope is None:
+        candidate_envelope = envelope(candidate, window)
+    upper, lower = candidate_envelope
+
+    above = np.clip(query - upper, 0, None)
+    below = np.clip(lower - query, 0, None)
+    return float(np.sum(above + below))
+
+def nearest_neighbour(query, candidates, window=None):
+    """
+    Index and DTW distance of the closest candidate to query.
+    Candidates are visited in LB_Keogh order and skipped as soon as their
+    lower bound exceeds the best distance found so far.
+    """
+    bounds = np.array([lb_keogh(query, c, window) for c in candidates])
+    best_index, best_dist = -1, np.inf
+
+    for idx in np.argsort(bounds, kind='stable'):
+        if bounds[idx] >= best_dist:
+            break
+        dist = dtw_distance(query, candidates[idx], window)
+        if dist < best_dist:
+            best_index, best_dist = int(idx), dist
+
+    return best_index, best_dist
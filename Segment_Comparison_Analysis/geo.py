@@ -0,0 +1,61 @@
+# Vectorized point-to-polyline distance and Gaussian weighting shared by weight.py and
+# Season_Comparison/weighting.py. Uses the same local flat-earth approximation
+# as the original scalar version (1 deg lat ~= 111 km, 1 deg lon ~= 111 * cos(lat) km).
+
+import numpy as np
+from grid_filter import chunk_cell_ids
+
+KM_PER_DEGREE = 111
+
+
+def distance_to_polyline(lats, lons, geometry):
+    """
+    Minimum distance (km) from every point to a polyline given as a list of
+    (lat, lon) vertices. All points x all edges are evaluated in one broadcast.
+    """
+    lats = np.asarray(lats, dtype=np.float64)[:, None]
+    lons = np.asarray(lons, dtype=np.float64)[:, None]
+    vertices = np.asarray(geometry, dtype=np.float64).reshape(-1, 2)
+
+    if len(vertices) < 2:
+        return np.full(lats.shape[0], np.inf)
+
+    p1, p2 = vertices[:-1], vertices[1:]
+    lon_scale = np.cos(np.radians((p1[:, 0] + p2[:, 0]) / 2))
+
+    # Vector AB (edge) and AP (point to edge start), shape (points, edges)
+    dx = (p2[:, 1] - p1[:, 1]) * KM_PER_DEGREE * lon_scale
+    dy = (p2[:, 0] - p1[:, 0]) * KM_PER_DEGREE
+    px = (lons - p1[:, 1]) * KM_PER_DEGREE * lon_scale
+    py = (lats - p1[:, 0]) * KM_PER_DEGREE
+
+    # Projection parameter clamped to the edge, degenerate edges use their start point
+    len_sq = dx*dx + dy*dy
+    safe_len_sq = np.where(len_sq == 0, 1, len_sq)
+    t = np.where(len_sq == 0, 0, (px * dx + py * dy) / safe_len_sq)
+    t = np.clip(t, 0, 1)
+
+    dist_km = np.sqrt((px - t * dx)**2 + (py - t * dy)**2)
+    return dist_km.min(axis=1)
+
+def gaussian_weights(lats, lons, geometry, sigma_km):
+    """Gaussian weight exp(-0.5 * (dist / sigma)^2) of every point."""
+    dist = distance_to_polyline(lats, lons, geometry)
+    return np.exp(-0.5 * (dist / sigma_km)**2)
+
+def cell_weights(df, geometry, sigma_km):
+    """
+    Weight coefficient for every row of df.
+    Distances are computed once per unique grid cell and mapped back to the
+    rows through the cell id.
+    """
+    cells = chunk_cell_ids(df)
+    unique_cells, first_row, row_to_cell = np.unique(cells, return_index=True, return_inverse=True)
+
+    weights = gaussian_weights(
+        df['LATITUDE'].to_numpy()[first_row],
+        df['LONGITUDE'].to_numpy()[first_row],
+        geometry,
+        sigma_km
+    )
+    return weights[row_to_cell.ravel()]
@@ -0,0 +1,39 @@
+# Vectorized grid-cell membership filter shared by all extractors.
+# Lat/lon pairs are quantized to integer cell ids once, so membership becomes a
+# NumPy integer lookup instead of building and hashing a Python tuple per row.
+
+import numpy as np
+
+CELL_PRECISION = 1e6        # Quantize coordinates to micro-degrees
+LON_SPAN = 1_000_000_000    # Larger than any quantized |longitude|, keeps ids unique
+
+
+def to_cell_ids(lats, lons):
+    """Converts arrays of latitude/longitude into int64 cell ids."""
+    lat_q = np.rint(np.asarray(lats, dtype=np.float64) * CELL_PRECISION).astype(np.int64)
+    lon_q = np.rint(np.asarray(lons, dtype=np.float64) * CELL_PRECISION).astype(np.int64)
+    return lat_q * LON_SPAN + lon_q
+
+def cell_id(lat, lon):
+    return int(to_cell_ids([lat], [lon])[0])
+
+def cell_center(cell):
+    """Inverse of cell_id, returns the (lat, lon) of a cell id."""
+    lat_q, lon_q = divmod(int(cell), LON_SPAN)
+    if lon_q > LON_SPAN // 2:
+        lat_q, lon_q = lat_q + 1, lon_q - LON_SPAN
+    return lat_q / CELL_PRECISION, lon_q / CELL_PRECISION
+
+def make_cell_set(grid_points):
+    """Sorted, unique cell ids for a list of (lat, lon) grid points."""
+    if len(grid_points) == 0:
+        return np.empty(0, dtype=np.int64)
+    points = np.asarray(grid_points, dtype=np.float64)
+    return np.unique(to_cell_ids(points[:, 0], points[:, 1]))
+
+def chunk_cell_ids(chunk):
+    return to_cell_ids(chunk['LATITUDE'].to_numpy(), chunk['LONGITUDE'].to_numpy())
+
+def grid_mask(chunk, cell_set):
+    """Boolean mask of the chunk rows that fall into one of the cells in cell_set."""
+    return np.isin(chunk_cell_ids(chunk), cell_set)
@@ -0,0 +1,247 @@
+# Per-stage instrumentation shared by the pipeline scripts.
+# A stage records wall time, rows in/out, bytes read, chunks, RSS and peak RSS. A summary
+# table of the main process' stages is printed at exit. With TRAFFIC_METRICS_FILE set
+# (or TRAFFIC_METRICS=1 for LOG_FOLDER/stages.jsonl) every finished stage, worker
+# processes included, is also appended to that file as one JSON line.
+# TRAFFIC_PROFILE=cprofile profiles every top-level stage with cProfile,
+# TRAFFIC_PROFILE=sample records stack samples from a background thread instead
+# (low overhead, collapsed stacks that flamegraph tools read). Output goes to LOG_FOLDER.
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import collections
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+LOG_FOLDER = os.environ.get('TRAFFIC_LOG_FOLDER', 'logs')
+METRICS_FILE = os.environ.get('TRAFFIC_METRICS_FILE') or (
+    os.path.join(LOG_FOLDER, 'stages.jsonl') if os.environ.get('TRAFFIC_METRICS') == '1' else None)
+PROFILE_MODE = os.environ.get('TRAFFIC_PROFILE', '').lower()       # '', 'cprofile' or 'sample'
+SAMPLE_INTERVAL = float(os.environ.get('TRAFFIC_SAMPLE_INTERVAL', '0.005'))
+TOP_FUNCTIONS = 15
+
+_local = threading.local()  # .stack: active stages of this thread, innermost last
+_finished = []          # Top-level stages finished in this process, for the summary
+_owner_pid = os.getpid()
+_summary_registered = False
+
+
+def _stack():
+    global _owner_pid
+    if os.getpid() != _owner_pid:
+        # Forked worker: the parent's running stages are not ours
+        _owner_pid = os.getpid()
+        _local.__dict__.clear()
+        _finished.clear()
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux), None elsewhere."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb():
+    """High-water RSS of this process in MB."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1e6 if sys.platform == 'darwin' else max_rss * 1024 / 1e6
+
+class Stage:
+    """Counters of one running stage, see stage()."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.chunks = 0
+        self.seconds = None
+        self._start = time.perf_counter()
+        self._rss_start = current_rss_mb()
+
+    def count(self, rows_in=0, rows_out=0, bytes_read=0, chunks=0):
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        self.bytes_read += bytes_read
+        self.chunks += chunks
+
+    def record(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self._start
+        rss = current_rss_mb()
+        peak = peak_rss_mb()
+        if peak is not None and rss is not None:
+            peak = max(peak, rss)       # The two are sampled differently
+        return {
+            'stage': self.name,
+            'pid': os.getpid(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds': round(seconds, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_read': self.bytes_read,
+            'chunks': self.chunks,
+            'rows_per_s': round(self.rows_in / seconds, 1) if seconds > 0 else None,
+            'rss_start_mb': None if self._rss_start is None else round(self._rss_start, 1),
+            'rss_end_mb': None if rss is None else round(rss, 1),
+            'peak_rss_mb': None if peak is None else round(peak, 1),
+            **self.fields,
+        }
+
+def count(rows_in=0, rows_out=0, bytes_read=0, chunks=0):
+    """Adds to the innermost running stage, does nothing outside of a stage."""
+    stack = _stack()
+    if stack:
+        stack[-1].count(rows_in, rows_out, bytes_read, chunks)
+
+def counted(chunks):
+    """Passes DataFrame chunks through, counting them as rows in of the current stage."""
+    for chunk in chunks:
+        count(rows_in=len(chunk), chunks=1)
+        yield chunk
+
+class _Sampler(threading.Thread):
+    """Samples the stack of the profiled thread every SAMPLE_INTERVAL seconds."""
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _start_profiler():
+    if PROFILE_MODE == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one cProfile can run at a time, e.g. with stages in several threads
+            print("cProfile is already running in another stage, not profiling this one")
+            return None
+        return profiler
+    if PROFILE_MODE == 'sample':
+        sampler = _Sampler(threading.get_ident())
+        sampler.start()
+        return sampler
+    return None
+
+def _stop_profiler(profiler, name):
+    """Stops the profiler, saves its output and returns the top functions as text."""
+    os.makedirs(LOG_FOLDER, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() else '_' for c in name)
+
+    if PROFILE_MODE == 'cprofile':
+        import io
+        import pstats
+        profiler.disable()
+        path = os.path.join(LOG_FOLDER, f"profile_{safe_name}_{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        return f"cProfile of {name} saved to {path}\n{text.getvalue()}"
+
+    profiler.stop()
+    path = os.path.join(LOG_FOLDER, f"samples_{safe_name}_{os.getpid()}.txt")
+    with open(path, 'w') as f:
+        for stack, n in profiler.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+
+    # Self time: samples whose innermost frame is the function
+    leaves = collections.Counter()
+    for stack, n in profiler.stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += n
+    total = sum(leaves.values()) or 1
+    lines = [f"Stack samples of {name} saved to {path} ({total} samples)"]
+    lines += [f"  {n / total:6.1%}  {leaf}" for leaf, n in leaves.most_common(TOP_FUNCTIONS)]
+    return '\n'.join(lines)
+
+def _write_record(record):
+    if METRICS_FILE is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(METRICS_FILE) or '.', exist_ok=True)
+        with open(METRICS_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError as e:
+        print(f"Could not write stage metrics: {e}")
+
+def _is_worker():
+    return multiprocessing.parent_process() is not None
+
+def print_summary():
+    if not _finished or _is_worker():
+        return
+    print(f"\n{'stage':<32} {'seconds':>9} {'rows in':>12} {'rows out':>12} {'rows/s':>12} {'MB read':>9} {'peak RSS':>9}")
+    for r in _finished:
+        rate = f"{r['rows_per_s']:12,.0f}" if r['rows_per_s'] else f"{'-':>12}"
+        peak = f"{r['peak_rss_mb']:6.0f} MB" if r['peak_rss_mb'] is not None else f"{'-':>9}"
+        print(f"{r['stage'][:32]:<32} {r['seconds']:9.2f} {r['rows_in']:12,} {r['rows_out']:12,} "
+              f"{rate} {r['bytes_read'] / 1e6:9.1f} {peak}")
+    if METRICS_FILE is not None:
+        print(f"Stage metrics: {METRICS_FILE}")
+    _finished.clear()
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times a pipeline stage. Use the yielded Stage (or count()) to add rows
+    and bytes; counts of nested stages are added to their parent as well.
+    Extra keyword fields are stored in the JSON record.
+    """
+    global _summary_registered
+    if not _summary_registered and not _is_worker():
+        atexit.register(print_summary)
+        _summary_registered = True
+
+    stack = _stack()
+    current = Stage(name, fields)
+    top_level = not stack
+    profiler = _start_profiler() if top_level else None
+    stack.append(current)
+    try:
+        yield current
+    finally:
+        stack.pop()
+        current.seconds = time.perf_counter() - current._start
+        profile_text = _stop_profiler(profiler, name) if profiler is not None else None
+
+        if stack:
+            stack[-1].count(current.rows_in, current.rows_out, current.bytes_read, current.chunks)
+
+        record = current.record()
+        _write_record(record)
+        if top_level:
+            _finished.append(record)
+        if profile_text:
+            print(profile_text)
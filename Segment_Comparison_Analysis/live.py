@@ -0,0 +1,251 @@
+# Watch mode for the live feed: hourly drop files instead of monthly exports.
+# New CSVs in DROP_FOLDER (same columns as the raw exports) are routed to the segments
+# with the filters of main.route_rows, weighted like weight.py, appended to the
+# segment and weighted files and their series store, merged into the weighted profile
+# cube and the anomaly scores are brought up to date.
+# An asyncio loop keeps watching the folder while earlier files are routed and
+# weighted in a process pool; results are committed one file at a time, in arrival
+# order. A file's rows are kept completely or not at all; committed files move to
+# DROP_FOLDER/done (failed ones, with nothing kept, to DROP_FOLDER/failed), so a
+# restart continues where it stopped.
+# Drop files should only hold hours that no monthly export extracted before, rows
+# are appended, not deduplicated.
+# Run from the repository root:
+#   python Segment_Comparison_Analysis/live.py [drop folder]
+
+import asyncio
+import os
+import shutil
+import sys
+import time
+import traceback
+from contextlib import ExitStack
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from main import ROAD_SEGMENTS, route_rows
+from weight import weight_frame
+from segment_writer import SegmentWriter
+from manifest import record_scans, load_manifest, fingerprint
+from profile_cube import load_cube, merge_into_cube
+from series_store import append_series, store_files
+from anomaly import update_scores, top_anomalies
+from instrument import stage
+
+DROP_FOLDER = 'live_drop'
+DONE_FOLDER = 'done'
+FAILED_FOLDER = 'failed'
+DATA_FOLDER = 'relevant_data'
+WEIGHTED_FOLDER = 'weighted_data'
+POLL_SECONDS = 5.0
+N_WORKERS = 2
+PENDING_FILES = 8           # Files routed ahead of the commit step at most
+
+
+def route_drop_file(file_path, segment_keys):
+    """
+    Worker side: matched rows of one drop file per segment and their weighted copy.
+    Returns {segment_key: (rows, weighted rows)} and the number of rows read.
+    """
+    parts = {}
+    with stage('live route', file=os.path.basename(file_path)) as s:
+        for key, part in route_rows(file_path, segment_keys):
+            parts.setdefault(key, []).append(part)
+
+        routed = {}
+        for key, frames in parts.items():
+            rows = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+            segment = ROAD_SEGMENTS[key]
+            weighted = weight_frame(rows.copy(), segment) if 'road_geometry' in segment else None
+            routed[key] = (rows, weighted)
+            s.count(rows_out=len(rows))
+    return routed, s.rows_in
+
+def drop_entry(file_path):
+    """Manifest key of a drop file: its path and content, names may be reused by later files."""
+    fp = fingerprint(file_path)
+    return f"{file_path}#{fp['size']}-{fp['head_sha1'][:16]}"
+
+def is_committed(file_path, data_folder=DATA_FOLDER):
+    return drop_entry(file_path) in load_manifest(data_folder)['files']
+
+def _read_files(paths):
+    """Contents of the files (None if missing), to put them back with _restore_files."""
+    contents = {}
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                contents[path] = f.read()
+        else:
+            contents[path] = None
+    return contents
+
+def _restore_files(contents):
+    for path, data in contents.items():
+        if data is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+
+def commit_drop_file(file_path, routed, data_folder=DATA_FOLDER, weighted_folder=WEIGHTED_FOLDER):
+    """
+    Appends one file's routed rows to the segment and weighted files and the series
+    store, all or nothing: the drop file is recorded in the extraction manifest of
+    data_folder last, and any failure before that truncates the appended rows,
+    deletes outputs the append created and puts the series store back. Then the rows are merged into the weighted cube and
+    the anomaly scores are refreshed; both catch up by themselves on a later run if
+    that fails. Returns the new scores.
+    """
+    # Cube as it was before the append, the new rows are merged into it below
+    cube = load_cube(weighted_folder) if os.path.isdir(weighted_folder) else None
+    weighted_frames = {}
+    filenames = {key: ROAD_SEGMENTS[key]['output_filename'] for key in routed}
+    store = _read_files([path for key, (_, weighted) in routed.items() if weighted is not None
+                         for path in store_files(weighted_folder, filenames[key])])
+
+    try:
+        with ExitStack() as writers:
+            for key, (rows, weighted) in routed.items():
+                writer = writers.enter_context(SegmentWriter(os.path.join(data_folder, filenames[key]), append=True))
+                writer.write(rows)
+                writer.close()
+                if weighted is not None and len(weighted):
+                    writer = writers.enter_context(
+                        SegmentWriter(os.path.join(weighted_folder, 'weighted_' + filenames[key]), append=True))
+                    writer.write(weighted)
+                    writer.close()
+                    append_series(weighted_folder, filenames[key], weighted)
+                    weighted_frames['weighted_' + filenames[key]] = weighted
+            # Commit point, the writers above are rolled back if this fails
+            record_scans(data_folder, {drop_entry(file_path): {key: len(rows) for key, (rows, _) in routed.items()}},
+                         {key: os.path.join(data_folder, filenames[key]) for key in routed})
+    except Exception:
+        _restore_files(store)
+        raise
+
+    if not weighted_frames:
+        return None
+    try:
+        if cube is None:
+            cube = load_cube(weighted_folder)
+        else:
+            cube = merge_into_cube(weighted_folder, cube, weighted_frames)
+        return update_scores(weighted_folder, cube=cube)
+    except Exception:
+        # The rows are committed; the cube notices the changed files on its next load
+        traceback.print_exc()
+        print(f"Rows of {file_path} are saved, the cube and anomaly scores catch up on the next run")
+        return None
+
+def _move(file_path, folder):
+    target_folder = os.path.join(os.path.dirname(file_path), folder)
+    os.makedirs(target_folder, exist_ok=True)
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    target = os.path.join(target_folder, name + ext)
+    n = 1
+    while os.path.exists(target):
+        # A reused name, keep the earlier file
+        target = os.path.join(target_folder, f"{name}.{n}{ext}")
+        n += 1
+    shutil.move(file_path, target)
+
+async def watch_folder(drop_folder, files, queued, poll_seconds=POLL_SECONDS):
+    """
+    Queues every new CSV in drop_folder once its size stopped changing between two
+    polls. commit_files takes paths out of queued once their file is moved away,
+    so a later file with the same name is picked up again.
+    """
+    sizes = {}
+    while True:
+        names = sorted(f for f in os.listdir(drop_folder) if f.endswith('.csv')) if os.path.isdir(drop_folder) else []
+        for path in set(sizes) - {os.path.join(drop_folder, name) for name in names}:
+            del sizes[path]
+        for name in names:
+            path = os.path.join(drop_folder, name)
+            if path in queued:
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if sizes.get(path) == size:
+                queued.add(path)
+                del sizes[path]
+                await files.put(path)
+            else:
+                # Still being written, or seen for the first time
+                sizes[path] = size
+        await asyncio.sleep(poll_seconds)
+
+async def route_files(files, routed, pool, segment_keys):
+    """Hands queued files to the pool without waiting for them, keeping arrival order."""
+    loop = asyncio.get_running_loop()
+    while True:
+        path = await files.get()
+        print(f"New drop file: {path}")
+        future = loop.run_in_executor(pool, route_drop_file, path, segment_keys)
+        await routed.put((path, future, time.perf_counter()))
+
+async def commit_files(routed, queued, data_folder, weighted_folder, stop_after=None):
+    """Commits routed files one at a time, in the order they arrived."""
+    loop = asyncio.get_running_loop()
+    committed = 0
+    while stop_after is None or committed < stop_after:
+        path, future, start = await routed.get()
+        try:
+            if is_committed(path, data_folder):
+                # Committed just before a restart, the move did not happen
+                print(f"Already committed: {path}")
+                _move(path, DONE_FOLDER)
+                continue
+            try:
+                result, rows_in = await future
+                # File and cube writes stay off the event loop so watching continues
+                scores = await loop.run_in_executor(None, commit_drop_file, path, result, data_folder, weighted_folder)
+            except Exception:
+                # Nothing of the file was kept, it can be dropped again once fixed
+                traceback.print_exc()
+                print(f"Failed: {path}")
+                _move(path, FAILED_FOLDER)
+                continue
+
+            _move(path, DONE_FOLDER)
+            rows_out = sum(len(rows) for rows, _ in result.values())
+            print(f"Committed {path}: {rows_in:,} rows read, {rows_out:,} routed to {len(result)} segments "
+                  f"in {time.perf_counter() - start:.1f} s")
+            if scores is not None and len(scores):
+                print(top_anomalies(weighted_folder, n=5, since=scores['DATE'].min()).to_string(index=False))
+        finally:
+            # The name is free again for a later file
+            queued.discard(path)
+            committed += 1
+
+async def run_live(drop_folder=DROP_FOLDER, data_folder=DATA_FOLDER, weighted_folder=WEIGHTED_FOLDER,
+                   n_workers=N_WORKERS, poll_seconds=POLL_SECONDS, stop_after=None):
+    """
+    Watches drop_folder until cancelled (or until stop_after files were committed).
+    """
+    segment_keys = [key for key in ROAD_SEGMENTS if len(ROAD_SEGMENTS[key]['cell_ids'])]
+    files = asyncio.Queue()
+    queued = set()
+    routed = asyncio.Queue(maxsize=PENDING_FILES)
+    os.makedirs(drop_folder, exist_ok=True)
+    print(f"Watching {drop_folder} for new drop files")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        tasks = [asyncio.create_task(watch_folder(drop_folder, files, queued, poll_seconds)),
+                 asyncio.create_task(route_files(files, routed, pool, segment_keys))]
+        try:
+            await commit_files(routed, queued, data_folder, weighted_folder, stop_after)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run_live(sys.argv[1] if len(sys.argv) > 1 else DROP_FOLDER))
+    except KeyboardInterrupt:
+        print("Stopped")
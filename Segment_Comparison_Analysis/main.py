@@ -1,5 +1,14 @@
-import pandas as pd
 import os
+import shutil
+from contextlib import ExitStack
+from raw_cache import iter_chunks, cached_dates
+from grid_filter import chunk_cell_ids, grid_mask
+from segments import load_segments
+from manifest import pending_scans, record_scans, covered_segments
+from segment_writer import SegmentWriter, DEFAULT_BUFFER_ROWS
+from instrument import stage, count
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 INPUT_FILES = [
     'raw_data/July.csv',
@@ -9,293 +18,31 @@ INPUT_FILES = [
 
 ##kriging method to use
 
-ROAD_SEGMENTS = {
-    'mecidiyekoy_d100': {
-        'name': 'Mecidiyeköy D100',
-        'grid_points': [
-            (41.0641479492188, 28.9874267578125),
-            (41.0696411132813, 28.9874267578125),
-            (41.0641479492188, 28.9984130859375),
-            (41.0641479492188, 29.0093994140625),
-            (41.0696411132813, 29.0093994140625)
-        ],
-        'road_geometry': [
-            (41.067182876360135, 28.98215768289143),
-            (41.066502096679706, 28.996652709932523),
-            (41.066870394042816, 29.010029912119386) 
-        ],
-        'output_filename': 'Mecidiyekoy_D100.csv',
-    },
-    'besiktas_meydan': {
-        'name': 'Besiktas Meydan',
-        'grid_points': [
-            (41.0421752929688, 29.0093994140625)
-        ],
-        'road_geometry': [
-            (41.041547423801894, 29.0040906695881),
-            (41.043937064646315, 29.014436643156362)
-        ],
-        'output_filename': 'Besiktas_Meydan.csv',
-    },
-        'kopru': {
-        'name': '15 Temmuz Köprüsü',
-        'grid_points': [
-            (41.0476684570313, 29.0313720703125),
-            (41.0421752929688, 29.0313720703125),
-            (41.0421752929688, 29.0423583984375)
-        ],
-        'road_geometry': [
-            (41.0407267606662, 29.03917836678557),
-            (41.04983196056567, 29.02968830103479)
-        ],
-        'output_filename': 'kopru.csv',
-    },
-    'buyukdere': {
-        'name': 'Buyukdere',
-        'grid_points': [
-            (41.0861206054688, 29.0093994140625),
-            (41.0806274414063, 29.0093994140625),
-            (41.0806274414063, 29.0093994140625)
-        ],
-        'road_geometry': [
-            (41.08633384273805, 29.007006849366046),
-            (41.08535310553135, 29.007423228765294),
-            (41.078293683837586, 29.012975956962265),
-        ],
-        'output_filename': 'Buyukdere.csv',
-    },
-        'cendere': {
-        'name': 'Cendere Yolu',
-        'grid_points': [
-            (41.0806274414063, 28.9764404296875),
-            (41.0861206054688, 28.9764404296875),
-            (41.0861206054688, 28.9874267578125),
-            (41.0916137695313, 28.9874267578125),
-        ],
-        'road_geometry': [
-            (41.0801939407255, 28.975130232849637),
-            (41.08357027188313, 28.976991474401203),
-            (41.089551656529615, 28.984825051573196),
-            (41.0912164812101, 28.985090943338836)
-        ],
-        'output_filename': 'cendere.csv',
-    },
-        'avcilar': {
-        'name': 'Avcılar Metrobüs',
-        'grid_points': [
-            (40.9982299804688, 28.7017822265625),
-            (40.9927368164063, 28.7127685546875),
-            (40.9872436523438, 28.7127685546875),
-            (40.9872436523438, 28.7237548828125)
-        ],
-        'road_geometry': [
-            (40.98583172130115, 28.721995915589016),
-            (40.99869821987855, 28.699997098937985)
-        ],
-        'output_filename': 'avcilar.csv',
-    },
-        'beylikduzu': {
-        'name': 'Beylikdüzü E5',
-        'grid_points': [
-            (41.0092163085938, 28.6578369140625),
-            (41.0092163085938, 28.6468505859375),
-            (41.0147094726563, 28.6468505859375),
-            (41.0147094726563, 28.6358642578125)
-        ],
-        'road_geometry': [
-            (41.01691183367701, 28.63720453966137),
-            (41.00655953054434, 28.665063278971022)
-        ],
-        'output_filename': 'beylikduzu.csv',
-    },
-        'bakirkoy': {
-        'name': 'Bakırköy - İncirli E5',
-        'grid_points': [
-            (40.9927368164063, 28.8555908203125),
-            (40.9927368164063, 28.8665771484375),
-            (40.9982299804688, 28.8665771484375),
-            (40.9982299804688, 28.8775634765625),
-            (41.0037231445313, 28.8885498046875),
-        ],
-        'road_geometry': [
-            (40.99189400632875, 28.852042716278085),
-            (41.00328781985447, 28.890711855469082),
-            (41.00666486194534, 28.895898070395827)
-        ],
-        'output_filename': 'bakirkoy.csv',
-    },
-        'topkapi': {
-        'name': 'Topkapı - E5',
-        'grid_points': [
-            (41.0202026367188, 28.9324951171875),
-            (41.0147094726563, 28.9434814453125),
-            (41.0202026367188, 28.9434814453125)
-        ],
-        'road_geometry': [
-            (41.01229952317056, 28.947066948948223),
-            (41.02307236167235, 28.931463308670303),
-        ],
-        'output_filename': 'topkapi.csv',
-    },
-        'eminonu': {
-        'name': 'Eminönü - Unkapanı Köprüsü',
-        'grid_points': [
-            (41.0256958007813, 28.9654541015625)
-        ],
-        'road_geometry': [
-            (41.022873299187985, 28.962399273962568),
-            (41.02534205127624, 28.967640786815554),
-        ],
-        'output_filename': 'eminonu.csv',
-    },
-        'karakoy': {
-        'name': 'Karaköy - Galata Köprüsü',
-        'grid_points': [
-            (41.0202026367188, 28.9764404296875)
-        ],
-        'road_geometry': [
-            (41.01828025641374, 28.971927686071574),
-            (41.021830671442146, 28.974476045911704),
-        ],
-        'output_filename': 'karakoy.csv',
-    },   
-        'okmeydani': {
-        'name': 'Okmeydanı - TEM Bağlantısı',
-        'grid_points': [
-            (41.0586547851563, 28.9654541015625),
-            (41.0531616210938, 28.9544677734375)
-        ],
-        'road_geometry': [
-            (41.05041382625551, 28.94844384864544),
-            (41.056999249970794, 28.962363548496498),
-            (41.06047129894944, 28.966094875149416)
-        ],
-        'output_filename': 'okmeydani.csv',
-    },
-        'kadikoy': {
-        'name': 'Kadıköy - Rıhtım',
-        'grid_points': [
-            (40.9927368164063, 29.0313720703125),
-            (40.9927368164063, 29.0203857421875),
-        ],
-        'road_geometry': [
-            (40.99602861741476, 29.02437520867931),
-            (40.992809975882146, 29.024842111678193),
-            (40.99142379717707, 29.024188447479755),
-            (40.99046050328627, 29.029293253600944),
-            (40.99264734680128, 29.034911267063638)
-        ],
-        'output_filename': 'kadikoy.csv',
-    },
-        'altunizade': {
-        'name': 'Altunizade - D100',
-        'grid_points': [
-            (41.0366821289063, 29.0423583984375),
-            (41.0311889648438, 29.0423583984375),
-            (41.0256958007813, 29.0423583984375)
-        ],
-        'road_geometry': [
-            (41.0394497542302, 29.040563299602624),
-            (41.0365633937752, 29.04339603116141),
-            (41.032814684782245, 29.045185124777486),
-            (41.027041255435506, 29.045781489316177),
-            (41.0229545609317, 29.047520886057733)
-        ],
-        'output_filename': 'altunizade.csv',
-    },                
-        'kozyatagi': {
-        'name': 'Kozyatağı - D100',
-        'grid_points': [
-            (40.9872436523438, 29.0863037109375),
-            (40.9817504882813, 29.0972900390625),
-            (40.9762573242188, 29.0972900390625)
-        ],
-        'road_geometry': [
-            (40.98928387828026, 29.081979952062287),
-            (40.98727004278125, 29.086716022081777),
-            (40.984829861657055, 29.090934154621486),
-            (40.98087181490753, 29.095270552559498),
-            (40.9752765766202, 29.099133889025445)
-        ],
-        'output_filename': 'kozyatagi.csv',
-    },
-        'atasehir': {
-        'name': 'Ataşehir - Finans Merkezi',
-        'grid_points': [
-            (40.9872436523438, 29.1082763671875),
-            (40.9927368164063, 29.1082763671875),
-            (40.9927368164063, 29.1192626953125)
-        ],
-        'road_geometry': [
-            (40.984476937885766, 29.10407655178869),
-            (40.9897218950238, 29.110833591261134),
-            (40.99467775555119, 29.115104550172966),
-        ],
-        'output_filename': 'atasehir.csv',
-    },        
-        'umraniye': {
-        'name': 'Ümraniye - TEM',
-        'grid_points': [
-            (41.0311889648438, 29.1192626953125),
-            (41.0311889648438, 29.1082763671875),
-            (41.0256958007813, 29.1302490234375)
-        ],
-        'road_geometry': [
-            (41.02907379193722, 29.105262640919836),
-            (41.02934581952999, 29.110220890111766),
-            (41.03101196401253, 29.115922876682486),
-            (41.02805367845497, 29.124644887761008),
-            (41.027441602744574, 29.12782267521026),
-            (41.02847872762489, 29.131225837155633)
-        ],
-        'output_filename': 'umraniye.csv',
-    },
-        'pendik': {
-        'name': 'Pendik - D100',
-        'grid_points': [
-            (40.8663940429688, 29.2730712890625),
-            (40.8718872070313, 29.2730712890625),
-            (40.8718872070313, 29.2620849609375),
-            (40.8773803710938, 29.2620849609375)
-        ],
-        'road_geometry': [
-            (40.87965529556967, 29.25817439793402),
-            (40.877512473495244, 29.262148232769306),
-            (40.8651899003452, 29.27413134724261),
-        ],
-        'output_filename': 'pendik.csv',
-    },
-        'kartal': {
-        'name': 'Kartal - D100',
-        'grid_points': [
-            (40.9048461914063, 29.2071533203125),
-            (40.9103393554688, 29.2071533203125),
-            (40.9103393554688, 29.1961669921875),
-            (40.9048461914063, 29.2181396484375)
-        ],
-        'road_geometry': [
-            (40.91266313003761, 29.191518974243706),
-            (40.90755847409568, 29.20795396421816),
-            (40.903253319564136, 29.215580049236312),
-        ],
-        'output_filename': 'kartal.csv',
-    },             
-        'fsm': {
-        'name': 'FSM Köprüsü',
-        'grid_points': [
-            (41.0916137695313, 29.0533447265625),
-            (41.0916137695313, 29.0643310546875),
-            (41.0916137695313, 29.0753173828125),
-        ],
-        'road_geometry': [
-            (41.090865767588014, 29.051531386950376),
-            (41.091940755151136, 29.076038713325193),
-        ],
-        'output_filename': 'fsm.csv',
-    },                      
-}
-
-def extract_road_segment(segment_key, input_files, chunk_size=100000):
+ROAD_SEGMENTS = load_segments()
+DATA_FOLDER = 'relevant_data'
+
+def segment_output_path(segment_key, data_folder=DATA_FOLDER):
+    return os.path.join(data_folder, ROAD_SEGMENTS[segment_key]['output_filename'])
+
+def report_segment_output(segment_key, rows, data_folder=DATA_FOLDER, append=False):
+    if rows == 0:
+        if append:
+            print(f"No new data for {segment_key}.")
+        else:
+            print(f"No data found for {segment_key} in any input files.")
+    elif append:
+        print(f"Appended {rows:,} rows to {segment_output_path(segment_key, data_folder)}")
+    else:
+        print(f"Saved {rows:,} rows to {segment_output_path(segment_key, data_folder)}")
+
+def extract_road_segment(segment_key, input_files, chunk_size=100000, incremental=False,
+                         buffer_rows=DEFAULT_BUFFER_ROWS):
+    """Extracts one segment, returns the number of rows written."""
+    
+    if incremental:
+        # Manifest-driven append, see extract_all_segments
+        return extract_all_segments(input_files, [segment_key], chunk_size, incremental=True,
+                                    buffer_rows=buffer_rows).get(segment_key)
     
     segment = ROAD_SEGMENTS[segment_key]
     grid_points = segment.get('grid_points', [])
@@ -304,42 +51,207 @@ def extract_road_segment(segment_key, input_files, chunk_size=100000):
         print(f"No grid points for segment '{segment_key}'")
         return None
     
-    grid_points_set = set(grid_points)
+    cell_set = segment['cell_ids']
     
-    filtered_chunks = []
-    filtered_rows = 0
-    
-    for file_path in input_files:
-        print(f"Processing file: {file_path}")
-        
-        for chunk in pd.read_csv(file_path, chunksize=chunk_size):
-            
-            chunk_coords = pd.Series(list(zip(chunk['LATITUDE'], chunk['LONGITUDE'])))
-            mask = chunk_coords.isin(grid_points_set)
-            
-            filtered_chunk = chunk[mask.values]
+    # Matched rows are streamed to the output instead of being kept in memory
+    with stage(f'extract {segment_key}') as s, \
+         SegmentWriter(segment_output_path(segment_key), buffer_rows=buffer_rows) as writer:
+        for file_path in input_files:
+            print(f"Processing file: {file_path}")
             
-            if not filtered_chunk.empty:
-                filtered_chunks.append(filtered_chunk)
-                filtered_rows += len(filtered_chunk)
-
-    if filtered_chunks:
-        print(f"Combine and save data for {segment['name']}...")
-        result_df = pd.concat(filtered_chunks, ignore_index=True)
-        
-        data_folder = 'relevant_data'
-        
-        output_filename = segment['output_filename']
-        output_path = os.path.join(data_folder, output_filename)
-        result_df.to_csv(output_path, index=False)
-        print(f"Saved to {output_path}")
-        
-        return result_df
+            for chunk in iter_chunks(file_path, chunk_size=chunk_size):
+                
+                mask = grid_mask(chunk, cell_set)
+                
+                writer.write(chunk[mask])
+        s.rows_out = writer.rows_written
+
+    report_segment_output(segment_key, writer.rows_written)
+    return writer.rows_written
+
+
+def build_cell_index(segment_keys):
+    """Maps every grid cell id to the keys of the segments that contain it."""
+    cell_index = {}
+    for segment_key in segment_keys:
+        for cell in ROAD_SEGMENTS[segment_key]['cell_ids']:
+            cell_index.setdefault(int(cell), []).append(segment_key)
+    return cell_index
+
+def route_rows(file_path, segment_keys, dates=None, chunk_size=100000):
+    """
+    Reads one raw file (or only the given cached days of it) and yields
+    (segment_key, DataFrame) pairs with the matching rows of each chunk, in file order.
+    """
+    cell_index = build_cell_index(segment_keys)
+    all_cells = np.array(sorted(cell_index), dtype=np.int64)
+    segment_sets = {key: ROAD_SEGMENTS[key]['cell_ids'] for key in segment_keys}
+
+    for chunk in iter_chunks(file_path, chunk_size=chunk_size, dates=dates):
+
+        chunk_cells = chunk_cell_ids(chunk)
+        mask = np.isin(chunk_cells, all_cells)
+
+        if not mask.any():
+            continue
+
+        matched = chunk[mask]
+        matched_cells = chunk_cells[mask]
+
+        # Only the segments owning one of the matched cells need a mask
+        hit_segments = {key for cell in np.unique(matched_cells) for key in cell_index[int(cell)]}
+
+        for key in hit_segments:
+            segment_mask = np.isin(matched_cells, segment_sets[key])
+            yield key, matched[segment_mask]
+
+def _route_work_unit(unit):
+    """
+    Worker side of extract_all_segments: streams one unit's matches into
+    header-less part files. Returns {segment_key: (part path, columns, rows)}
+    and the unit's counters (rows read, bytes read, chunks) for the parent stage.
+    """
+    unit_id, file_path, dates, segment_keys, chunk_size, part_folder, buffer_rows = unit
+    if dates is None:
+        print(f"Processing file: {file_path}")
     else:
-        print(f"No data found for {segment_key} in any input files.")
-        return None
+        print(f"Processing file: {file_path} ({dates[0]} .. {dates[-1]})")
+
+    writers = {}
+    with stage('extract unit', unit=unit_id, file=file_path) as s:
+        for key, part in route_rows(file_path, segment_keys, dates=dates, chunk_size=chunk_size):
+            if key not in writers:
+                part_path = os.path.join(part_folder, f"unit{unit_id:05d}_{key}.csv")
+                writers[key] = SegmentWriter(part_path, buffer_rows=buffer_rows, header=False)
+            writers[key].write(part)
+
+        parts = {key: (writer.path, writer.columns, writer.close()) for key, writer in writers.items()}
+        s.rows_out = sum(rows for _, _, rows in parts.values())
+
+    return parts, (s.rows_in, s.bytes_read, s.chunks)
+
+def make_work_units(input_files, segment_keys, n_workers, chunk_size=100000):
+    """
+    Splits the input into ordered work units. Cached files are split into
+    groups of consecutive days so a single month can use several workers,
+    plain CSVs are one unit each.
+    """
+    units = []
+    for file_path in input_files:
+        dates = cached_dates(file_path)
+        if n_workers == 1 or not dates:
+            units.append((file_path, None, segment_keys, chunk_size))
+            continue
+
+        n_groups = min(len(dates), n_workers)
+        for group in np.array_split(np.array(dates), n_groups):
+            units.append((file_path, list(group), segment_keys, chunk_size))
+    return units
+
+def _extend_range(ranges, key, writer, start):
+    """Extends ranges[key] to cover what the writer wrote since it was at byte start."""
+    end = writer.tell()
+    start = max(start, writer.data_start)
+    ranges[key] = [ranges[key][0], end] if key in ranges else [min(start, end), end]
+
+def extract_all_segments(input_files, segment_keys=None, chunk_size=100000, n_workers=1,
+                         incremental=False, data_folder=DATA_FOLDER, buffer_rows=DEFAULT_BUFFER_ROWS):
+    """
+    Single-pass version of extract_road_segment.
+    Every raw file is read once and each matching row is routed to all
+    segments that share its grid cell, so the cost no longer grows with
+    the number of segments.
+    n_workers > 1 (None = all cores) processes the files, or day ranges of
+    cached files, in worker processes. Results are merged in input order, so
+    the outputs are the same as with n_workers=1.
+    incremental=True uses the manifest in data_folder: only raw files and
+    segments that were not extracted before are scanned, and their rows are
+    appended to the existing outputs. The scans are recorded once every output
+    is complete; if the run fails first, the appended rows are truncated away.
+    Rows are streamed to the outputs through SegmentWriter, buffer_rows caps
+    how many matched rows are held in memory per segment.
+    Returns {segment_key: rows written}.
+    """
+    if segment_keys is None:
+        segment_keys = list(ROAD_SEGMENTS)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    for key in segment_keys:
+        if len(ROAD_SEGMENTS[key]['cell_ids']) == 0:
+            print(f"No grid points for segment '{key}'")
+    segment_keys = [key for key in segment_keys if len(ROAD_SEGMENTS[key]['cell_ids'])]
+
+    if incremental:
+        output_paths = {key: segment_output_path(key, data_folder) for key in segment_keys}
+        work = pending_scans(data_folder, input_files, output_paths)
+        append_keys = covered_segments(data_folder)
+        if not work:
+            print("All input files are already extracted.")
+            return {}
+    else:
+        append_keys = set()
+        work = {file_path: segment_keys for file_path in input_files}
+
+    scanned_keys = [key for key in segment_keys if any(key in keys for keys in work.values())]
+    file_rows = {file_path: dict.fromkeys(keys, 0) for file_path, keys in work.items()}
+    # Byte range each file's rows take up in each output, see manifest.py
+    file_ranges = {file_path: {} for file_path in work}
+
+    # An exception anywhere below removes partial outputs and truncates appended ones
+    with stage('extract', workers=n_workers, files=len(work), segments=len(scanned_keys)) as s, \
+         ExitStack() as writer_stack:
+        writers = {key: writer_stack.enter_context(
+                       SegmentWriter(segment_output_path(key, data_folder), append=key in append_keys,
+                                     buffer_rows=buffer_rows))
+                   for key in scanned_keys}
+        if n_workers == 1:
+            for file_path, keys in work.items():
+                print(f"Processing file: {file_path}")
+                starts = {key: writers[key].tell() for key in keys}
+                with stage(f'extract {os.path.basename(file_path)}'):
+                    for key, part in route_rows(file_path, keys, chunk_size=chunk_size):
+                        writers[key].write(part)
+                        file_rows[file_path][key] += len(part)
+                        count(rows_out=len(part))
+                for key in keys:
+                    _extend_range(file_ranges[file_path], key, writers[key], starts[key])
+        else:
+            part_folder = os.path.join(data_folder, '_parts')
+            os.makedirs(part_folder, exist_ok=True)
+
+            units = []
+            for file_path, keys in work.items():
+                units.extend(make_work_units([file_path], keys, n_workers, chunk_size))
+            units = [(unit_id,) + unit + (part_folder, buffer_rows) for unit_id, unit in enumerate(units)]
+
+            try:
+                with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                    # map() yields in submission order, which keeps the merge deterministic
+                    for unit, (unit_result, (rows_in, bytes_read, chunks)) in zip(units, pool.map(_route_work_unit, units)):
+                        for key, (part_path, columns, rows) in unit_result.items():
+                            start = writers[key].tell()
+                            writers[key].append_part(part_path, columns, rows)
+                            _extend_range(file_ranges[unit[1]], key, writers[key], start)
+                            file_rows[unit[1]][key] += rows
+                            count(rows_out=rows)
+                        count(rows_in=rows_in, bytes_read=bytes_read, chunks=chunks)
+            finally:
+                # Parts are removed as they are merged, a failed run may leave some behind
+                shutil.rmtree(part_folder, ignore_errors=True)
+
+        results = {}
+        for key, writer in writers.items():
+            results[key] = writer.close()
+
+        if incremental:
+            # Commit step: the outputs only count as extracted once this is saved
+            record_scans(data_folder, file_rows, {key: segment_output_path(key, data_folder) for key in scanned_keys},
+                         file_ranges)
 
+    for key in scanned_keys:
+        report_segment_output(key, results[key], data_folder, append=key in append_keys)
+    return results
 
 if __name__ == '__main__':
-    for segment_key in ROAD_SEGMENTS:
-        extract_road_segment(segment_key, input_files=INPUT_FILES)
\ No newline at end of file
+    extract_all_segments(input_files=INPUT_FILES, n_workers=None, incremental=True)
@@ -0,0 +1,166 @@
+# Manifest of the raw files already extracted into an output folder.
+# For every raw file it keeps a fingerprint (size, mtime, hash of the first MiB), the
+# number of rows written for each segment and the byte range those rows fill in the
+# segment's output, so re-runs only scan what is missing: a new month is scanned for
+# all segments, a new segment for all months, and a changed month has its old rows cut
+# out of the outputs and is scanned again (its rows move to the end of the outputs).
+# It also keeps the size of every output as of the last recorded run. Outputs are
+# appended to in place, so bytes past that size come from a run that stopped before
+# recording its scans, and are truncated away before anything is appended again.
+
+import os
+import json
+import shutil
+import hashlib
+
+MANIFEST_FILENAME = '_manifest.json'
+HASH_BYTES = 1024 * 1024
+
+
+def fingerprint(path):
+    """Cheap identity of a raw file, None if only its Parquet cache is left."""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head_hash = hashlib.sha1(f.read(HASH_BYTES)).hexdigest()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'head_sha1': head_hash}
+
+def load_manifest(folder):
+    manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(folder, manifest):
+    os.makedirs(folder, exist_ok=True)
+    manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def covered_segments(folder):
+    """Segment keys that already have rows from at least one recorded raw file."""
+    return {key for entry in load_manifest(folder)['files'].values() for key in entry['segments']}
+
+def _cut_range(path, start, end):
+    """Removes bytes [start, end) from a file, written beside it and swapped in."""
+    with open(path, 'rb') as src, open(path + '.tmp', 'wb') as out:
+        out.write(src.read(start))
+        src.seek(end)
+        shutil.copyfileobj(src, out)
+    os.replace(path + '.tmp', path)
+
+def _shift_ranges(files, key, after, delta):
+    """Moves the recorded ranges of a segment that start at or after `after` by delta bytes."""
+    for entry in files.values():
+        ranges = entry.get('ranges', {})
+        if key in ranges and ranges[key][0] >= after:
+            ranges[key] = [ranges[key][0] + delta, ranges[key][1] + delta]
+
+def pending_scans(folder, input_files, output_paths, config=None):
+    """
+    Returns {raw file: [segment keys still to scan]} for the segments in output_paths
+    ({segment_key: output csv path}).
+    A raw file which has changed since is scanned again: its byte range is cut out
+    of the outputs of the segments it fed. Segments whose output was deleted or
+    does not match the manifest, or whose rows of a changed file have no recorded
+    range (older manifests), lose their coverage and are rescanned from scratch.
+    A different config (e.g. the extracted dates) resets the whole manifest.
+    Callers overwrite the output of segments not in covered_segments() and
+    append to the others, then record everything with record_scans().
+    """
+    manifest = load_manifest(folder)
+    files = manifest['files']
+    outputs = manifest.setdefault('outputs', {})
+    dirty = False
+
+    if config is not None and manifest.get('config') != config:
+        if files:
+            print("Extraction settings changed, rebuilding all outputs")
+        files.clear()
+        outputs.clear()
+        manifest['config'] = config
+        dirty = True
+
+    # Roll back rows appended after the last record_scans()
+    stale = set()
+    for key, output in outputs.items():
+        output_path = os.path.join(folder, output['file'])
+        if not os.path.exists(output_path):
+            continue
+        size = os.path.getsize(output_path)
+        if size > output['size']:
+            print(f"Removing {size - output['size']:,} bytes an interrupted run appended to {output_path}")
+            with open(output_path, 'r+b') as f:
+                f.truncate(output['size'])
+        elif size < output['size']:
+            stale.add(key)
+
+    changed = set()
+    for path in input_files:
+        entry = files.get(path)
+        current = fingerprint(path)
+        if entry and current is not None and entry['fingerprint'] != current:
+            changed.add(path)
+
+    for path in changed:
+        ranges = files[path].get('ranges', {})
+        for key in files[path]['segments']:
+            output = outputs.get(key)
+            output_path = os.path.join(folder, output['file']) if output else None
+            if key in stale or key not in ranges or output is None or not os.path.exists(output_path):
+                stale.add(key)
+                continue
+            start, end = ranges[key]
+            if end > start:
+                print(f"{path} changed, removing its rows from {output_path}")
+                _cut_range(output_path, start, end)
+                _shift_ranges(files, key, end, start - end)
+                output['size'] -= end - start
+    for key, output_path in output_paths.items():
+        covered = any(key in entry['segments'] for entry in files.values())
+        if covered and not os.path.exists(output_path):
+            stale.add(key)
+
+    for key in stale:
+        print(f"Rebuilding {key} from scratch")
+        for entry in files.values():
+            entry['segments'].pop(key, None)
+            entry.get('ranges', {}).pop(key, None)
+        outputs.pop(key, None)
+    for path in changed:
+        del files[path]
+
+    if dirty or changed or stale:
+        save_manifest(folder, manifest)
+
+    work = {}
+    for path in input_files:
+        covered = files.get(path, {}).get('segments', {})
+        todo = [key for key in output_paths if key not in covered]
+        if todo:
+            work[path] = todo
+    return work
+
+def record_scans(folder, file_rows, output_paths, file_ranges=None):
+    """
+    Marks raw files as extracted, {raw file: {segment_key: rows written}}, with
+    the byte range of those rows in each output ({raw file: {segment_key: [start, end]}}),
+    and stores the current size of the outputs ({segment_key: output csv path}),
+    in one manifest write. Call it once all writers of the run are closed.
+    """
+    manifest = load_manifest(folder)
+    for path, segment_rows in file_rows.items():
+        entry = manifest['files'].setdefault(path, {'fingerprint': fingerprint(path), 'segments': {}})
+        entry['segments'].update({key: int(rows) for key, rows in segment_rows.items()})
+        if file_ranges and path in file_ranges:
+            entry.setdefault('ranges', {}).update(
+                {key: [int(start), int(end)] for key, (start, end) in file_ranges[path].items()})
+    outputs = manifest.setdefault('outputs', {})
+    for key, output_path in output_paths.items():
+        if os.path.exists(output_path):
+            # Relative to the folder, which can be moved or copied as a whole
+            outputs[key] = {'file': os.path.relpath(output_path, folder), 'size': os.path.getsize(output_path)}
+    save_manifest(folder, manifest)
@@ -0,0 +1,402 @@
+# Runs the whole workflow as one dependency graph:
+#   extract -> weight -> compare, anomalies              (named segments)
+#   baseline_extract -> baseline_weight -+
+#   holiday_extract  -> holiday_weight  -+-> season_compare
+#   baseline_extract -> segment_map,  grid_map
+#   grid -> extract, baseline_extract, holiday_extract   (grid file for the spatial index)
+# A stage's key hashes its code, settings, raw inputs and the content of its upstream
+# outputs. Stages whose key and outputs match PIPELINE_STATE are skipped, so an
+# upstream re-run that writes identical files does not trigger the stages below it.
+# Independent stages (e.g. the baseline and holiday branches) run in parallel processes.
+# Run from the repository root:
+#   python Segment_Comparison_Analysis/pipeline.py                 # everything
+#   python Segment_Comparison_Analysis/pipeline.py season_compare  # one target and what it needs
+#   python Segment_Comparison_Analysis/pipeline.py --dry-run
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEASON_DIR = os.path.join(CODE_DIR, '..', 'Season_Comparison')
+sys.path.append(SEASON_DIR)
+
+# Figures are saved to files, plt.show() must not block a pipeline run
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from segments import load_segments, SEGMENTS_FILE
+from manifest import fingerprint
+from raw_cache import cache_path_for, SOURCE_MARKER
+from instrument import stage
+
+PIPELINE_STATE = '.pipeline_state.json'
+HASH_BLOCK = 1024 * 1024
+
+# Output folders, the defaults the scripts read from when run by hand
+RELEVANT_FOLDER = 'relevant_data'
+WEIGHTED_FOLDER = 'weighted_data'
+BASELINE_FOLDER = 'Season_Comparison/season_baseline_data'
+HOLIDAY_FOLDER = 'Season_Comparison/holiday_data'
+WEIGHTED_BASELINE_FOLDER = 'Season_Comparison/weighted_baseline'
+WEIGHTED_HOLIDAY_FOLDER = 'Season_Comparison/weighted_holiday'
+
+# Segment cell sets come from segments.geojson and, for segments without grid_points,
+# from the grid index (spatial_index over the grid stage's file)
+READ_MODULES = ['raw_cache', 'schema', 'date_filter', 'grid_filter', 'segments', 'segment_writer',
+                'spatial_index', 'geo']
+
+
+# --- Stage bodies (run in worker processes) ---
+
+def run_grid():
+    import visualize_grid
+    import spatial_index
+    visualize_grid.discover_grid(visualize_grid.MASTER_DATA_PATH, output_path=spatial_index.GRID_FILE)
+
+def run_extract():
+    import main
+    main.extract_all_segments(main.INPUT_FILES, n_workers=None, incremental=True, data_folder=RELEVANT_FOLDER)
+
+def run_weight():
+    import weight
+    for key in weight.ROAD_SEGMENTS:
+        weight.apply_weights_to_segment(key, RELEVANT_FOLDER, WEIGHTED_FOLDER)
+
+def run_compare():
+    import compare_segments
+    compare_segments.main()
+
+def run_anomalies():
+    import anomaly
+    anomaly.update_scores(WEIGHTED_FOLDER)
+
+def run_baseline_extract():
+    import extract_data_from_master as baseline
+    for key in baseline.ROAD_SEGMENTS:
+        baseline.extract_road_segment(key, baseline.INPUT_FILES, data_folder=BASELINE_FOLDER)
+
+def run_holiday_extract():
+    import extract_holiday_data as holiday
+    for key in holiday.ROAD_SEGMENTS:
+        holiday.extract_holiday_data(key, holiday.INPUT_FILES, incremental=True, output_folder=HOLIDAY_FOLDER)
+
+def run_baseline_weight():
+    import weighting
+    for key in weighting.ROAD_SEGMENTS:
+        weighting.apply_weights_to_segment(key, BASELINE_FOLDER, WEIGHTED_BASELINE_FOLDER)
+
+def run_holiday_weight():
+    import weighting
+    for key in weighting.ROAD_SEGMENTS:
+        weighting.apply_weights_to_segment(key, HOLIDAY_FOLDER, WEIGHTED_HOLIDAY_FOLDER)
+
+def run_season_compare():
+    import compare
+    compare.main()
+
+def run_segment_map():
+    import visualize_map
+    keys = list(visualize_map.ROAD_SEGMENTS) if visualize_map.SEGMENT_KEY is None else [visualize_map.SEGMENT_KEY]
+    for key in keys:
+        visualize_map.create_map_for_segment(key)
+
+def run_grid_map():
+    import visualize_grid
+    visualize_grid.visualize_master_grid(visualize_grid.MASTER_DATA_PATH)
+
+
+# --- Graph ---
+
+def _segment_files(catalogue, folder, prefix=''):
+    return [os.path.join(folder, prefix + s['output_filename']) for s in load_segments(catalogue).values()]
+
+def _store_files(catalogue, folder):
+    import series_store
+    return [path for s in load_segments(catalogue).values() if 'road_geometry' in s
+            for path in series_store.store_files(folder, s['output_filename'])]
+
+def build_stages():
+    """
+    {name: stage} in run order. A stage has the function to run, the stages it
+    needs, the modules whose code it depends on, its raw inputs and its outputs.
+    """
+    import main
+    import extract_data_from_master as baseline
+    import extract_holiday_data as holiday
+    import visualize_map
+    import visualize_grid
+    import anomaly
+    import spatial_index
+
+    weighted_segments = [s for s in load_segments().values() if 'road_geometry' in s]
+    segment_key = visualize_map.SEGMENT_KEY
+    map_segments = list(visualize_map.ROAD_SEGMENTS) if segment_key is None else [segment_key]
+
+    return {
+        # Only this stage writes the grid file, the extract stages read it as an upstream output
+        'grid': dict(
+            run=run_grid, needs=[],
+            code=['visualize_grid', 'raw_cache', 'schema', 'date_filter'],
+            raw=[visualize_grid.MASTER_DATA_PATH],
+            outputs=[spatial_index.GRID_FILE]),
+        'extract': dict(
+            run=run_extract, needs=['grid'],
+            code=['main', 'manifest'] + READ_MODULES,
+            raw=main.INPUT_FILES,
+            outputs=_segment_files(None, RELEVANT_FOLDER)),
+        'weight': dict(
+            run=run_weight, needs=['extract'],
+            code=['weight', 'main', 'geo', 'schema', 'segments', 'series_store', 'instrument'],
+            outputs=[os.path.join(WEIGHTED_FOLDER, 'weighted_' + s['output_filename']) for s in weighted_segments]
+                    + _store_files(None, WEIGHTED_FOLDER)),
+        'compare': dict(
+            run=run_compare, needs=['weight'],
+            code=['compare_segments', 'dtw', 'clustering', 'profile_cube', 'series_store', 'schema'],
+            outputs=['maps/dtw_distance_matrix.png', 'maps/segment_clusters.png', 'maps/cluster_profiles.png']),
+        'anomalies': dict(
+            run=run_anomalies, needs=['weight'],
+            code=['anomaly', 'dtw', 'profile_cube', 'schema'],
+            outputs=[os.path.join(WEIGHTED_FOLDER, anomaly.SCORES_FILENAME)]),
+        'baseline_extract': dict(
+            run=run_baseline_extract, needs=['grid'],
+            code=['extract_data_from_master'] + READ_MODULES,
+            settings={'weeks': baseline.TARGET_WEEKS},
+            raw=baseline.INPUT_FILES,
+            outputs=_segment_files('season', BASELINE_FOLDER)),
+        'holiday_extract': dict(
+            run=run_holiday_extract, needs=['grid'],
+            code=['extract_holiday_data', 'manifest'] + READ_MODULES,
+            settings={'dates': sorted(holiday.ALL_HOLIDAY_DATES)},
+            raw=holiday.INPUT_FILES,
+            outputs=_segment_files('season', HOLIDAY_FOLDER)),
+        'baseline_weight': dict(
+            run=run_baseline_weight, needs=['baseline_extract'],
+            code=['weighting', 'weight', 'main', 'geo', 'schema', 'segments', 'series_store'],
+            outputs=_segment_files('season', WEIGHTED_BASELINE_FOLDER, 'weighted_')
+                    + _store_files('season', WEIGHTED_BASELINE_FOLDER)),
+        'holiday_weight': dict(
+            run=run_holiday_weight, needs=['holiday_extract'],
+            code=['weighting', 'weight', 'main', 'geo', 'schema', 'segments', 'series_store'],
+            outputs=_segment_files('season', WEIGHTED_HOLIDAY_FOLDER, 'weighted_')
+                    + _store_files('season', WEIGHTED_HOLIDAY_FOLDER)),
+        'season_compare': dict(
+            run=run_season_compare, needs=['baseline_weight', 'holiday_weight'],
+            code=['compare', 'dtw', 'profile_cube', 'series_store', 'schema'],
+            outputs=['global_seasonality_line_graph.png', 'density_line_comparison.png',
+                     'dtw_similarity_matrix.png', 'density_comparison_bars.png']),
+        'segment_map': dict(
+            run=run_segment_map, needs=['baseline_extract'],
+            code=['visualize_map', 'cell_layers', 'animated_map', 'main', 'segments', 'spatial_index', 'geo',
+                  'raw_cache', 'grid_filter', 'manifest', 'schema'],
+            settings={'segments': map_segments, 'render_mode': visualize_map.RENDER_MODE},
+            outputs=[visualize_map.map_path(key, visualize_map.RENDER_MODE)
+                     for key in map_segments if key in visualize_map.ROAD_SEGMENTS]),
+        'grid_map': dict(
+            run=run_grid_map, needs=[],
+            code=['visualize_grid', 'cell_layers', 'tile_pyramid'] + READ_MODULES,
+            settings={'render_mode': visualize_grid.RENDER_MODE},
+            raw=[visualize_grid.MASTER_DATA_PATH],
+            outputs=[visualize_grid.OUTPUT_FILE]),
+    }
+
+
+# --- Hashing ---
+
+def file_hash(path):
+    """sha1 of a file's content, None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _module_path(module):
+    for folder in (CODE_DIR, SEASON_DIR):
+        path = os.path.join(folder, module + '.py')
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No module {module} in {CODE_DIR} or {SEASON_DIR}")
+
+def raw_state(path):
+    """
+    Identity of a raw input (a monthly file or the grid file). Raw files are too big to hash in full, the
+    manifest fingerprint is used instead (or the cache marker if only the cache is left).
+    """
+    state = fingerprint(path)
+    if state is None:
+        marker = os.path.join(cache_path_for(path), SOURCE_MARKER)
+        state = {'cache': file_hash(marker)}
+    return state
+
+def output_hashes(spec):
+    return {path: file_hash(path) for path in spec['outputs']}
+
+def stage_key(name, spec, upstream_outputs):
+    """Hash of everything the stage's result depends on."""
+    key = {
+        'stage': name,
+        'code': {module: file_hash(_module_path(module)) for module in sorted(set(spec['code']))},
+        'segments': file_hash(SEGMENTS_FILE),
+        'settings': spec.get('settings', {}),
+        'raw': {path: raw_state(path) for path in spec.get('raw', [])},
+        'upstream': upstream_outputs,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_state(path=PIPELINE_STATE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path=PIPELINE_STATE):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+# --- Runner ---
+
+def _run_stage(name):
+    """Worker process body."""
+    spec = build_stages()[name]
+    for path in spec['outputs']:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with stage(f'pipeline {name}'):
+        spec['run']()
+
+def select_stages(stages, targets):
+    """The targets and every stage they need, in run order."""
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stages[name]['needs'])
+    return [name for name in stages if name in selected]
+
+def run_pipeline(targets=None, force=False, dry_run=False, n_workers=None):
+    """
+    Runs the targets (default: all stages) and whatever they need, skipping
+    stages that are up to date. Returns {stage: 'ran' | 'skipped' | 'failed' | 'blocked'}.
+    """
+    stages = build_stages()
+    names = select_stages(stages, targets or list(stages))
+    state = load_state()
+    status = {}
+    running = {}        # future -> stage name
+    ran_upstream = set()
+
+    def upstream_of(name):
+        return {need: state[need]['outputs'] for need in stages[name]['needs']}
+
+    def is_current(name, key):
+        entry = state.get(name)
+        return (not force and entry is not None and entry['key'] == key
+                and entry['outputs'] == output_hashes(stages[name]))
+
+    with ProcessPoolExecutor(max_workers=n_workers or len(names)) as pool:
+        while len(status) < len(names):
+            started = False
+            for name in names:
+                if name in status or name in running.values():
+                    continue
+                needs = stages[name]['needs']
+                if any(status.get(need) in ('failed', 'blocked') for need in needs):
+                    status[name] = 'blocked'
+                    print(f"[{name}] not run, an upstream stage failed")
+                    continue
+                if not all(need in status for need in needs):
+                    continue
+
+                if dry_run:
+                    if any(need in ran_upstream for need in needs):
+                        # Upstream outputs are not known before it has run
+                        print(f"[{name}] would run after {', '.join(n for n in needs if n in ran_upstream)}")
+                        ran_upstream.add(name)
+                    elif is_current(name, stage_key(name, stages[name], upstream_of(name))):
+                        print(f"[{name}] up to date")
+                    else:
+                        print(f"[{name}] would run")
+                        ran_upstream.add(name)
+                    status[name] = 'skipped'
+                    started = True
+                    continue
+
+                key = stage_key(name, stages[name], upstream_of(name))
+                if is_current(name, key):
+                    print(f"[{name}] up to date")
+                    status[name] = 'skipped'
+                    started = True
+                    continue
+
+                print(f"[{name}] running")
+                future = pool.submit(_run_stage, name)
+                future.key = key
+                future.start = time.perf_counter()
+                running[future] = name
+                started = True
+
+            if started or not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                seconds = time.perf_counter() - future.start
+                try:
+                    future.result()
+                except Exception:
+                    traceback.print_exc()
+                    print(f"[{name}] failed after {seconds:.1f} s")
+                    status[name] = 'failed'
+                    continue
+
+                state[name] = {
+                    'key': future.key,
+                    'outputs': output_hashes(stages[name]),
+                    'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'seconds': round(seconds, 2),
+                }
+                save_state(state)
+                status[name] = 'ran'
+                print(f"[{name}] done in {seconds:.1f} s")
+
+    return status
+
+def main():
+    stages = build_stages()
+    parser = argparse.ArgumentParser(description='Runs the traffic analysis stages that are out of date.')
+    parser.add_argument('targets', nargs='*', help=f"stages to bring up to date, from {', '.join(stages)} (default: all)")
+    parser.add_argument('--force', action='store_true', help='run the selected stages even if up to date (extractors stay incremental, see manifest.py)')
+    parser.add_argument('--dry-run', action='store_true', help='only show what would run')
+    parser.add_argument('--workers', type=int, default=None, help='stages run at the same time')
+    parser.add_argument('--list', action='store_true', help='show the stages and their dependencies')
+    args = parser.parse_args()
+
+    unknown = set(args.targets) - set(stages)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if args.list:
+        state = load_state()
+        for name, spec in stages.items():
+            needs = ', '.join(spec['needs']) or '-'
+            last = state.get(name, {}).get('finished', 'never')
+            print(f"{name:<18} needs {needs:<36} last run {last}")
+        return
+
+    status = run_pipeline(args.targets, force=args.force, dry_run=args.dry_run, n_workers=args.workers)
+    if any(s in ('failed', 'blocked') for s in status.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# Materialized segment x date x hour aggregate of the weighted segment files.
+# The cube is stored next to the CSVs it summarizes and only the files that are new
+# or changed since the last build are re-read, so profile queries no longer need to
+# parse every weighted CSV again.
+
+import pandas as pd
+import numpy as np
+import os
+import json
+import warnings
+from schema import read_traffic_csv
+from instrument import stage
+
+CUBE_FILENAME = '_profile_cube.parquet'
+MANIFEST_FILENAME = '_profile_cube.json'
+WEIGHTED_PREFIX = 'weighted_'
+
+CUBE_COLUMNS = ['SEGMENT', 'DATE', 'HOUR',
+                'VEH_SUM', 'VEH_MEAN', 'VEH_COUNT',
+                'SPEED_SUM', 'SPEED_MEAN', 'SPEED_COUNT']
+
+# In-process cache: folder -> (manifest, cube)
+_loaded_cubes = {}
+
+
+def segment_name(filename):
+    """Segment files are keyed by their output_filename, without the weighted_ prefix."""
+    if filename.startswith(WEIGHTED_PREFIX):
+        return filename[len(WEIGHTED_PREFIX):]
+    return filename
+
+def _source_files(folder):
+    """Maps segment name -> file to use, preferring weighted_ files over raw ones."""
+    sources = {}
+    for f in sorted(os.listdir(folder)):
+        if not f.endswith('.csv') or f.startswith('_'):
+            # Underscore files are bookkeeping (e.g. anomaly scores), not segments
+            continue
+        name = segment_name(f)
+        if name not in sources or f.startswith(WEIGHTED_PREFIX):
+            sources[name] = f
+    return sources
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def aggregate_frame(df, segment):
+    """Hourly aggregate of one segment's rows (needs DATE_TIME, NUMBER_OF_VEHICLES, AVERAGE_SPEED)."""
+    date_time = pd.to_datetime(df['DATE_TIME'])
+    keys = [date_time.dt.normalize().rename('DATE'), date_time.dt.hour.rename('HOUR')]
+
+    cube = df.groupby(keys).agg(
+        VEH_SUM=('NUMBER_OF_VEHICLES', 'sum'),
+        VEH_MEAN=('NUMBER_OF_VEHICLES', 'mean'),
+        VEH_COUNT=('NUMBER_OF_VEHICLES', 'count'),
+        SPEED_SUM=('AVERAGE_SPEED', 'sum'),
+        SPEED_MEAN=('AVERAGE_SPEED', 'mean'),
+        SPEED_COUNT=('AVERAGE_SPEED', 'count'),
+    ).reset_index()
+    # uint16 inputs sum to uint64, the stored cube keeps int64 sums
+    for column in ('VEH_SUM', 'SPEED_SUM'):
+        if pd.api.types.is_unsigned_integer_dtype(cube[column]):
+            cube[column] = cube[column].astype(np.int64)
+    cube.insert(0, 'SEGMENT', segment)
+    return cube[CUBE_COLUMNS]
+
+def _aggregate_file(path, segment):
+    df = read_traffic_csv(path, usecols=['DATE_TIME', 'NUMBER_OF_VEHICLES', 'AVERAGE_SPEED'])
+    return aggregate_frame(df, segment)
+
+def _read_manifest(folder):
+    manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+    cube_path = os.path.join(folder, CUBE_FILENAME)
+    if not (os.path.exists(manifest_path) and os.path.exists(cube_path)):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def load_cube(folder):
+    """
+    Returns the cube for a folder of segment CSVs, rebuilding only the
+    segments whose source file was added, changed or removed.
+    """
+    if not os.path.exists(folder):
+        print(f"Directory not found: {folder}")
+        return None
+
+    sources = _source_files(folder)
+    wanted = {name: dict(file=f, **_file_state(os.path.join(folder, f))) for name, f in sources.items()}
+
+    if folder in _loaded_cubes and _loaded_cubes[folder][0] == wanted:
+        return _loaded_cubes[folder][1]
+
+    manifest = _read_manifest(folder)
+    # An empty manifest also means no stored cube, a folder without segment files is built below
+    if manifest and manifest == wanted:
+        cube = pd.read_parquet(os.path.join(folder, CUBE_FILENAME))
+        _loaded_cubes[folder] = (wanted, cube)
+        return cube
+
+    if manifest:
+        cube = pd.read_parquet(os.path.join(folder, CUBE_FILENAME))
+    else:
+        cube = pd.DataFrame(columns=CUBE_COLUMNS)
+
+    stale = [name for name in manifest if manifest[name] != wanted.get(name)]
+    fresh = [name for name in wanted if manifest.get(name) != wanted[name]]
+    cube = cube[~cube['SEGMENT'].isin(stale)]
+
+    parts = [cube] if len(cube) else []
+    with stage('profile cube', folder=folder) as s:
+        for name in fresh:
+            print(f"Updating profile cube: {sources[name]}")
+            path = os.path.join(folder, sources[name])
+            part = _aggregate_file(path, name)
+            s.count(rows_out=len(part), bytes_read=os.path.getsize(path), chunks=1)
+            parts.append(part)
+
+    if parts:
+        cube = pd.concat(parts, ignore_index=True)
+    cube = cube.sort_values(['SEGMENT', 'DATE', 'HOUR'], ignore_index=True)
+
+    cube.to_parquet(os.path.join(folder, CUBE_FILENAME), index=False)
+    with open(os.path.join(folder, MANIFEST_FILENAME), 'w') as f:
+        json.dump(wanted, f, indent=2)
+
+    _loaded_cubes[folder] = (wanted, cube)
+    return cube
+
+def merge_into_cube(folder, cube, frames):
+    """
+    Adds rows that were just appended to the folder's segment files to the cube
+    loaded before the append, and stores the result as current, so load_cube does
+    not re-read those files. frames: {file name in folder: appended rows}.
+    """
+    parts = [aggregate_frame(df, segment_name(f)) for f, df in frames.items() if len(df)]
+    if not parts:
+        return cube
+
+    # Sums and counts add up, means are derived from them again
+    merged = pd.concat([cube] + parts, ignore_index=True)
+    totals = merged.groupby(['SEGMENT', 'DATE', 'HOUR'], as_index=False)[
+        ['VEH_SUM', 'VEH_COUNT', 'SPEED_SUM', 'SPEED_COUNT']].sum()
+    totals['VEH_MEAN'] = totals['VEH_SUM'] / totals['VEH_COUNT']
+    totals['SPEED_MEAN'] = totals['SPEED_SUM'] / totals['SPEED_COUNT']
+    cube = totals[CUBE_COLUMNS]
+
+    manifest = _read_manifest(folder)
+    for f in frames:
+        manifest[segment_name(f)] = dict(file=f, **_file_state(os.path.join(folder, f)))
+
+    cube.to_parquet(os.path.join(folder, CUBE_FILENAME), index=False)
+    with open(os.path.join(folder, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    _loaded_cubes[folder] = (manifest, cube)
+    return cube
+
+def select(cube, segment=None, dates=None, weekdays=None):
+    """Cube rows for one segment, optional 'YYYY-MM-DD' dates and days of week (0 = Monday)."""
+    mask = np.ones(len(cube), dtype=bool)
+    if segment is not None:
+        mask &= (cube['SEGMENT'] == segment).to_numpy()
+    if dates is not None:
+        mask &= cube['DATE'].isin(pd.to_datetime(list(dates))).to_numpy()
+    if weekdays is not None:
+        mask &= cube['DATE'].dt.dayofweek.isin(list(weekdays)).to_numpy()
+    return cube[mask]
+
+def hourly_profile(rows, value='sum'):
+    """
+    24-value profile of the selected cube rows.
+    value='sum': total vehicles per hour, value='mean': mean vehicles per record.
+    """
+    grouped = rows.groupby('HOUR')[['VEH_SUM', 'VEH_COUNT']].sum()
+    if value == 'mean':
+        profile = grouped['VEH_SUM'] / grouped['VEH_COUNT']
+    else:
+        profile = grouped['VEH_SUM']
+    return profile.reindex(range(24), fill_value=0).values
+
+def day_tensor(cube, value='VEH_SUM', segments=None, dates=None, weekdays=None, fill=np.nan):
+    """
+    Dense segment x day x hour array of one cube column, filled in one scatter.
+    segments / dates / weekdays restrict the rows as in select(). Hours without
+    data get `fill`. Returns (tensor, segment names, dates as a DatetimeIndex).
+    """
+    rows = select(cube, dates=dates, weekdays=weekdays)
+    if segments is not None:
+        rows = rows[rows['SEGMENT'].isin(list(segments)).to_numpy()]
+
+    segment_codes, segment_names = pd.factorize(rows['SEGMENT'], sort=True)
+    day_codes, days = pd.factorize(rows['DATE'], sort=True)
+
+    tensor = np.full((len(segment_names), len(days), 24), fill, dtype=np.float64)
+    tensor[segment_codes, day_codes, rows['HOUR'].to_numpy()] = rows[value].to_numpy(dtype=np.float64)
+    return tensor, list(segment_names), pd.DatetimeIndex(days)
+
+def minmax_scale(profiles):
+    """
+    Scales every profile (last axis) to 0-1 like MinMaxScaler; flat profiles become 0.
+    Profiles without any value (no data that day) stay all NaN.
+    """
+    profiles = np.asarray(profiles, dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # All-NaN slices
+        low = np.nanmin(profiles, axis=-1, keepdims=True)
+        span = np.nanmax(profiles, axis=-1, keepdims=True) - low
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = np.where(span > 0, (profiles - low) / span, 0.0)
+    return np.where(np.isnan(span), np.nan, scaled)
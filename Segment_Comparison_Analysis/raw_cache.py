@@ -0,0 +1,157 @@
+# Columnar cache for the raw monthly traffic CSVs.
+# Each month is converted once into a Parquet dataset partitioned by day, so later
+# runs can read only the columns and days they need without re-parsing the CSV.
+
+import numpy as np
+import os
+import glob
+import json
+from date_filter import filter_chunks, dates_to_days, iso_weeks
+from schema import read_traffic_csv, compact_frame
+from instrument import count, counted
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Anchored to the repository root (like spatial_index.GRID_FILE inside it), so scripts
+# run from Season_Comparison/ or benchmarks/ share one cache
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'raw_cache')
+RAW_FOLDER = 'raw_data'
+PARTITION_COLUMN = 'DATE'
+SOURCE_MARKER = '_source.json'
+
+
+def cache_path_for(csv_path, cache_folder=CACHE_FOLDER):
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_folder, name)
+
+def _source_info(csv_path):
+    stat = os.stat(csv_path)
+    return {'source': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def is_cached(csv_path, cache_folder=CACHE_FOLDER):
+    """True if the cache exists and was built from the current version of the CSV."""
+    marker_path = os.path.join(cache_path_for(csv_path, cache_folder), SOURCE_MARKER)
+    if pa is None or not os.path.exists(marker_path):
+        return False
+    if not os.path.exists(csv_path):
+        # Raw file was removed after ingest, the cache is all we have
+        return True
+
+    with open(marker_path) as f:
+        marker = json.load(f)
+    info = _source_info(csv_path)
+    # The cache is named after the file only, a same-named CSV in another folder is a different file
+    return (marker['source'] == info['source'] and marker['size'] == info['size']
+            and marker['mtime'] == info['mtime'])
+
+def ingest_csv(csv_path, cache_folder=CACHE_FOLDER, chunk_size=1000000):
+    """Converts one raw CSV into a typed Parquet dataset partitioned by DATE."""
+    if pa is None:
+        raise ImportError("pyarrow is required to build the Parquet cache")
+
+    output_path = cache_path_for(csv_path, cache_folder)
+    if os.path.exists(output_path):
+        # Rebuild from scratch so stale partitions do not survive
+        for old_file in glob.glob(os.path.join(output_path, '**', '*.parquet'), recursive=True):
+            os.remove(old_file)
+    os.makedirs(output_path, exist_ok=True)
+
+    print(f"Ingesting {csv_path} -> {output_path}")
+    total_rows = 0
+
+    # Stored with the compact schema, so cached reads come back compact too
+    for chunk_num, chunk in enumerate(read_traffic_csv(csv_path, chunksize=chunk_size)):
+        chunk[PARTITION_COLUMN] = chunk['DATE_TIME'].dt.strftime('%Y-%m-%d')
+
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        pq.write_to_dataset(
+            table,
+            root_path=output_path,
+            partition_cols=[PARTITION_COLUMN],
+            basename_template=f"chunk{chunk_num:05d}-{{i}}.parquet"
+        )
+        total_rows += len(chunk)
+
+    info = _source_info(csv_path)
+    info['rows'] = total_rows
+    with open(os.path.join(output_path, SOURCE_MARKER), 'w') as f:
+        json.dump(info, f, indent=2)
+
+    print(f"  -> {total_rows:,} rows cached")
+    return output_path
+
+def cached_dates(file_path, cache_folder=CACHE_FOLDER):
+    """Sorted 'YYYY-MM-DD' partitions of a cached file, empty if it is not cached."""
+    if not is_cached(file_path, cache_folder):
+        return []
+    prefix = PARTITION_COLUMN + '='
+    cache_path = cache_path_for(file_path, cache_folder)
+    return sorted(name[len(prefix):] for name in os.listdir(cache_path) if name.startswith(prefix))
+
+def _open_dataset(csv_path, cache_folder=CACHE_FOLDER):
+    partitioning = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+    return ds.dataset(cache_path_for(csv_path, cache_folder), format='parquet', partitioning=partitioning)
+
+def _dates_in_weeks(partition_dates, weeks):
+    days = dates_to_days(partition_dates)
+    keep = set(days[np.isin(iso_weeks(days), list(weeks))].tolist())
+    return [d for d, day in zip(sorted(partition_dates), days) if day in keep]
+
+def iter_chunks(file_path, chunk_size=100000, columns=None, dates=None, weeks=None,
+                assume_sorted=False, cache_folder=CACHE_FOLDER):
+    """
+    Yields DataFrame chunks (compact schema, see schema.py) for a raw monthly file.
+    Reads from the Parquet cache when it is up to date (column projection and
+    day-partition pruning), otherwise falls back to chunked pd.read_csv with
+    the prefix-based date filter.
+    dates: optional list of 'YYYY-MM-DD' strings to keep.
+    weeks: optional list of ISO week numbers to keep.
+    assume_sorted: CSV rows are ordered by DATE_TIME (enables chunk skipping).
+    Rows, chunks and bytes read are counted in the running instrument stage.
+    """
+    if is_cached(file_path, cache_folder):
+        dataset = _open_dataset(file_path, cache_folder)
+        if columns is None:
+            columns = [name for name in dataset.schema.names if name != PARTITION_COLUMN]
+
+        partitions = None
+        if dates is not None:
+            partitions = sorted(set(dates))
+        if weeks is not None:
+            partitions = _dates_in_weeks(partitions or cached_dates(file_path, cache_folder), weeks)
+
+        row_filter = None
+        if partitions is not None:
+            row_filter = ds.field(PARTITION_COLUMN).isin(partitions)
+
+        # Partition files selected by the filter (upper bound, columns are projected)
+        count(bytes_read=sum(os.path.getsize(fragment.path) for fragment in dataset.get_fragments(filter=row_filter)))
+
+        scanner = dataset.scanner(columns=list(columns), filter=row_filter, batch_size=chunk_size)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                # No-op for caches built with the compact schema
+                yield from counted([compact_frame(batch.to_pandas())])
+        return
+
+    count(bytes_read=os.path.getsize(file_path))
+    if dates is None and weeks is None:
+        yield from counted(read_traffic_csv(file_path, chunksize=chunk_size, usecols=columns))
+        return
+
+    # DATE_TIME is only parsed for the rows left after the prefix date filter
+    chunks = read_traffic_csv(file_path, parse_dates=False, chunksize=chunk_size, usecols=columns)
+    for chunk in filter_chunks(chunks, dates=dates, weeks=weeks, assume_sorted=assume_sorted):
+        yield from counted([compact_frame(chunk)])
+
+if __name__ == '__main__':
+    for csv_path in sorted(glob.glob(os.path.join(RAW_FOLDER, '*.csv'))):
+        if is_cached(csv_path):
+            print(f"Up to date: {csv_path}")
+            continue
+        ingest_csv(csv_path)
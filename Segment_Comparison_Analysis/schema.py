@@ -0,0 +1,92 @@
+# Compact column types for the IBB hourly traffic frames.
+# Every CSV read and write of raw, segment and weighted traffic data goes through
+# here, so chunks use datetime64 time stamps, uint16 counts and speeds, a
+# categorical GEOHASH cell id and float32 coordinates instead of pandas' defaults.
+
+import pandas as pd
+import numpy as np
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Counts and speeds of one cell-hour are far below 65535
+COUNT_COLUMNS = ['MINIMUM_SPEED', 'MAXIMUM_SPEED', 'AVERAGE_SPEED',
+                 'NUMBER_OF_VEHICLES', 'ORIGINAL_VEHICLES']
+COUNT_DTYPE = np.uint16
+COORD_COLUMNS = ['LATITUDE', 'LONGITUDE']
+CELL_COLUMN = 'GEOHASH'
+
+# Types that can be given to read_csv directly, the rest is done by compact_frame
+CSV_DTYPES = {CELL_COLUMN: 'category'}
+
+
+def _fits_counts(values):
+    if not pd.api.types.is_integer_dtype(values):
+        return False
+    if len(values) == 0:
+        return True
+    return values.min() >= 0 and values.max() <= np.iinfo(COUNT_DTYPE).max
+
+def _fits_float32(values):
+    """IBB coordinates are geohash cell centers, which float32 holds exactly."""
+    if values.dtype != np.float64:
+        return False
+    return np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True)
+
+def parse_times(values):
+    """
+    DATE_TIME text to datetime64. The export format is parsed with the fast fixed
+    format, other layouts (no seconds, ISO 'T', fractions) fall back to per-value parsing.
+    """
+    try:
+        return pd.to_datetime(values, format=DATE_FORMAT)
+    except ValueError:
+        return pd.to_datetime(values, format='mixed')
+
+def compact_frame(df, parse_dates=True):
+    """
+    Returns df converted to the compact schema.
+    Columns are only narrowed when no value changes: counts out of the uint16
+    range (or with missing values) and coordinates that float32 cannot hold
+    exactly keep their type, so cell ids and outputs stay the same.
+    """
+    updates = {}
+    if parse_dates and 'DATE_TIME' in df and not pd.api.types.is_datetime64_any_dtype(df['DATE_TIME']):
+        updates['DATE_TIME'] = parse_times(df['DATE_TIME'])
+
+    for column in COUNT_COLUMNS:
+        if column in df and df[column].dtype != COUNT_DTYPE and _fits_counts(df[column].to_numpy()):
+            updates[column] = df[column].astype(COUNT_DTYPE)
+
+    for column in COORD_COLUMNS:
+        if column in df and _fits_float32(df[column].to_numpy()):
+            updates[column] = df[column].astype(np.float32)
+
+    if CELL_COLUMN in df and not isinstance(df[CELL_COLUMN].dtype, pd.CategoricalDtype):
+        updates[CELL_COLUMN] = df[CELL_COLUMN].astype('category')
+
+    return df.assign(**updates) if updates else df
+
+def read_traffic_csv(path, parse_dates=True, **kwargs):
+    """
+    pd.read_csv with the compact schema. Accepts the usual read_csv arguments,
+    with chunksize an iterator of compact chunks is returned.
+    parse_dates=False keeps DATE_TIME as text (e.g. for the prefix date filter).
+    """
+    reader = pd.read_csv(path, dtype=CSV_DTYPES, **kwargs)
+    if kwargs.get('chunksize') is None:
+        return compact_frame(reader, parse_dates)
+    return (compact_frame(chunk, parse_dates) for chunk in reader)
+
+def csv_frame(df):
+    """
+    Frame to hand to to_csv. float32 coordinates are written at float64
+    precision, otherwise 40.91583251953125 would be printed as 40.915833.
+    """
+    narrow = [column for column in COORD_COLUMNS if column in df and df[column].dtype == np.float32]
+    if narrow:
+        df = df.astype({column: np.float64 for column in narrow})
+    return df
+
+def write_traffic_csv(df, path, **kwargs):
+    """df.to_csv with the formats read_traffic_csv expects back."""
+    csv_frame(df).to_csv(path, index=False, date_format=DATE_FORMAT, **kwargs)
@@ -0,0 +1,148 @@
+# Buffered, appendable CSV writer for per-segment extraction outputs.
+# Extractors hand every matched chunk to a SegmentWriter instead of collecting them
+# for one final pd.concat, so peak memory is bounded by buffer_rows, not by the
+# number of months extracted.
+
+import os
+import shutil
+import pandas as pd
+from schema import write_traffic_csv
+
+DEFAULT_BUFFER_ROWS = 200000
+
+
+def _header_columns(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        line = f.readline().rstrip('\r\n')
+    return line.split(',') if line else None
+
+
+class SegmentWriter:
+    """
+    Writes DataFrame chunks to one CSV file.
+    append=True adds to an existing file (no second header); otherwise rows go to
+    a '.partial' file that replaces the output on close(), so an interrupted run
+    never leaves a half-written output behind. abort() (or an exception in a
+    with block, also after close()) removes the partial file, or truncates an
+    appended file back to its size before the writer opened it. An output the
+    writer created (append=True on a missing file) is deleted again, even after close().
+    Rows appended to an existing file are put in the order of its header columns.
+    Nothing is created if no rows are written.
+    """
+
+    def __init__(self, path, append=False, buffer_rows=DEFAULT_BUFFER_ROWS, header=True):
+        self.path = path
+        self.append = append and os.path.exists(path)
+        # Asked to append to a file that is not there yet, abort() deletes what close() created
+        self.created = append and not self.append
+        self.buffer_rows = buffer_rows
+        self.header = header and not self.append
+        self.rows_written = 0
+        self.columns = _header_columns(path) if self.append and header else None
+
+        self._buffer = []
+        self._buffered = 0
+        self._target = path if self.append else path + '.partial'
+        self._started = False
+        self._closed = False
+        # Size of the output before this writer, an abort truncates back to it
+        self.base_size = os.path.getsize(path) if self.append else 0
+        # Offset of the first row this writer writes (after the header)
+        self.data_start = self.base_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open_target(self):
+        if not self._started:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            if not self.append and os.path.exists(self._target):
+                os.remove(self._target)
+            if self.header:
+                # Written once up front, so every row block after it is header-less
+                with open(self._target, 'w', encoding='utf-8', newline='') as out:
+                    out.write(','.join(self.columns) + '\n')
+            self._started = True
+            self.data_start = os.path.getsize(self._target) if os.path.exists(self._target) else 0
+
+    def write(self, df):
+        if df.empty:
+            return
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            df = df[self.columns]
+        self._buffer.append(df)
+        self._buffered += len(df)
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._open_target()
+        block = self._buffer[0] if len(self._buffer) == 1 else pd.concat(self._buffer, ignore_index=True)
+        # Fixed formats keep separately flushed blocks consistent (pandas drops the
+        # time part of a block where all values are at midnight)
+        write_traffic_csv(block, self._target, mode='a', header=False)
+        self.rows_written += len(block)
+        self._buffer = []
+        self._buffered = 0
+
+    def append_part(self, part_path, columns, rows):
+        """Appends a header-less CSV part file (written by a worker) and deletes it."""
+        self.flush()
+        if self.columns is not None and list(columns) != self.columns:
+            # Different column order than the output, reordered as text so values stay as written
+            self.write(pd.read_csv(part_path, header=None, names=list(columns), dtype=str,
+                                   keep_default_na=False)[self.columns])
+            self.flush()
+            os.remove(part_path)
+            return
+        if self.columns is None:
+            self.columns = list(columns)
+        self._open_target()
+        with open(self._target, 'a', encoding='utf-8', newline='') as out:
+            with open(part_path, encoding='utf-8', newline='') as part:
+                shutil.copyfileobj(part, out)
+        os.remove(part_path)
+        self.rows_written += rows
+
+    def tell(self):
+        """Flushes the buffer and returns the size of the output so far, in bytes."""
+        self.flush()
+        if self._started:
+            return os.path.getsize(self.path if self._closed else self._target)
+        return self.base_size
+
+    def abort(self):
+        """
+        Drops everything this writer wrote. Appended rows are truncated away even
+        after close(), so a with block that fails later still leaves no rows behind.
+        """
+        self._buffer = []
+        self._buffered = 0
+        if self.append:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.base_size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self.base_size)
+        elif self._started and not self._closed and os.path.exists(self._target):
+            os.remove(self._target)
+        elif self.created and self._started and self._closed and os.path.exists(self.path):
+            os.remove(self.path)
+        self.rows_written = 0
+
+    def close(self):
+        if self._closed:
+            return self.rows_written
+        self.flush()
+        if self._started and not self.append:
+            os.replace(self._target, self.path)
+        self._closed = True
+        return self.rows_written
@@ -0,0 +1,61 @@
+# Road segment registry.
+# All segment definitions live in segments.geojson (one Feature per segment, GeoJSON
+# [lon, lat] order). They are loaded once per process into the dict layout the
+# scripts already use, plus precomputed cell ids, a polyline array and a bounding box.
+# A feature without 'grid_points' gets every grid cell within AUTO_CELLS_K * SIGMA_KM
+# of its road geometry from the spatial index.
+
+import numpy as np
+import os
+import json
+from functools import lru_cache
+from grid_filter import make_cell_set
+from spatial_index import load_grid_index
+
+SEGMENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'segments.geojson')
+AUTO_CELLS_SIGMA_KM = 0.5   # Same as SIGMA_KM in weight.py
+AUTO_CELLS_K = 2            # Cells further than K sigma get a weight below ~0.14
+
+
+@lru_cache(maxsize=None)
+def _read_features(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['features']
+
+def _build_segment(feature):
+    props = feature['properties']
+    # GeoJSON stores [lon, lat], the scripts work with (lat, lon)
+    road_geometry = [(lat, lon) for lon, lat in feature['geometry']['coordinates']]
+    if 'grid_points' in props:
+        grid_points = [(lat, lon) for lon, lat in props['grid_points']]
+    else:
+        grid_points = load_grid_index().points_near(road_geometry, AUTO_CELLS_K * AUTO_CELLS_SIGMA_KM)
+
+    polyline = np.array(road_geometry, dtype=np.float64).reshape(-1, 2)
+    points = np.array(grid_points + road_geometry, dtype=np.float64).reshape(-1, 2)
+
+    segment = {
+        'name': props['name'],
+        'grid_points': grid_points,
+        'road_geometry': road_geometry,
+        'output_filename': props['output_filename'],
+        'cell_ids': make_cell_set(grid_points),
+        'polyline': polyline,
+        # (min_lat, min_lon, max_lat, max_lon) of the cells and the road together
+        'bbox': tuple(float(v) for v in np.concatenate([points.min(axis=0), points.max(axis=0)])),
+    }
+    return segment
+
+@lru_cache(maxsize=None)
+def load_segments(catalogue=None, path=SEGMENTS_FILE):
+    """
+    Returns {segment_key: segment} for every feature in the registry file.
+    catalogue: only keep segments listing this name in their 'catalogues'
+    property (e.g. 'season' for the Season_Comparison subset).
+    """
+    segments = {}
+    for feature in _read_features(path):
+        if catalogue is not None and catalogue not in feature['properties'].get('catalogues', []):
+            continue
+        segments[feature['id']] = _build_segment(feature)
+    return segments
@@ -0,0 +1,239 @@
+# Fixed-layout binary store of the weighted segment series, written next to the
+# weighted CSVs by the weighting scripts. Per segment, STORE_FOLDER holds
+#   <segment>.f32   float32 array of shape (channels, hours), C order, so every
+#                   channel is one contiguous hour-indexed series
+#   <segment>.json  header: first hour, number of hours and channel names
+# The series start at midnight and cover whole days, hour h is start + h hours and
+# hours without records are NaN. Readers memory-map the file, so a date range of a
+# channel (or its day x hour matrix) is a view, with no CSV parsing and no copy.
+
+import pandas as pd
+import numpy as np
+import os
+import json
+
+STORE_FOLDER = '_series'
+DTYPE = np.float32
+CHANNELS = ['VEHICLES', 'RECORDS', 'SPEED']    # Vehicle sum, record count, mean speed per hour
+VERSION = 1
+
+# In-process cache: data path -> (file state, header, memmap)
+_open_series = {}
+
+
+def store_folder(folder):
+    return os.path.join(folder, STORE_FOLDER)
+
+def _paths(folder, segment):
+    """Data and header path of a segment (its output_filename, e.g. 'avcilar.csv')."""
+    base = os.path.join(store_folder(folder), os.path.splitext(segment)[0])
+    return base + '.f32', base + '.json'
+
+def store_files(folder, segment):
+    """The files written for a segment, for pipeline outputs."""
+    return list(_paths(folder, segment))
+
+def hourly_series(df):
+    """
+    Hourly channels of one segment's rows (needs DATE_TIME, NUMBER_OF_VEHICLES,
+    AVERAGE_SPEED) on a full-day hour index. Returns (start, (channels, hours) array).
+    """
+    hours = pd.to_datetime(df['DATE_TIME']).dt.floor('h').rename('HOUR')
+    grouped = df.groupby(hours).agg(
+        VEHICLES=('NUMBER_OF_VEHICLES', 'sum'),
+        RECORDS=('NUMBER_OF_VEHICLES', 'count'),
+        SPEED=('AVERAGE_SPEED', 'mean'),
+    )
+    if grouped.empty:
+        return None, np.empty((len(CHANNELS), 0), dtype=DTYPE)
+
+    start = grouped.index.min().normalize()
+    end = grouped.index.max().normalize() + pd.Timedelta(days=1)
+    offsets = ((grouped.index - start) // pd.Timedelta(hours=1)).to_numpy()
+
+    data = np.full((len(CHANNELS), int((end - start) // pd.Timedelta(hours=1))), np.nan, dtype=DTYPE)
+    data[:, offsets] = grouped[CHANNELS].to_numpy(dtype=np.float64).T
+    return start, data
+
+def _write(folder, segment, start, data):
+    data_path, header_path = _paths(folder, segment)
+    os.makedirs(store_folder(folder), exist_ok=True)
+    header = {
+        'version': VERSION,
+        'segment': segment,
+        'start': f"{start:%Y-%m-%d %H:%M:%S}",
+        'hours': data.shape[1],
+        'channels': CHANNELS,
+        'dtype': np.dtype(DTYPE).str,
+    }
+    # Written beside the old files and swapped in, readers never see half a store
+    np.ascontiguousarray(data, dtype=DTYPE).tofile(data_path + '.tmp')
+    with open(header_path + '.tmp', 'w') as f:
+        json.dump(header, f, indent=2)
+    os.replace(data_path + '.tmp', data_path)
+    os.replace(header_path + '.tmp', header_path)
+    _open_series.pop(data_path, None)
+
+def write_series(folder, segment, df):
+    """Replaces a segment's series with the hourly channels of its weighted rows."""
+    start, data = hourly_series(df)
+    if start is None:
+        return None
+    _write(folder, segment, start, data)
+    return data.shape[1]
+
+def append_series(folder, segment, df):
+    """
+    Adds rows that were appended to a segment's weighted file to its series.
+    Hours already in the store are combined (sums and counts add up, the mean
+    speed is weighted by the record counts).
+    """
+    start, added = hourly_series(df)
+    if start is None:
+        return None
+    header, current = open_series(folder, segment)
+    if header is None:
+        _write(folder, segment, start, added)
+        return added.shape[1]
+
+    old_start = pd.Timestamp(header['start'])
+    new_start = min(start, old_start)
+    hours = max(old_start + pd.Timedelta(hours=header['hours']),
+                start + pd.Timedelta(hours=added.shape[1])) - new_start
+    data = np.full((len(CHANNELS), int(hours // pd.Timedelta(hours=1))), np.nan, dtype=np.float64)
+
+    old = int((old_start - new_start) // pd.Timedelta(hours=1))
+    data[:, old:old + current.shape[1]] = current
+    first = int((start - new_start) // pd.Timedelta(hours=1))
+    new = slice(first, first + added.shape[1])
+
+    vehicles, records, speed = (np.nan_to_num(data[i, new]) for i in range(3))
+    add_vehicles, add_records, add_speed = (np.nan_to_num(added[i]) for i in range(3))
+    total = records + add_records
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data[2, new] = (speed * records + add_speed * add_records) / total
+    data[0, new] = vehicles + add_vehicles
+    data[1, new] = total
+    data[:, new][:, total == 0] = np.nan
+
+    _write(folder, segment, new_start, data)
+    return data.shape[1]
+
+def read_header(folder, segment):
+    header_path = _paths(folder, segment)[1]
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path) as f:
+        header = json.load(f)
+    return header if header.get('version') == VERSION else None
+
+def open_series(folder, segment):
+    """(header, read-only (channels, hours) memmap) of a segment, (None, None) without a store."""
+    data_path = _paths(folder, segment)[0]
+    if not os.path.exists(data_path):
+        return None, None
+    stat = os.stat(data_path)
+    state = (stat.st_size, stat.st_mtime_ns)
+    if data_path in _open_series and _open_series[data_path][0] == state:
+        return _open_series[data_path][1:]
+
+    header = read_header(folder, segment)
+    if header is None or header['hours'] == 0:
+        return header, None
+    data = np.memmap(data_path, dtype=np.dtype(header['dtype']), mode='r',
+                     shape=(len(header['channels']), header['hours']))
+    _open_series[data_path] = (state, header, data)
+    return header, data
+
+def stored_segments(folder):
+    """Segments with a series store in the folder."""
+    folder = store_folder(folder)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f[:-len('.json')] + '.csv' for f in os.listdir(folder) if f.endswith('.json'))
+
+def _hour(header, when):
+    """Hour offset of a time stamp (or 'YYYY-MM-DD') in the series, clipped to its range."""
+    offset = (pd.Timestamp(when) - pd.Timestamp(header['start'])) // pd.Timedelta(hours=1)
+    return int(min(max(offset, 0), header['hours']))
+
+def load_series(folder, segment, channel='VEHICLES', start=None, end=None):
+    """
+    One channel of a segment for [start, end) as a view into the memory-mapped store.
+    start and end are time stamps or 'YYYY-MM-DD' dates, None for the whole series.
+    Returns (values, time stamp of the first value), (None, None) without a store.
+    """
+    header, data = open_series(folder, segment)
+    if data is None:
+        return None, None
+    first = 0 if start is None else _hour(header, start)
+    last = header['hours'] if end is None else _hour(header, end)
+    values = data[header['channels'].index(channel), first:max(first, last)]
+    return values, pd.Timestamp(header['start']) + pd.Timedelta(hours=first)
+
+def day_matrix(folder, segment, channel='VEHICLES', start=None, end=None):
+    """
+    Days x 24 hours of one channel for the days from start up to end (exclusive),
+    still a view into the store. Returns (matrix, DatetimeIndex of the days).
+    """
+    if start is not None:
+        start = pd.Timestamp(start).normalize()
+    if end is not None:
+        end = pd.Timestamp(end).normalize()
+    values, first = load_series(folder, segment, channel, start, end)
+    if values is None:
+        return None, None
+    matrix = values.reshape(-1, 24)
+    return matrix, pd.date_range(first, periods=len(matrix), freq='D')
+
+def day_tensor(folder, segments=None, channel='VEHICLES', weekdays=None):
+    """
+    Segment x day x hour array of one channel, like profile_cube.day_tensor: days
+    run over all segments' stores, days without any data and days of other
+    weekdays (0 = Monday) are left out. Returns (tensor, segment names, DatetimeIndex).
+    """
+    names = stored_segments(folder) if segments is None else [s for s in segments if read_header(folder, s)]
+    matrices = {}
+    for name in names:
+        matrix, days = day_matrix(folder, name, channel)
+        if matrix is not None:
+            matrices[name] = (matrix, days)
+    if not matrices:
+        return np.empty((0, 0, 24)), [], pd.DatetimeIndex([])
+
+    first = min(days[0] for _, days in matrices.values())
+    last = max(days[-1] for _, days in matrices.values())
+    all_days = pd.date_range(first, last, freq='D')
+    tensor = np.full((len(matrices), len(all_days), 24), np.nan)
+    for i, (matrix, days) in enumerate(matrices.values()):
+        offset = (days[0] - first).days
+        tensor[i, offset:offset + len(matrix)] = matrix
+
+    keep = ~np.isnan(tensor).all(axis=(0, 2))
+    if weekdays is not None:
+        keep &= all_days.dayofweek.isin(list(weekdays))
+    return tensor[:, keep], list(matrices), all_days[keep]
+
+def hourly_profile(folder, segment, value='sum', dates=None, weekdays=None):
+    """
+    24-value profile of a segment over the selected days, like profile_cube.hourly_profile.
+    value='sum': total vehicles per hour, value='mean': mean vehicles per record.
+    Returns None without a store or without data on the selected days.
+    """
+    vehicles, days = day_matrix(folder, segment, 'VEHICLES')
+    if vehicles is None:
+        return None
+    keep = np.ones(len(days), dtype=bool)
+    if dates is not None:
+        keep &= days.isin(pd.to_datetime(list(dates)))
+    if weekdays is not None:
+        keep &= days.dayofweek.isin(list(weekdays))
+    if np.isnan(vehicles[keep]).all():
+        return None
+
+    total = np.nansum(vehicles[keep], axis=0, dtype=np.float64)
+    if value == 'mean':
+        records = np.nansum(day_matrix(folder, segment, 'RECORDS')[0][keep], axis=0, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total = np.where(records > 0, total / records, 0.0)
+    return total
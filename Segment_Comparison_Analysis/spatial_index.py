@@ -0,0 +1,108 @@
+# Spatial index over the city grid discovered by visualize_grid.discover_grid.
+# Cells are hashed by their (row, col) position on the regular IBB grid, so the cells
+# around a road polyline are found by enumerating the few grid positions near each
+# edge instead of scanning the whole grid.
+
+import pandas as pd
+import numpy as np
+import os
+from functools import lru_cache
+from geo import distance_to_polyline, KM_PER_DEGREE
+from raw_cache import CACHE_FOLDER
+
+# In the raw cache folder, which is anchored to the repository root
+GRID_FILE = os.path.join(CACHE_FOLDER, 'grid_cells.csv')
+
+
+def _grid_step(values):
+    diffs = np.diff(np.unique(values))
+    diffs = diffs[diffs > 1e-9]
+    return float(np.median(diffs)) if len(diffs) else 1.0
+
+class GridIndex:
+    """Cell hash over a set of grid cell centers (arrays of lat and lon)."""
+
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+
+        self.lat_step = _grid_step(self.lats)
+        self.lon_step = _grid_step(self.lons)
+        self.lat_origin = self.lats.min() if len(self.lats) else 0.0
+        self.lon_origin = self.lons.min() if len(self.lons) else 0.0
+
+        rows, cols = self._position(self.lats, self.lons)
+        self.n_cols = int(cols.max()) + 3 if len(cols) else 1
+        keys = self._key(rows, cols)
+
+        order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[order]
+        self.sorted_cells = order
+
+    def _position(self, lats, lons):
+        rows = np.rint((np.asarray(lats) - self.lat_origin) / self.lat_step).astype(np.int64)
+        cols = np.rint((np.asarray(lons) - self.lon_origin) / self.lon_step).astype(np.int64)
+        return rows, cols
+
+    def _key(self, rows, cols):
+        return rows * self.n_cols + cols
+
+    def _lookup(self, rows, cols):
+        """Indices of existing cells at the given grid positions."""
+        inside = (cols >= 0) & (cols < self.n_cols) & (rows >= 0)
+        keys = self._key(rows[inside], cols[inside])
+        pos = np.searchsorted(self.sorted_keys, keys)
+        pos = np.clip(pos, 0, len(self.sorted_keys) - 1)
+        found = self.sorted_keys[pos] == keys
+        return self.sorted_cells[pos[found]]
+
+    def cells_near(self, geometry, radius_km):
+        """
+        Indices (into lats/lons) of every cell whose center lies within
+        radius_km of the polyline, ordered by distance.
+        """
+        if len(self.sorted_keys) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        vertices = np.asarray(geometry, dtype=np.float64).reshape(-1, 2)
+        lon_km = KM_PER_DEGREE * np.cos(np.radians(vertices[:, 0].mean()))
+        lat_pad = radius_km / KM_PER_DEGREE
+        lon_pad = radius_km / lon_km
+
+        # Candidate grid positions from the padded bounding box of every edge
+        edges = [(vertices[i], vertices[i+1]) for i in range(len(vertices) - 1)] or [(vertices[0], vertices[0])]
+        candidates = []
+        for p1, p2 in edges:
+            row_lo, col_lo = self._position(min(p1[0], p2[0]) - lat_pad, min(p1[1], p2[1]) - lon_pad)
+            row_hi, col_hi = self._position(max(p1[0], p2[0]) + lat_pad, max(p1[1], p2[1]) + lon_pad)
+            rows, cols = np.meshgrid(np.arange(row_lo, row_hi + 1), np.arange(col_lo, col_hi + 1), indexing='ij')
+            candidates.append(self._lookup(rows.ravel(), cols.ravel()))
+
+        cells = np.unique(np.concatenate(candidates))
+        if len(vertices) < 2:
+            dist = np.hypot((self.lats[cells] - vertices[0, 0]) * KM_PER_DEGREE,
+                            (self.lons[cells] - vertices[0, 1]) * lon_km)
+        else:
+            dist = distance_to_polyline(self.lats[cells], self.lons[cells], vertices)
+
+        keep = dist <= radius_km
+        return cells[keep][np.argsort(dist[keep], kind='stable')]
+
+    def points_near(self, geometry, radius_km):
+        """Same as cells_near but returns a list of (lat, lon) tuples."""
+        cells = self.cells_near(geometry, radius_km)
+        return list(zip(self.lats[cells].tolist(), self.lons[cells].tolist()))
+
+@lru_cache(maxsize=None)
+def load_grid_index(path=GRID_FILE):
+    """
+    GridIndex over the grid saved by visualize_grid.discover_grid, built once per process.
+    Raises FileNotFoundError without the grid file (not cached, so a later call retries):
+    an empty index would silently give segments without grid_points no cells at all.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Grid file not found: {path} (run the pipeline's grid stage or "
+                                f"visualize_grid.discover_grid(output_path=GRID_FILE), "
+                                f"or list grid_points for the segment in segments.geojson)")
+    grid = pd.read_csv(path)
+    return GridIndex(grid['LATITUDE'].to_numpy(), grid['LONGITUDE'].to_numpy())
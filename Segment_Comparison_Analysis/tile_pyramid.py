@@ -0,0 +1,236 @@
+# Static vector-tile pyramid of the city grid with per-cell traffic aggregates.
+# Cells (or, at low zoom, blocks of cells) are cut into z/x/y Web Mercator tiles on
+# disk, and the Leaflet page only loads the tiles in view. Tiles are small JS files
+# that hand their GeoJSON to the page, so the map also works when opened from disk
+# (browsers block fetch() of local files).
+
+import pandas as pd
+import numpy as np
+import os
+import json
+import shutil
+from branca.element import MacroElement
+from jinja2 import Template
+from raw_cache import iter_chunks
+from grid_filter import chunk_cell_ids
+from cell_layers import grid_spacing
+
+MIN_ZOOM = 9
+DETAIL_ZOOM = 13            # Single cells from this zoom on, coarser zooms show blocks of cells
+TILE_FOLDER = 'tiles'
+TILE_CALLBACK = 'gridTile'
+COORD_DECIMALS = 6
+
+
+def cell_aggregates(input_csv, chunk_size=100000):
+    """
+    Per-cell average speed and vehicle count of a raw file.
+    Returns a DataFrame with LATITUDE, LONGITUDE, AVG_SPEED, AVG_VEHICLES, DATA_POINTS
+    and the number of rows read.
+    """
+    columns = ['LATITUDE', 'LONGITUDE', 'AVERAGE_SPEED', 'NUMBER_OF_VEHICLES']
+    parts = []
+    total_rows = 0
+
+    for chunk in iter_chunks(input_csv, chunk_size=chunk_size, columns=columns):
+        part = pd.DataFrame({
+            'CELL': chunk_cell_ids(chunk),
+            'LATITUDE': chunk['LATITUDE'].to_numpy(dtype=np.float64),
+            'LONGITUDE': chunk['LONGITUDE'].to_numpy(dtype=np.float64),
+            'SPEED_SUM': chunk['AVERAGE_SPEED'].to_numpy(dtype=np.float64),
+            'VEH_SUM': chunk['NUMBER_OF_VEHICLES'].to_numpy(dtype=np.float64),
+        })
+        parts.append(part.groupby('CELL').agg(
+            LATITUDE=('LATITUDE', 'first'), LONGITUDE=('LONGITUDE', 'first'),
+            SPEED_SUM=('SPEED_SUM', 'sum'), VEH_SUM=('VEH_SUM', 'sum'),
+            DATA_POINTS=('SPEED_SUM', 'count'),
+        ))
+        total_rows += len(chunk)
+
+    if not parts:
+        return pd.DataFrame(columns=['LATITUDE', 'LONGITUDE', 'AVG_SPEED', 'AVG_VEHICLES', 'DATA_POINTS']), total_rows
+
+    cells = pd.concat(parts).groupby(level=0).agg(
+        LATITUDE=('LATITUDE', 'first'), LONGITUDE=('LONGITUDE', 'first'),
+        SPEED_SUM=('SPEED_SUM', 'sum'), VEH_SUM=('VEH_SUM', 'sum'),
+        DATA_POINTS=('DATA_POINTS', 'sum'),
+    )
+    cells['AVG_SPEED'] = cells['SPEED_SUM'] / cells['DATA_POINTS']
+    cells['AVG_VEHICLES'] = cells['VEH_SUM'] / cells['DATA_POINTS']
+    cells = cells.sort_values(['LATITUDE', 'LONGITUDE'], ignore_index=True)
+    return cells[['LATITUDE', 'LONGITUDE', 'AVG_SPEED', 'AVG_VEHICLES', 'DATA_POINTS']], total_rows
+
+def tile_xy(lats, lons, zoom):
+    """Web Mercator (slippy map) tile x, y of every point at a zoom level."""
+    n = 2 ** zoom
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    x = np.floor((np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
+
+def block_cells(cells, lat_spacing, lon_spacing, factor):
+    """
+    Merges cells into blocks of factor x factor grid cells.
+    Speeds and vehicle counts are averaged over the data points of the block.
+    Returns a DataFrame of block centers with half sizes LAT_HALF, LON_HALF.
+    """
+    lat_size = lat_spacing * factor
+    lon_size = lon_spacing * factor
+    lat_origin = cells['LATITUDE'].min() - lat_spacing / 2
+    lon_origin = cells['LONGITUDE'].min() - lon_spacing / 2
+
+    rows = np.floor((cells['LATITUDE'].to_numpy() - lat_origin) / lat_size).astype(np.int64)
+    cols = np.floor((cells['LONGITUDE'].to_numpy() - lon_origin) / lon_size).astype(np.int64)
+    points = cells['DATA_POINTS'].to_numpy(dtype=np.float64)
+
+    blocks = pd.DataFrame({
+        'ROW': rows, 'COL': cols,
+        'SPEED_SUM': cells['AVG_SPEED'].to_numpy() * points,
+        'VEH_SUM': cells['AVG_VEHICLES'].to_numpy() * points,
+        'DATA_POINTS': points,
+        'CELLS': 1,
+    }).groupby(['ROW', 'COL'], as_index=False).sum()
+
+    return pd.DataFrame({
+        'LATITUDE': lat_origin + (blocks['ROW'] + 0.5) * lat_size,
+        'LONGITUDE': lon_origin + (blocks['COL'] + 0.5) * lon_size,
+        'LAT_HALF': lat_size / 2,
+        'LON_HALF': lon_size / 2,
+        'AVG_SPEED': blocks['SPEED_SUM'] / blocks['DATA_POINTS'],
+        'AVG_VEHICLES': blocks['VEH_SUM'] / blocks['DATA_POINTS'],
+        'DATA_POINTS': blocks['DATA_POINTS'].astype(np.int64),
+        'CELLS': blocks['CELLS'],
+    })
+
+def _tile_features(frame):
+    """Compact GeoJSON features: s = avg speed, v = avg vehicles, n = data points, c = cells."""
+    lats = frame['LATITUDE'].to_numpy()
+    lons = frame['LONGITUDE'].to_numpy()
+    lat_half = frame['LAT_HALF'].to_numpy()[:, None]
+    lon_half = frame['LON_HALF'].to_numpy()[:, None]
+
+    lat_offsets = np.array([-1, -1, 1, 1, -1]) * lat_half
+    lon_offsets = np.array([-1, 1, 1, -1, -1]) * lon_half
+    rings = np.stack([lons[:, None] + lon_offsets, lats[:, None] + lat_offsets], axis=-1)
+    rings = np.round(rings, COORD_DECIMALS)
+
+    props = zip(frame['AVG_SPEED'].round(1).tolist(), frame['AVG_VEHICLES'].round(0).tolist(),
+                frame['DATA_POINTS'].tolist(), frame['CELLS'].tolist())
+    return [
+        {'type': 'Feature', 'properties': {'s': s, 'v': v, 'n': n, 'c': c},
+         'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+        for ring, (s, v, n, c) in zip(rings.tolist(), props)
+    ]
+
+def build_pyramid(cells, output_folder, min_zoom=MIN_ZOOM, detail_zoom=DETAIL_ZOOM):
+    """
+    Writes output_folder/tiles/{z}/{x}/{y}.js for every zoom from min_zoom to
+    detail_zoom. Each zoom below detail_zoom halves the resolution, so a tile
+    always holds about the same number of polygons.
+    Returns the list of written 'z/x/y' keys.
+    """
+    tile_root = os.path.join(output_folder, TILE_FOLDER)
+    if os.path.exists(tile_root):
+        shutil.rmtree(tile_root)
+
+    lat_spacing, lon_spacing = grid_spacing(cells['LATITUDE'], cells['LONGITUDE'])
+    written = []
+
+    for zoom in range(min_zoom, detail_zoom + 1):
+        if zoom == detail_zoom:
+            frame = cells.assign(LAT_HALF=lat_spacing / 2, LON_HALF=lon_spacing / 2, CELLS=1)
+        else:
+            frame = block_cells(cells, lat_spacing, lon_spacing, 2 ** (detail_zoom - zoom))
+
+        xs, ys = tile_xy(frame['LATITUDE'], frame['LONGITUDE'], zoom)
+        frame = frame.assign(TILE_X=xs, TILE_Y=ys)
+
+        for (x, y), tile in frame.groupby(['TILE_X', 'TILE_Y']):
+            key = f"{zoom}/{x}/{y}"
+            collection = {'type': 'FeatureCollection', 'features': _tile_features(tile)}
+
+            tile_path = os.path.join(tile_root, str(zoom), str(x), f"{y}.js")
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            with open(tile_path, 'w') as f:
+                f.write(f"{TILE_CALLBACK}({json.dumps(key)},{json.dumps(collection, separators=(',', ':'))});")
+            written.append(key)
+
+        print(f"  zoom {zoom}: {len(frame):,} polygons in {frame.groupby(['TILE_X', 'TILE_Y']).ngroups} tiles")
+
+    return written
+
+class TileGridLayer(MacroElement):
+    """Leaflet GridLayer that loads the pyramid's tiles in view and drops them when they leave."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var tileIndex = {{ this.index_json }};
+            var tileLayers = {};
+
+            function speedColor(s) {
+                return s < 30 ? 'red' : s < 50 ? 'orange' : s < 70 ? 'yellow' : 'green';
+            }
+
+            window.{{ this.callback }} = function(key, data) {
+                if (!(key in tileLayers)) { return; }
+                tileLayers[key] = L.geoJSON(data, {
+                    style: function(feature) {
+                        return {color: '#555', weight: 0.5, fillColor: speedColor(feature.properties.s), fillOpacity: 0.5};
+                    },
+                    onEachFeature: function(feature, layer) {
+                        var p = feature.properties;
+                        layer.bindTooltip('Avg Speed: ' + p.s + ' km/h<br>Avg Vehicles: ' + p.v +
+                                          '<br>Data points: ' + p.n + (p.c > 1 ? '<br>Cells: ' + p.c : ''));
+                    }
+                }).addTo(map);
+            };
+
+            var GridTiles = L.GridLayer.extend({
+                createTile: function(coords) {
+                    var key = coords.z + '/' + coords.x + '/' + coords.y;
+                    if (tileIndex[key] && !(key in tileLayers)) {
+                        tileLayers[key] = null;
+                        var script = document.createElement('script');
+                        script.src = '{{ this.tile_folder }}/' + key + '.js';
+                        script.onload = function() { script.remove(); };
+                        document.head.appendChild(script);
+                    }
+                    return document.createElement('div');
+                }
+            });
+
+            var grid = new GridTiles({
+                minNativeZoom: {{ this.min_zoom }},
+                maxNativeZoom: {{ this.detail_zoom }},
+                keepBuffer: 1
+            });
+            grid.on('tileunload', function(e) {
+                var key = e.coords.z + '/' + e.coords.x + '/' + e.coords.y;
+                if (tileLayers[key]) { map.removeLayer(tileLayers[key]); }
+                delete tileLayers[key];
+            });
+            grid.addTo(map);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, tile_keys, tile_folder=TILE_FOLDER, min_zoom=MIN_ZOOM, detail_zoom=DETAIL_ZOOM):
+        super().__init__()
+        self._name = 'TileGridLayer'
+        self.index_json = json.dumps({key: 1 for key in tile_keys}, separators=(',', ':'))
+        self.tile_folder = tile_folder
+        self.callback = TILE_CALLBACK
+        self.min_zoom = min_zoom
+        self.detail_zoom = detail_zoom
+
+def add_tile_layer(m, cells, output_folder, min_zoom=MIN_ZOOM, detail_zoom=DETAIL_ZOOM):
+    """
+    Builds the tile pyramid in output_folder and adds the layer that loads it to m.
+    The map has to be saved into output_folder, tiles are referenced relative to it.
+    """
+    print(f"Building tile pyramid in {output_folder}")
+    tile_keys = build_pyramid(cells, output_folder, min_zoom, detail_zoom)
+    TileGridLayer(tile_keys, TILE_FOLDER, min_zoom, detail_zoom).add_to(m)
+    return tile_keys
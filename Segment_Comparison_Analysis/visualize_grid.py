@@ -3,7 +3,12 @@
 import pandas as pd
 import folium
 import math
-import statistics
+import os
+from raw_cache import iter_chunks
+from spatial_index import GRID_FILE
+from cell_layers import grid_spacing, cell_polygons, cell_points, add_polygon_layer, add_point_layer
+from tile_pyramid import cell_aggregates, add_tile_layer
+from instrument import stage
 
 
 MASTER_DATA_PATH = 'raw_data/September.csv'
@@ -11,84 +16,120 @@ MASTER_DATA_PATH = 'raw_data/September.csv'
 MAP_CENTER = [41.0082, 28.9784]
 MAP_ZOOM = 11
 
+# 'geojson': all cells as one GeoJSON layer, 'markers': one folium object per cell,
+# 'tiles': tile pyramid with per-cell averages in TILED_OUTPUT_FOLDER (see tile_pyramid.py)
+RENDER_MODE = 'geojson'
+
 OUTPUT_FILE = 'maps/master_data_grid.html'
+TILED_OUTPUT_FOLDER = 'maps/master_data_grid_tiles'
 
-def visualize_master_grid(input_csv=MASTER_DATA_PATH, sample_size=None):
-    
-    chunk_size = 100000
-    all_coords = set()
+def discover_grid(input_csv=MASTER_DATA_PATH, output_path=None, chunk_size=100000):
+    """
+    Collects every unique grid cell in a raw file. With output_path (GRID_FILE for
+    spatial_index.load_grid_index, see the pipeline's grid stage) it is saved there.
+    Returns (grid DataFrame, total rows read).
+    """
+    parts = []
     total_rows = 0
     
-    for chunk_num, chunk in enumerate(pd.read_csv(input_csv, chunksize=chunk_size), 1):
-        unique_pairs = chunk[['LATITUDE', 'LONGITUDE']].drop_duplicates()
-        
-        for _, row in unique_pairs.iterrows():
-            all_coords.add((row['LATITUDE'], row['LONGITUDE']))
-        
+    for chunk in iter_chunks(input_csv, chunk_size=chunk_size, columns=['LATITUDE', 'LONGITUDE']):
+        parts.append(chunk[['LATITUDE', 'LONGITUDE']].drop_duplicates())
         total_rows += len(chunk)
-        
-    
-    grid_points = list(all_coords)
-    
-    
-    if grid_points:
-        lats = [p[0] for p in grid_points]
-        lons = [p[1] for p in grid_points]
-        
-        center_lat = (min(lats) + max(lats)) / 2
-        center_lon = (min(lons) + max(lons)) / 2
-        
-        sorted_lats = sorted(set(lats))
-        sorted_lons = sorted(set(lons))
-        
-        lat_diffs = [sorted_lats[i+1] - sorted_lats[i] for i in range(len(sorted_lats)-1)]
-        lon_diffs = [sorted_lons[i+1] - sorted_lons[i] for i in range(len(sorted_lons)-1)]
-        
-        lat_spacing = statistics.median([d for d in lat_diffs if d > 0])
-        lon_spacing = statistics.median([d for d in lon_diffs if d > 0])
-        
-        lat_half = lat_spacing / 2
-        lon_half = lon_spacing / 2
-        
-        lon_km = lon_spacing * 111 * math.cos(math.radians(center_lat))
+    
+    if not parts:
+        return pd.DataFrame(columns=['LATITUDE', 'LONGITUDE']), total_rows
+    
+    grid = pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+    # Compact chunks may hold float32 coordinates, the grid is kept at full precision
+    grid = grid.astype('float64').sort_values(['LATITUDE', 'LONGITUDE'], ignore_index=True)
+    
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        grid.to_csv(output_path, index=False)
+    
+    return grid, total_rows
+
+@stage('map grid')
+def visualize_master_grid(input_csv=MASTER_DATA_PATH, sample_size=None, render_mode=RENDER_MODE):
+    
+    if render_mode == 'tiles':
+        # Per-cell averages are needed for the tiles, the cell set comes with them
+        grid, total_rows = cell_aggregates(input_csv)
     else:
+        grid, total_rows = discover_grid(input_csv)
+    
+    if grid.empty:
         return None
     
+    lats = grid['LATITUDE'].to_numpy()
+    lons = grid['LONGITUDE'].to_numpy()
+    
+    center_lat = (lats.min() + lats.max()) / 2
+    center_lon = (lons.min() + lons.max()) / 2
+    
+    lat_spacing, lon_spacing = grid_spacing(lats, lons)
+    
+    lat_half = lat_spacing / 2
+    lon_half = lon_spacing / 2
+    
+    lon_km = lon_spacing * 111 * math.cos(math.radians(center_lat))
+    
     m = folium.Map(
         location=[center_lat, center_lon],
         zoom_start=MAP_ZOOM,
         tiles='OpenStreetMap'
     )
     
-    for lat, lon in grid_points:
-        square_corners = [
-            [lat - lat_half, lon - lon_half],
-            [lat - lat_half, lon + lon_half],
-            [lat + lat_half, lon + lon_half],
-            [lat + lat_half, lon - lon_half],
-            [lat - lat_half, lon - lon_half],
-        ]
-        
-        folium.Polygon(
-            locations=square_corners,
-            color='blue',
-            weight=1,
-            fillColor='lightblue',
-            fillOpacity=0.3,
-            popup=f"Grid Cell<br>Center: ({lat}, {lon})",
-            tooltip=f"Grid Cell: ({lat}, {lon})"
-        ).add_to(m)
-        
-        folium.CircleMarker(
-            location=[lat, lon],
-            radius=4,
-            popup=f"Grid Point<br>Lat: {lat}<br>Lon: {lon}",
-            color='darkblue',
-            weight=2,
-            fillColor='blue',
-            fillOpacity=0.8,
-            tooltip=f"Data Point: ({lat}, {lon})"
-        ).add_to(m)
+    output_file = OUTPUT_FILE
+    
+    if render_mode == 'tiles':
+        # Static z/x/y pyramid on disk, the page only loads the tiles in view
+        add_tile_layer(m, grid, TILED_OUTPUT_FOLDER)
+        output_file = os.path.join(TILED_OUTPUT_FOLDER, 'index.html')
+    elif render_mode == 'geojson':
+        # One FeatureCollection layer for all cells and one for all center points
+        coords = {'LAT': lats, 'LON': lons}
+        add_polygon_layer(
+            m, cell_polygons(lats, lons, lat_half, lon_half, coords),
+            style={'color': 'blue', 'weight': 1, 'fillColor': 'lightblue', 'fillOpacity': 0.3},
+            tooltip_fields=['LAT', 'LON'], tooltip_aliases=['Grid Cell Lat', 'Lon'],
+            name='Grid cells'
+        )
+        add_point_layer(
+            m, cell_points(lats, lons),
+            style={'radius': 4, 'color': 'darkblue', 'weight': 2, 'fillColor': 'blue', 'fillOpacity': 0.8},
+            name='Grid points'
+        )
+    else:
+        for lat, lon in zip(lats.tolist(), lons.tolist()):
+            square_corners = [
+                [lat - lat_half, lon - lon_half],
+                [lat - lat_half, lon + lon_half],
+                [lat + lat_half, lon + lon_half],
+                [lat + lat_half, lon - lon_half],
+                [lat - lat_half, lon - lon_half],
+            ]
+            
+            folium.Polygon(
+                locations=square_corners,
+                color='blue',
+                weight=1,
+                fillColor='lightblue',
+                fillOpacity=0.3,
+                popup=f"Grid Cell<br>Center: ({lat}, {lon})",
+                tooltip=f"Grid Cell: ({lat}, {lon})"
+            ).add_to(m)
+            
+            folium.CircleMarker(
+                location=[lat, lon],
+                radius=4,
+                popup=f"Grid Point<br>Lat: {lat}<br>Lon: {lon}",
+                color='darkblue',
+                weight=2,
+                fillColor='blue',
+                fillOpacity=0.8,
+                tooltip=f"Data Point: ({lat}, {lon})"
+            ).add_to(m)
     
     
     info_html = f'''
@@ -97,14 +138,14 @@ def visualize_master_grid(input_csv=MASTER_DATA_PATH, sample_size=None):
          background-color: white; z-index:9999; font-size:14px;
          border:2px solid grey; border-radius:5px; padding: 10px">
          <b>Master Data Grid Visualization</b><br>
-         <small>Total unique grid points: {len(grid_points):,}</small><br>
+         <small>Total unique grid points: {len(grid):,}</small><br>
          <small>Total rows processed: {total_rows:,}</small><br>
          <small>Grid spacing: {lat_spacing*111:.2f} km (lat) × {lon_km:.2f} km (lon)</small><br>
     </div>
     '''
     m.get_root().html.add_child(folium.Element(info_html))
     
-    m.save(OUTPUT_FILE)
+    m.save(output_file)
     
     return m
 
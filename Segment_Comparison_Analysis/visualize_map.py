@@ -1,14 +1,30 @@
 # This script generates an interactive map visualizing traffic data for specified road segments.
 
-import pandas as pd
 import folium
 import os
-import statistics
+import numpy as np
 from main import ROAD_SEGMENTS
+from schema import read_traffic_csv
+from grid_filter import chunk_cell_ids
+from cell_layers import unique_cells, grid_spacing, cell_polygons, cell_points, add_polygon_layer, add_point_layer
+from animated_map import cell_time_aggregate, add_time_slider
+from instrument import stage, count
 
 SEGMENT_KEY = 'mecidiyekoy_d100'
 
-def create_map_for_segment(segment_key):
+# 'geojson': cells and markers as single GeoJSON layers, 'markers': one folium object each,
+# 'animated': per-cell markers with a time slider over ANIMATION_FREQ slots ('h' or 'D')
+RENDER_MODE = 'geojson'
+MAPS_FOLDER = 'maps2'
+ANIMATION_FREQ = 'h'
+
+def map_path(segment_key, render_mode=RENDER_MODE):
+    """File the map of a segment is saved to, the animated mode has its own name."""
+    suffix = '_animated_map.html' if render_mode == 'animated' else '_map.html'
+    return os.path.join(MAPS_FOLDER, ROAD_SEGMENTS[segment_key]['output_filename'].replace('.csv', suffix))
+
+@stage('map segment')
+def create_map_for_segment(segment_key, render_mode=RENDER_MODE):
     
     if segment_key not in ROAD_SEGMENTS:
         print(f"Segment not found in segments")
@@ -26,38 +42,18 @@ def create_map_for_segment(segment_key):
     csv_path = os.path.join(data_folder, output_filename)
     
     try:
-        df = pd.read_csv(csv_path)
+        df = read_traffic_csv(csv_path)
     except FileNotFoundError:
         print(f"File not found.")
         return None
+    count(rows_in=len(df), bytes_read=os.path.getsize(csv_path), chunks=1)
     
-    lats = [p[0] for p in grid_points]
-    lons = [p[1] for p in grid_points]
+    lats, lons = unique_cells([p[0] for p in grid_points], [p[1] for p in grid_points])
     
-    center_lat = sum(lats) / len(lats)
-    center_lon = sum(lons) / len(lons)
+    center_lat = lats.mean()
+    center_lon = lons.mean()
     
-    sorted_lats = sorted(set(lats))
-    sorted_lons = sorted(set(lons))
-    
-    lat_diffs = []
-    for i in range(len(sorted_lats) - 1):
-        difference = sorted_lats[i+1] - sorted_lats[i]
-        if difference > 0:
-            lat_diffs.append(difference)
-
-    lon_diffs = []
-    for i in range(len(sorted_lons) - 1):
-        difference = sorted_lons[i+1] - sorted_lons[i]
-        if difference > 0:
-            lon_diffs.append(difference)
-
-    if lat_diffs and lon_diffs:
-        lat_spacing = statistics.median(lat_diffs)
-        lon_spacing = statistics.median(lon_diffs)
-    else:
-        lat_spacing = 0.0054931641
-        lon_spacing = 0.0109863281
+    lat_spacing, lon_spacing = grid_spacing(lats, lons)
     
     lat_half = lat_spacing / 2
     lon_half = lon_spacing / 2
@@ -77,32 +73,42 @@ def create_map_for_segment(segment_key):
             tooltip='Target Road Segment'
         ).add_to(m)
     
-    for lat, lon in grid_points:
-        square_corners = [
-            [lat - lat_half, lon - lon_half],
-            [lat - lat_half, lon + lon_half],
-            [lat + lat_half, lon + lon_half],
-            [lat + lat_half, lon - lon_half],
-            [lat - lat_half, lon - lon_half],
-        ]
-        
-        folium.Polygon(
-            locations=square_corners,
-            color='red',
-            weight=2,
-            fillColor='red',
-            fillOpacity=0.1,
-            popup=f"Grid Cell<br>Center: ({lat}, {lon})",
-            tooltip=f"Grid Cell"
-        ).add_to(m)
+    if render_mode != 'markers':
+        add_polygon_layer(
+            m, cell_polygons(lats, lons, lat_half, lon_half),
+            style={'color': 'red', 'weight': 2, 'fillColor': 'red', 'fillOpacity': 0.1},
+            name='Grid cells'
+        )
+    else:
+        for lat, lon in zip(lats.tolist(), lons.tolist()):
+            square_corners = [
+                [lat - lat_half, lon - lon_half],
+                [lat - lat_half, lon + lon_half],
+                [lat + lat_half, lon + lon_half],
+                [lat + lat_half, lon - lon_half],
+                [lat - lat_half, lon - lon_half],
+            ]
+            
+            folium.Polygon(
+                locations=square_corners,
+                color='red',
+                weight=2,
+                fillColor='red',
+                fillOpacity=0.1,
+                popup=f"Grid Cell<br>Center: ({lat}, {lon})",
+                tooltip=f"Grid Cell"
+            ).add_to(m)
         
-    unique_locations = df.groupby(['LATITUDE', 'LONGITUDE']).agg({
-        'AVERAGE_SPEED': 'mean',
-        'NUMBER_OF_VEHICLES': 'mean',
-        'MAXIMUM_SPEED': 'max',
-        'DATE_TIME': 'count'
-    }).reset_index()
-    unique_locations.columns = ['LATITUDE', 'LONGITUDE', 'AVG_SPEED', 'AVG_VEHICLES', 'MAX_SPEED', 'DATA_POINTS']
+    # Grouped by coordinates, as integer cell ids instead of float pairs (no GEOHASH needed)
+    unique_locations = df.groupby(chunk_cell_ids(df)).agg(
+        LATITUDE=('LATITUDE', 'first'),
+        LONGITUDE=('LONGITUDE', 'first'),
+        AVG_SPEED=('AVERAGE_SPEED', 'mean'),
+        AVG_VEHICLES=('NUMBER_OF_VEHICLES', 'mean'),
+        MAX_SPEED=('MAXIMUM_SPEED', 'max'),
+        DATA_POINTS=('DATE_TIME', 'count'),
+    ).reset_index(drop=True)
+    unique_locations = unique_locations.astype({'LATITUDE': 'float64', 'LONGITUDE': 'float64'})
     
     print(f"Unique locations: {len(unique_locations)}")
 
@@ -111,44 +117,62 @@ def create_map_for_segment(segment_key):
 
     def get_radius(speed):
         if max_speed_in_grid == min_speed_in_grid:
-            return 8
+            return np.full(len(speed), 8.0)
             
         normalized = (speed - min_speed_in_grid) / (max_speed_in_grid - min_speed_in_grid)
         return 8 + ((1 - normalized) * 12)
 
     def get_color(speed):
-        if speed < 30:
-            return 'red'
-        elif speed < 50:
-            return 'orange'
-        elif speed < 70:
-            return 'yellow'
-        else:
-            return 'green'
-    
-    for idx, row in unique_locations.iterrows():
-        popup_text = f"""
-        <b>Location</b><br>
-        Lat: {row['LATITUDE']:.6f}<br>
-        Lon: {row['LONGITUDE']:.6f}<br>
-        <b>Traffic Stats:</b><br>
-        Avg Speed: {row['AVG_SPEED']:.1f} km/h<br>
-        Max Speed: {row['MAX_SPEED']:.0f} km/h<br>
-        Avg Vehicles: {row['AVG_VEHICLES']:.0f}<br>
-        """
-        
-        current_speed = row['AVG_SPEED']
-        
-        folium.CircleMarker(
-            location=[row['LATITUDE'], row['LONGITUDE']],
-            radius=get_radius(current_speed),
-            popup=folium.Popup(popup_text, max_width=300),
-            color='black',
-            weight=1,
-            fillColor=get_color(current_speed),
-            fillOpacity=0.8,
-            tooltip=f"Speed: {current_speed:.1f} km/h"
-        ).add_to(m)
+        return np.select([speed < 30, speed < 50, speed < 70], ['red', 'orange', 'yellow'], 'green')
+    
+    speeds = unique_locations['AVG_SPEED'].to_numpy()
+    
+    if render_mode == 'animated':
+        # One frame per ANIMATION_FREQ slot instead of one marker for all hours
+        add_time_slider(m, cell_time_aggregate(df, ANIMATION_FREQ), radius_range=(8, 20))
+    elif render_mode == 'geojson':
+        # All location markers in one layer, radius and color are feature properties
+        properties = {
+            'LAT': unique_locations['LATITUDE'].round(6),
+            'LON': unique_locations['LONGITUDE'].round(6),
+            'AVG_SPEED': unique_locations['AVG_SPEED'].round(1),
+            'MAX_SPEED': unique_locations['MAX_SPEED'],
+            'AVG_VEHICLES': unique_locations['AVG_VEHICLES'].round(0),
+            'radius': get_radius(speeds).round(1),
+            'fillColor': get_color(speeds),
+        }
+        add_point_layer(
+            m, cell_points(unique_locations['LATITUDE'], unique_locations['LONGITUDE'], properties),
+            style={'color': 'black', 'weight': 1, 'fillOpacity': 0.8},
+            tooltip_fields=['AVG_SPEED'], tooltip_aliases=['Speed (km/h)'],
+            popup_fields=['LAT', 'LON', 'AVG_SPEED', 'MAX_SPEED', 'AVG_VEHICLES'],
+            popup_aliases=['Lat', 'Lon', 'Avg Speed (km/h)', 'Max Speed (km/h)', 'Avg Vehicles'],
+            name='Traffic stats'
+        )
+    else:
+        radii = get_radius(speeds)
+        colors = get_color(speeds)
+        for i, row in enumerate(unique_locations.itertuples(index=False)):
+            popup_text = f"""
+            <b>Location</b><br>
+            Lat: {row.LATITUDE:.6f}<br>
+            Lon: {row.LONGITUDE:.6f}<br>
+            <b>Traffic Stats:</b><br>
+            Avg Speed: {row.AVG_SPEED:.1f} km/h<br>
+            Max Speed: {row.MAX_SPEED:.0f} km/h<br>
+            Avg Vehicles: {row.AVG_VEHICLES:.0f}<br>
+            """
+            
+            folium.CircleMarker(
+                location=[row.LATITUDE, row.LONGITUDE],
+                radius=float(radii[i]),
+                popup=folium.Popup(popup_text, max_width=300),
+                color='black',
+                weight=1,
+                fillColor=str(colors[i]),
+                fillOpacity=0.8,
+                tooltip=f"Speed: {row.AVG_SPEED:.1f} km/h"
+            ).add_to(m)
     
     legend_html = '''
     <div style="position: fixed; 
@@ -176,11 +200,7 @@ def create_map_for_segment(segment_key):
     '''
     m.get_root().html.add_child(folium.Element(title_html))
     
-    maps_folder = 'maps2'
-    
-    map_filename = output_filename.replace('.csv', '_map.html')
-    map_path = os.path.join(maps_folder, map_filename)
-    m.save(map_path)
+    m.save(map_path(segment_key, render_mode))
     
     return m
 
@@ -0,0 +1,53 @@
+# Benchmark: tuple Series.isin coordinate filter vs. vectorized cell-id filter.
+# Run from the repository root: python benchmarks/bench_grid_filter.py [n_rows]
+
+import pandas as pd
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Segment_Comparison_Analysis'))
+from grid_filter import make_cell_set, grid_mask
+from synthetic import make_grid, write_traffic_csv
+
+N_ROWS = 10_000_000
+N_CELLS = 2000
+N_SEGMENT_CELLS = 50
+CHUNK_SIZE = 100000
+DATA_PATH = 'benchmarks/data/synthetic_{n}.csv'
+
+
+def tuple_filter(chunk, grid_points_set):
+    chunk_coords = pd.Series(list(zip(chunk['LATITUDE'], chunk['LONGITUDE'])))
+    return chunk_coords.isin(grid_points_set).values
+
+def main(n_rows=N_ROWS):
+    path = write_traffic_csv(DATA_PATH.format(n=n_rows), n_rows, n_cells=N_CELLS)
+
+    lats, lons = make_grid(N_CELLS)
+    grid_points = list(zip(lats[:N_SEGMENT_CELLS], lons[:N_SEGMENT_CELLS]))
+    grid_points_set = set(grid_points)
+    cell_set = make_cell_set(grid_points)
+
+    timings = {'tuple isin': 0.0, 'cell id': 0.0}
+    matches = {'tuple isin': 0, 'cell id': 0}
+    total_rows = 0
+
+    for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE, usecols=['LATITUDE', 'LONGITUDE']):
+        start = time.perf_counter()
+        matches['tuple isin'] += int(tuple_filter(chunk, grid_points_set).sum())
+        timings['tuple isin'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        matches['cell id'] += int(grid_mask(chunk, cell_set).sum())
+        timings['cell id'] += time.perf_counter() - start
+
+        total_rows += len(chunk)
+
+    print(f"Rows: {total_rows:,}  (segment cells: {N_SEGMENT_CELLS}, chunk size: {CHUNK_SIZE:,})")
+    for name, seconds in timings.items():
+        print(f"  {name:<12} {seconds:8.2f} s  {total_rows / seconds:14,.0f} rows/s  matched {matches[name]:,}")
+    print(f"  speedup: {timings['tuple isin'] / timings['cell id']:.1f}x")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS)
@@ -0,0 +1,69 @@
+# Benchmark: all-pairs DTW distance matrix, old serial double loop vs. pairwise_dtw.
+# Run from the repository root: python benchmarks/bench_pairwise_dtw.py [profile_length]
+
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Segment_Comparison_Analysis'))
+from dtw import pairwise_dtw
+
+SEGMENT_COUNTS = [10, 100, 1000]
+PROFILE_LENGTH = 24
+# The pure-Python loop is only timed up to this size and extrapolated beyond it
+MAX_REFERENCE_SEGMENTS = 100
+
+
+def reference_dtw(s1, s2):
+    n, m = len(s1), len(s2)
+    dtw_matrix = np.full((n+1, m+1), np.inf)
+    dtw_matrix[0, 0] = 0
+    for i in range(1, n+1):
+        for j in range(1, m+1):
+            cost = abs(s1[i-1] - s2[j-1])
+            dtw_matrix[i, j] = cost + min(dtw_matrix[i-1, j], dtw_matrix[i, j-1], dtw_matrix[i-1, j-1])
+    return dtw_matrix[n, m]
+
+def reference_matrix(profiles):
+    n = len(profiles)
+    dist_matrix = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            dist_matrix[i, j] = dist_matrix[j, i] = reference_dtw(profiles[i], profiles[j])
+    return dist_matrix
+
+def main(profile_length=PROFILE_LENGTH):
+    rng = np.random.default_rng(42)
+    # Warm-up so numba compilation is not part of the timings
+    pairwise_dtw(rng.random((3, profile_length)), n_jobs=1)
+
+    print(f"Profile length: {profile_length}, cores: {os.cpu_count()}")
+    print(f"{'N':>6} {'pairs':>10} {'reference':>12} {'serial':>10} {'parallel':>10}")
+
+    per_pair = None
+    for n in SEGMENT_COUNTS:
+        profiles = rng.random((n, profile_length))
+        pairs = n * (n - 1) // 2
+
+        if n <= MAX_REFERENCE_SEGMENTS:
+            start = time.perf_counter()
+            reference_matrix(profiles)
+            reference = time.perf_counter() - start
+            per_pair = reference / pairs
+            reference_text = f"{reference:10.2f} s"
+        else:
+            reference_text = f"~{per_pair * pairs:9.0f} s"
+
+        start = time.perf_counter()
+        pairwise_dtw(profiles, n_jobs=1)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairwise_dtw(profiles)
+        parallel = time.perf_counter() - start
+
+        print(f"{n:>6} {pairs:>10,} {reference_text:>12} {serial:8.2f} s {parallel:8.2f} s")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else PROFILE_LENGTH)
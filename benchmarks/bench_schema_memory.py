@@ -0,0 +1,111 @@
+# Memory report: default pandas inference vs. the compact schema (schema.py).
+# Reads a whole month chunk by chunk both ways and compares bytes per row by column,
+# plus the per-cell and per-hour groupbys used by the maps and profiles.
+# Run from the repository root: python benchmarks/bench_schema_memory.py [month.csv]
+# Without a path a synthetic month (N_ROWS rows) is generated.
+
+import pandas as pd
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Segment_Comparison_Analysis'))
+from schema import read_traffic_csv
+from synthetic import write_traffic_csv
+
+N_ROWS = 2_000_000      # ~2,800 cells x 720 hours, about one IBB month
+N_CELLS = 2800
+CHUNK_SIZE = 100000
+DATA_PATH = 'benchmarks/data/synthetic_month_{n}.csv'
+
+
+def read_default(path):
+    for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE):
+        # What the scripts did before: parse DATE_TIME after loading
+        chunk['DATE_TIME'] = pd.to_datetime(chunk['DATE_TIME'])
+        yield chunk
+
+def read_default_raw(path):
+    yield from pd.read_csv(path, chunksize=CHUNK_SIZE)
+
+def read_compact(path):
+    yield from read_traffic_csv(path, chunksize=CHUNK_SIZE)
+
+def groupby_timings(chunk, cell_columns):
+    start = time.perf_counter()
+    chunk.groupby(cell_columns, observed=True).agg(
+        AVG_SPEED=('AVERAGE_SPEED', 'mean'),
+        AVG_VEHICLES=('NUMBER_OF_VEHICLES', 'mean'),
+    )
+    by_cell = time.perf_counter() - start
+
+    start = time.perf_counter()
+    date_time = pd.to_datetime(chunk['DATE_TIME'])
+    chunk.groupby([date_time.dt.normalize(), date_time.dt.hour]).agg(
+        VEH_SUM=('NUMBER_OF_VEHICLES', 'sum'),
+        SPEED_MEAN=('AVERAGE_SPEED', 'mean'),
+    )
+    by_hour = time.perf_counter() - start
+    return by_cell, by_hour
+
+def measure(chunks, cell_columns):
+    column_bytes = None
+    total_rows = 0
+    max_chunk_bytes = 0
+    read_seconds = 0.0
+    cell_seconds = 0.0
+    hour_seconds = 0.0
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        read_seconds += time.perf_counter() - start
+
+        usage = chunk.memory_usage(deep=True, index=False)
+        column_bytes = usage if column_bytes is None else column_bytes + usage
+        max_chunk_bytes = max(max_chunk_bytes, int(usage.sum()))
+        total_rows += len(chunk)
+
+        by_cell, by_hour = groupby_timings(chunk, cell_columns)
+        cell_seconds += by_cell
+        hour_seconds += by_hour
+        start = time.perf_counter()
+
+    return {
+        'rows': total_rows,
+        'column_bytes': column_bytes,
+        'max_chunk_bytes': max_chunk_bytes,
+        'read': read_seconds,
+        'groupby_cell': cell_seconds,
+        'groupby_hour': hour_seconds,
+    }
+
+def main(path=None):
+    if path is None:
+        path = write_traffic_csv(DATA_PATH.format(n=N_ROWS), N_ROWS, n_cells=N_CELLS)
+
+    results = {
+        'default (text)': measure(read_default_raw(path), ['LATITUDE', 'LONGITUDE']),
+        'default': measure(read_default(path), ['LATITUDE', 'LONGITUDE']),
+        'compact': measure(read_compact(path), ['GEOHASH']),
+    }
+    rows = results['compact']['rows']
+
+    print(f"File: {path}  ({rows:,} rows, chunk size {CHUNK_SIZE:,})")
+    print()
+    print(f"{'bytes/row':<20}" + ''.join(f"{name:>16}" for name in results))
+    for column in results['compact']['column_bytes'].index:
+        print(f"  {column:<18}" + ''.join(
+            f"{r['column_bytes'][column] / r['rows']:16.1f}" for r in results.values()))
+    print(f"  {'total':<18}" + ''.join(
+        f"{r['column_bytes'].sum() / r['rows']:16.1f}" for r in results.values()))
+    print()
+    print(f"{'largest chunk (MB)':<20}" + ''.join(f"{r['max_chunk_bytes'] / 1e6:16.1f}" for r in results.values()))
+    for key, label in [('read', 'read (s)'), ('groupby_cell', 'groupby cell (s)'), ('groupby_hour', 'groupby hour (s)')]:
+        print(f"{label:<20}" + ''.join(f"{r[key]:16.2f}" for r in results.values()))
+    print()
+    for name in ('default (text)', 'default'):
+        ratio = results[name]['max_chunk_bytes'] / results['compact']['max_chunk_bytes']
+        print(f"compact vs {name}: {ratio:.1f}x less memory per chunk")
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,232 @@
+# Benchmark harness for the whole pipeline on synthetic IBB-shaped data.
+# Generates cells x hours x months of raw CSVs (see synthetic.write_dataset), then runs
+# extraction, weighting, profile building, DTW and map rendering in a scratch
+# folder, each stage in a fresh process so its peak RSS is its own.
+# Run from the repository root:
+#   python benchmarks/run_benchmarks.py --cells 2000 --days 30 --months 1
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json
+# Results are written as JSON; --compare exits with 1 if a stage got slower than
+# the allowed tolerance, so it can run before the nightly job.
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.join(BENCH_DIR, '..', 'Segment_Comparison_Analysis')
+sys.path.append(CODE_DIR)
+from synthetic import write_dataset
+
+DATA_ROOT = os.path.join(BENCH_DIR, 'data')
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results', 'latest.json')
+STAGES = ['ingest', 'extract', 'weight', 'profiles', 'dtw', 'maps']
+DEFAULT_STAGES = ['extract', 'weight', 'profiles', 'dtw', 'maps']
+TOLERANCE = 0.2             # Allowed slowdown against --compare before failing
+
+
+def count_rows(path):
+    """Data rows of a CSV (lines minus header), cheap enough to not distort a stage."""
+    with open(path, 'rb') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+def stage_ingest(config):
+    from raw_cache import ingest_csv
+    for path in config['input_files']:
+        ingest_csv(path)
+    rows = sum(count_rows(path) for path in config['input_files'])
+    return rows, rows
+
+def stage_extract(config):
+    import main
+    results = main.extract_all_segments(config['input_files'], n_workers=config['workers'])
+    return sum(count_rows(path) for path in config['input_files']), sum(results.values())
+
+def stage_weight(config):
+    import weight
+    os.makedirs(weight.OUTPUT_FOLDER, exist_ok=True)
+    for key in weight.ROAD_SEGMENTS:
+        weight.apply_weights_to_segment(key)
+    rows = sum(count_rows(os.path.join(weight.DATA_FOLDER, f))
+               for f in os.listdir(weight.DATA_FOLDER) if f.endswith('.csv'))
+    return rows, rows
+
+def stage_profiles(config):
+    from profile_cube import load_cube, select, hourly_profile
+    cube = load_cube('weighted_data')
+    if cube is None:
+        return 0, 0
+    profiles = [hourly_profile(select(cube, segment=name)) for name in cube['SEGMENT'].unique()]
+    return int(cube['VEH_COUNT'].sum()), len(profiles)
+
+def stage_dtw(config):
+    import numpy as np
+    from profile_cube import load_cube
+    from dtw import pairwise_dtw
+    cube = load_cube('weighted_data')
+    # One 24-hour profile per (segment, day), the shape the per-day comparisons use
+    table = cube.pivot_table(index=['SEGMENT', 'DATE'], columns='HOUR', values='VEH_SUM', fill_value=0)
+    profiles = table.reindex(columns=range(24), fill_value=0).to_numpy(dtype=np.float64)
+    distances = pairwise_dtw(profiles, n_jobs=config['workers'])
+    return len(profiles), len(distances)
+
+def stage_maps(config):
+    import visualize_map
+    import visualize_grid
+    import animated_map
+
+    # visualize_map reads the season baseline folder, point it at the extracted data
+    os.makedirs('Season_Comparison', exist_ok=True)
+    baseline = os.path.join('Season_Comparison', 'season_baseline_data')
+    if os.path.exists(baseline):
+        shutil.rmtree(baseline)
+    shutil.copytree('relevant_data', baseline)
+    for folder in ('maps', 'maps2'):
+        os.makedirs(folder, exist_ok=True)
+
+    for key in visualize_map.ROAD_SEGMENTS:
+        visualize_map.create_map_for_segment(key)
+
+    master = config['input_files'][0]
+    visualize_grid.visualize_master_grid(master, render_mode='geojson')
+    visualize_grid.visualize_master_grid(master, render_mode='tiles')
+    animated_map.create_animated_grid_map(master, dates=config['animation_dates'])
+
+    return count_rows(master), len(visualize_map.ROAD_SEGMENTS)
+
+def _run_stage(name, config, connection):
+    """Child process body: runs one stage and sends back timings and peak RSS."""
+    sys.path.insert(0, os.path.abspath(CODE_DIR))
+    os.chdir(config['workdir'])
+    if config['quiet']:
+        sys.stdout = open(os.devnull, 'w')
+
+    start = time.perf_counter()
+    rows_in, rows_out = globals()['stage_' + name](config)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform == 'darwin' else 1024
+    connection.send({
+        'stage': name,
+        'seconds': seconds,
+        'rows_in': int(rows_in),
+        'rows_out': int(rows_out),
+        'rows_per_s': rows_in / seconds if seconds > 0 else None,
+        'peak_rss_mb': max(max_rss, max_rss_children) * scale / 1e6,
+    })
+
+def run_stage(name, config):
+    # spawn gives every stage a clean interpreter, so peak RSS is not inherited
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe()
+    process = context.Process(target=_run_stage, args=(name, config, child))
+    process.start()
+    result = parent.recv() if parent.poll(None) else None
+    process.join()
+    if process.exitcode != 0 or result is None:
+        raise RuntimeError(f"Stage {name} failed (exit code {process.exitcode})")
+    return result
+
+def prepare(args):
+    """Generates (or reuses) the dataset and returns the stage config."""
+    from segments import load_segments
+
+    name = f"suite_{args.cells}c_{args.days}d_{args.months}m"
+    workdir = os.path.join(DATA_ROOT, name)
+    include = [p for segment in load_segments().values() for p in segment['grid_points']]
+
+    print(f"Dataset: {args.cells:,} cells x {args.days * 24} hours x {args.months} months in {workdir}")
+    start = time.perf_counter()
+    paths = write_dataset(os.path.join(workdir, 'raw_data'), n_cells=args.cells, days=args.days,
+                          months=args.months, seed=args.seed, include=include)
+    print(f"  ready in {time.perf_counter() - start:.1f} s")
+
+    # Outputs of earlier runs (Parquet cache, extracted and weighted data, maps) are
+    # removed, every run starts from the raw CSVs
+    for entry in os.listdir(workdir):
+        if entry != 'raw_data':
+            shutil.rmtree(os.path.join(workdir, entry))
+
+    # First week of the first month for the animated map (write_dataset starts on 2024-07-01)
+    animation_dates = [f"2024-07-{day:02d}" for day in range(1, min(7, args.days) + 1)]
+
+    return {
+        'workdir': os.path.abspath(workdir),
+        'input_files': [os.path.join('raw_data', os.path.basename(p)) for p in paths],
+        'workers': args.workers,
+        'animation_dates': animation_dates,
+        'quiet': not args.verbose,
+        'dataset': name,
+    }
+
+def compare(results, baseline_path, tolerance=TOLERANCE):
+    """Prints the change against a previous results file, returns the regressed stage names."""
+    with open(baseline_path) as f:
+        baseline = {r['stage']: r for r in json.load(f)['stages']}
+
+    regressions = []
+    print(f"\nAgainst {baseline_path}:")
+    for r in results:
+        old = baseline.get(r['stage'])
+        if old is None:
+            continue
+        change = r['seconds'] / old['seconds'] - 1 if old['seconds'] > 0 else 0.0
+        rss_change = r['peak_rss_mb'] / old['peak_rss_mb'] - 1 if old['peak_rss_mb'] > 0 else 0.0
+        flag = ''
+        if change > tolerance:
+            flag = '  <-- slower'
+            regressions.append(r['stage'])
+        print(f"  {r['stage']:<10} time {change:+7.1%}   peak RSS {rss_change:+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the pipeline stages on synthetic traffic data.')
+    parser.add_argument('--cells', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=7, help='days per month')
+    parser.add_argument('--months', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES), help=f"comma separated, from {','.join(STAGES)}")
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--compare', help='previous results JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--verbose', action='store_true', help='show the scripts\' own output')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    config = prepare(args)
+    results = []
+    print(f"\n{'stage':<10} {'seconds':>9} {'rows in':>12} {'rows/s':>12} {'peak RSS':>10}")
+    for name in stages:
+        r = run_stage(name, config)
+        results.append(r)
+        rate = f"{r['rows_per_s']:12,.0f}" if r['rows_per_s'] else f"{'-':>12}"
+        print(f"{name:<10} {r['seconds']:9.2f} {r['rows_in']:12,} {rate} {r['peak_rss_mb']:8.0f} MB")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'dataset': config['dataset'],
+            'cells': args.cells, 'days': args.days, 'months': args.months, 'workers': args.workers,
+            'python': sys.version.split()[0],
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'stages': results,
+        }, f, indent=2)
+    print(f"\nSaved {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# Synthetic traffic data shaped like the IBB hourly traffic density export.
+# Used by the benchmark scripts, nothing here touches the real raw_data files.
+
+import pandas as pd
+import numpy as np
+import os
+
+LAT_SPACING = 0.0054931640625
+LON_SPACING = 0.010986328125
+
+# Istanbul bounding box in grid steps, cell centers sit at (k + 0.5) * spacing
+LAT_RANGE = (7420, 7500)
+LON_RANGE = (2600, 2680)
+
+
+def make_grid(n_cells, seed=0, include=None):
+    """
+    Returns (lats, lons) of n_cells distinct grid cell centers.
+    include: optional (lat, lon) cell centers on the same grid (e.g. the road
+    segments' grid points) that are always part of the result.
+    """
+    rng = np.random.default_rng(seed)
+    n_lat = LAT_RANGE[1] - LAT_RANGE[0]
+    n_lon = LON_RANGE[1] - LON_RANGE[0]
+    n_cells = min(n_cells, n_lat * n_lon)
+
+    forced = np.empty(0, dtype=np.int64)
+    if include is not None and len(include):
+        points = np.asarray(include, dtype=np.float64).reshape(-1, 2)
+        rows = np.rint(points[:, 0] / LAT_SPACING - 0.5).astype(np.int64) - LAT_RANGE[0]
+        cols = np.rint(points[:, 1] / LON_SPACING - 0.5).astype(np.int64) - LON_RANGE[0]
+        inside = (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lon)
+        forced = np.unique(rows[inside] * n_lon + cols[inside])
+
+    if len(forced):
+        rest = np.setdiff1d(np.arange(n_lat * n_lon), forced)
+        extra = rng.choice(rest, size=max(n_cells - len(forced), 0), replace=False)
+        flat = np.concatenate([forced, extra])
+    else:
+        flat = rng.choice(n_lat * n_lon, size=n_cells, replace=False)
+
+    lats = (LAT_RANGE[0] + flat // n_lon + 0.5) * LAT_SPACING
+    lons = (LON_RANGE[0] + flat % n_lon + 0.5) * LON_SPACING
+    return lats, lons
+
+def make_traffic_frame(n_rows, n_cells=2000, seed=0, start='2024-09-01', grid=None):
+    """
+    Random rows with the raw CSV columns, ordered by DATE_TIME like the export.
+    grid: optional (lats, lons) to draw the cells from, default make_grid(n_cells, seed).
+    """
+    rng = np.random.default_rng(seed)
+    lats, lons = make_grid(n_cells, seed) if grid is None else grid
+
+    cells = rng.integers(0, len(lats), size=n_rows)
+    hours = np.sort(rng.integers(0, 24 * 30, size=n_rows))
+    speeds = rng.integers(5, 120, size=(n_rows, 3))
+    speeds.sort(axis=1)
+
+    return pd.DataFrame({
+        'DATE_TIME': (pd.Timestamp(start) + pd.to_timedelta(hours, unit='h')).strftime('%Y-%m-%d %H:%M:%S'),
+        'LATITUDE': lats[cells],
+        'LONGITUDE': lons[cells],
+        'GEOHASH': np.char.add('sxk', cells.astype(str)),
+        'MINIMUM_SPEED': speeds[:, 0],
+        'MAXIMUM_SPEED': speeds[:, 2],
+        'AVERAGE_SPEED': speeds[:, 1],
+        'NUMBER_OF_VEHICLES': rng.integers(1, 400, size=n_rows),
+    })
+
+def write_traffic_csv(path, n_rows, n_cells=2000, seed=0, block_rows=1000000):
+    """
+    Writes a synthetic raw CSV in blocks so large files do not need to fit in memory.
+    Every block draws from the same make_grid(n_cells, seed) cells. The file is
+    written under a temporary name and renamed when complete, so an existing
+    file is always a finished one and is reused.
+    """
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    grid = make_grid(n_cells, seed)
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        # Left over from an interrupted run
+        os.remove(tmp_path)
+    written = 0
+    block = 0
+    while written < n_rows:
+        rows = min(block_rows, n_rows - written)
+        start = pd.Timestamp('2024-09-01') + pd.Timedelta(days=30 * block)
+        df = make_traffic_frame(rows, seed=seed + block, start=str(start.date()), grid=grid)
+        df.to_csv(tmp_path, mode='a', header=(written == 0), index=False)
+        written += rows
+        block += 1
+    os.replace(tmp_path, path)
+    return path
+
+# Relative traffic volume by hour of day, morning and evening rush hours
+HOURLY_SHAPE = np.array([0.25, 0.15, 0.1, 0.1, 0.15, 0.3, 0.6, 1.0, 1.1, 0.8, 0.65, 0.65,
+                         0.7, 0.7, 0.7, 0.8, 0.95, 1.15, 1.2, 0.9, 0.7, 0.55, 0.45, 0.35])
+WEEKEND_FACTOR = 0.7
+FREE_FLOW_SPEED = 90
+
+def make_hourly_frame(lats, lons, start, n_hours, seed=0):
+    """
+    One row per cell and hour for n_hours from start, shaped like the export:
+    volumes follow HOURLY_SHAPE (lower on weekends), speeds drop as volume rises.
+    """
+    rng = np.random.default_rng(seed)
+    n_cells = len(lats)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(n_hours), unit='h')
+
+    # Every cell gets its own base volume, rows are ordered by time then cell
+    base = np.random.default_rng(0).gamma(2.0, 60.0, size=n_cells)
+    load = HOURLY_SHAPE[times.hour.to_numpy()] * np.where(times.dayofweek.to_numpy() >= 5, WEEKEND_FACTOR, 1.0)
+    volume = np.outer(load, base) * rng.lognormal(0.0, 0.15, size=(n_hours, n_cells))
+    vehicles = np.maximum(np.rint(volume), 1).astype(np.int64).ravel()
+
+    congestion = np.clip(np.outer(load, np.ones(n_cells)) / 1.3, 0, 0.9).ravel()
+    average = np.clip(FREE_FLOW_SPEED * (1 - congestion) + rng.normal(0, 5, size=vehicles.size), 5, 130)
+    minimum = np.clip(average - rng.uniform(5, 30, size=vehicles.size), 1, None)
+    maximum = average + rng.uniform(5, 40, size=vehicles.size)
+
+    cell_codes = np.char.add('sxk', np.arange(n_cells).astype(str))
+    return pd.DataFrame({
+        'DATE_TIME': np.repeat(times.strftime('%Y-%m-%d %H:%M:%S').to_numpy(), n_cells),
+        'LATITUDE': np.tile(lats, n_hours),
+        'LONGITUDE': np.tile(lons, n_hours),
+        'GEOHASH': np.tile(cell_codes, n_hours),
+        'MINIMUM_SPEED': np.rint(minimum).astype(np.int64),
+        'MAXIMUM_SPEED': np.rint(maximum).astype(np.int64),
+        'AVERAGE_SPEED': np.rint(average).astype(np.int64),
+        'NUMBER_OF_VEHICLES': vehicles,
+    })
+
+def write_dataset(folder, n_cells=1000, days=30, months=1, seed=0, include=None, start='2024-07-01'):
+    """
+    Writes one raw CSV per month into folder, every cell with a row for every
+    hour of the first `days` days of the month (cells x hours x months rows).
+    Files are named like the real exports (July.csv, ...). Existing files are
+    kept. Returns the list of paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    lats, lons = make_grid(n_cells, seed, include)
+    paths = []
+
+    for month in range(months):
+        month_start = pd.Timestamp(start) + pd.DateOffset(months=month)
+        path = os.path.join(folder, f"{month_start.strftime('%B')}.csv")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        # One day per block keeps memory flat for large grids
+        for day in range(days):
+            day_start = month_start + pd.Timedelta(days=day)
+            df = make_hourly_frame(lats, lons, day_start, 24, seed=seed + month * 1000 + day)
+            df.to_csv(path, mode='a', header=(day == 0), index=False)
+    return paths
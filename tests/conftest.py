@@ -0,0 +1,6 @@
+# The modules are flat scripts, tests import them the way the benchmarks do.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Segment_Comparison_Analysis'))
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from profile_cube import aggregate_frame
+from anomaly import score_days
+
+
+def segment_rows(days=35, busy_day=None, empty_hours=()):
+    """Hourly rows of one segment with the same weekday pattern every day."""
+    hours = np.arange(24)
+    pattern = 50 + 200 * np.exp(-(hours - 8) ** 2 / 4) + 150 * np.exp(-(hours - 18) ** 2 / 4)
+    times = pd.date_range('2024-09-02', periods=24 * days, freq='h')
+    vehicles = np.tile(pattern, days).round().astype(int)
+    vehicles[times.dayofweek >= 5] //= 2
+    if busy_day is not None:
+        vehicles[times.normalize() == pd.Timestamp(busy_day)] *= 3
+    df = pd.DataFrame({'DATE_TIME': times, 'NUMBER_OF_VEHICLES': vehicles, 'AVERAGE_SPEED': 50})
+    return df[~df['DATE_TIME'].isin(pd.to_datetime(list(empty_hours)))]
+
+def test_busy_day_scores_highest():
+    cube = aggregate_frame(segment_rows(busy_day='2024-09-25'), 'seg.csv')
+    scores, processed = score_days(cube)
+    assert scores.sort_values('SCORE').iloc[-1]['DATE'] == '2024-09-25'
+    assert not scores.duplicated(['SEGMENT', 'DATE']).any()
+    assert processed == {'seg.csv': '2024-10-06'}
+
+def test_day_with_a_few_empty_hours_is_still_scored():
+    empty = ['2024-09-26 02:00', '2024-09-26 03:00']
+    cube = aggregate_frame(segment_rows(empty_hours=empty), 'seg.csv')
+    scores, _ = score_days(cube)
+    assert '2024-09-26' in set(scores['DATE'])
+
+def test_scoring_continues_where_it_stopped():
+    cube = aggregate_frame(segment_rows(), 'seg.csv')
+    all_scores, _ = score_days(cube)
+    later, _ = score_days(cube, since={'seg.csv': '2024-09-30'})
+    assert later['DATE'].min() > '2024-09-30'
+    expected = all_scores[all_scores['DATE'] > '2024-09-30'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(later.reset_index(drop=True), expected)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from dtw import pairwise_dtw, to_square_matrix
+from clustering import n_items, distance_block, kmedoids, silhouette, choose_k, clara
+
+
+def blobs(seed=0, per_cluster=12):
+    """
+    Three groups of 24-hour profiles at different levels. Unbanded DTW warps a
+    morning peak onto an evening one, the groups differ in volume instead.
+    """
+    rng = np.random.default_rng(seed)
+    hours = np.arange(24)
+    shapes = [level + np.exp(-(hours - 8) ** 2 / 4) for level in (0.0, 2.0, 4.0)]
+    profiles = [shape + rng.normal(0, 0.03, 24) for shape in shapes for _ in range(per_cluster)]
+    return np.array(profiles), np.repeat(np.arange(3), per_cluster)
+
+def same_partition(a, b):
+    pairs_a = np.equal.outer(a, a)
+    pairs_b = np.equal.outer(b, b)
+    return np.array_equal(pairs_a, pairs_b)
+
+def test_distance_block_reads_the_square_matrix():
+    rng = np.random.default_rng(1)
+    condensed = rng.random(10 * 9 // 2)
+    square = to_square_matrix(condensed, 10)
+    assert n_items(condensed) == 10
+    assert np.array_equal(distance_block(condensed, 10, [0, 3, 9]), square[[0, 3, 9]])
+    assert np.array_equal(distance_block(condensed, 10, [2, 5], [5, 1]), square[np.ix_([2, 5], [5, 1])])
+    with pytest.raises(ValueError):
+        n_items(np.zeros(4))
+
+def test_kmedoids_finds_the_groups():
+    profiles, truth = blobs()
+    condensed = pairwise_dtw(profiles, n_jobs=1)
+    labels, medoids, cost = kmedoids(condensed, 3)
+    assert same_partition(labels, truth)
+    assert labels[medoids].tolist() == [0, 1, 2]
+    square = to_square_matrix(condensed, len(profiles))
+    assert cost == pytest.approx(square[medoids][labels, np.arange(len(profiles))].sum())
+
+def test_silhouette_matches_scikit_learn():
+    metrics = pytest.importorskip('sklearn.metrics')
+    profiles, _ = blobs(seed=2)
+    condensed = pairwise_dtw(profiles, n_jobs=1)
+    square = to_square_matrix(condensed, len(profiles))
+    labels = np.random.default_rng(3).integers(0, 4, len(profiles))
+    for labelling in (labels, kmedoids(condensed, 3)[0]):
+        labelling = np.unique(labelling, return_inverse=True)[1]
+        expected = metrics.silhouette_score(square, labelling, metric='precomputed')
+        assert silhouette(condensed, labelling) == pytest.approx(expected)
+
+def test_choose_k_prefers_the_true_number_of_groups():
+    profiles, truth = blobs(seed=4)
+    result = choose_k(pairwise_dtw(profiles, n_jobs=1), range(2, 6), n_jobs=1)
+    assert result['k'] == 3
+    assert same_partition(result['labels'], truth)
+    assert set(result['scores']) == {2, 3, 4, 5}
+
+def test_clara_on_samples_finds_the_groups():
+    profiles, truth = blobs(seed=5, per_cluster=40)
+    result = clara(profiles, k=3, n_jobs=1, sample_items=30, n_samples=3)
+    assert same_partition(result['labels'], truth)
+    assert result['labels'][result['medoids']].tolist() == [0, 1, 2]
+    assert result['distances'] is None
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from date_filter import day_numbers, iso_weeks, filter_chunks, dates_to_days
+
+
+def test_day_numbers_match_pandas():
+    times = pd.date_range('1999-12-25', '2025-03-05', freq='37h')
+    expected = (times.normalize() - pd.Timestamp('1970-01-01')).days.to_numpy()
+    text = pd.Series(times.strftime('%Y-%m-%d %H:%M:%S'))
+    assert np.array_equal(day_numbers(text), expected)
+    assert np.array_equal(day_numbers(pd.Series(times)), expected)
+
+def test_iso_weeks_match_isocalendar():
+    days = pd.date_range('2015-12-20', '2027-01-10', freq='D')
+    numbers = (days - pd.Timestamp('1970-01-01')).days.to_numpy()
+    assert np.array_equal(iso_weeks(numbers), days.isocalendar().week.to_numpy())
+
+def test_sorted_shortcut_keeps_the_same_rows():
+    times = pd.date_range('2024-08-25', '2024-09-20', freq='h').strftime('%Y-%m-%d %H:%M:%S')
+    df = pd.DataFrame({'DATE_TIME': times, 'N': np.arange(len(times))})
+    chunks = [df.iloc[start:start + 50] for start in range(0, len(df), 50)]
+    dates = ['2024-09-01', '2024-09-02', '2024-09-15']
+    # 2024-09-01 and 2024-09-15 are Sundays in ISO weeks 35 and 37
+    for weeks, rows in ((None, 72), ([36], 24)):
+        fast = pd.concat(filter_chunks(chunks, dates=dates, weeks=weeks, assume_sorted=True))
+        slow = pd.concat(filter_chunks(chunks, dates=dates, weeks=weeks))
+        assert fast['N'].tolist() == slow['N'].tolist()
+        assert set(day_numbers(fast['DATE_TIME'])) <= set(dates_to_days(dates))
+        assert len(fast) == rows
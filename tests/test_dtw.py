@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import dtw
+from dtw import (dtw_distance, dtw_pairs, pairwise_dtw, to_square_matrix, lb_keogh,
+                 nearest_neighbour, batched_distances, pairwise_day_distances)
+
+
+def reference_dtw(s1, s2, window=None):
+    """Plain double loop, as in benchmarks/bench_pairwise_dtw.py, with an optional band."""
+    n, m = len(s1), len(s2)
+    band = max(n, m) if window is None else max(window, abs(n - m))
+    dtw_matrix = np.full((n+1, m+1), np.inf)
+    dtw_matrix[0, 0] = 0
+    for i in range(1, n+1):
+        for j in range(max(1, i - band), min(m, i + band) + 1):
+            cost = abs(s1[i-1] - s2[j-1])
+            dtw_matrix[i, j] = cost + min(dtw_matrix[i-1, j], dtw_matrix[i, j-1], dtw_matrix[i-1, j-1])
+    return dtw_matrix[n, m]
+
+@pytest.fixture(params=['compiled', 'numpy'])
+def kernel(request, monkeypatch):
+    """Runs a test with the numba kernel (when installed) and with the NumPy fallback."""
+    if request.param == 'numpy':
+        monkeypatch.setattr(dtw, '_dtw_compiled', None)
+        monkeypatch.setattr(dtw, '_dtw_pairs_compiled', None)
+    elif dtw._dtw_compiled is None:
+        pytest.skip("numba is not installed")
+    return request.param
+
+@pytest.mark.parametrize('window', [None, 0, 3])
+def test_distance_matches_reference(kernel, window):
+    rng = np.random.default_rng(0)
+    for n, m in [(24, 24), (10, 15), (1, 5)]:
+        s1, s2 = rng.random(n), rng.random(m)
+        assert dtw_distance(s1, s2, window) == pytest.approx(reference_dtw(s1, s2, window))
+
+def test_pairs_match_reference_in_any_batch_size(kernel):
+    rng = np.random.default_rng(1)
+    s1, s2 = rng.random((9, 24)), rng.random((9, 24))
+    expected = [reference_dtw(a, b, 2) for a, b in zip(s1, s2)]
+    assert dtw_pairs(s1, s2, 2) == pytest.approx(expected)
+    assert dtw_pairs(s1, s2, 2, batch_size=4) == pytest.approx(expected)
+
+def test_pairwise_is_condensed_pdist_order():
+    rng = np.random.default_rng(2)
+    profiles = rng.random((7, 24))
+    square = to_square_matrix(pairwise_dtw(profiles, n_jobs=1, chunk_pairs=5), len(profiles))
+    for i in range(len(profiles)):
+        for j in range(len(profiles)):
+            expected = 0.0 if i == j else reference_dtw(profiles[i], profiles[j])
+            assert square[i, j] == pytest.approx(expected)
+
+@pytest.mark.parametrize('window', [None, 1, 4])
+def test_lb_keogh_is_a_lower_bound(window):
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        query, candidate = rng.normal(size=24), rng.normal(size=24)
+        assert lb_keogh(query, candidate, window) <= dtw_distance(query, candidate, window) + 1e-9
+
+def test_nearest_neighbour_matches_brute_force():
+    rng = np.random.default_rng(4)
+    query, candidates = rng.random(24), rng.random((30, 24))
+    index, distance = nearest_neighbour(query, candidates, window=3)
+    brute = [dtw_distance(query, c, 3) for c in candidates]
+    assert index == int(np.argmin(brute))
+    assert distance == pytest.approx(min(brute))
+
+def test_batched_distances_leave_rows_with_nan_out():
+    rng = np.random.default_rng(5)
+    s1, s2 = rng.random((4, 24)), rng.random((4, 24))
+    s1[1, 5] = np.nan
+    distances = batched_distances(s1, s2, metric='euclidean')
+    assert np.isnan(distances[1])
+    assert distances[0] == pytest.approx(np.linalg.norm(s1[0] - s2[0]))
+
+def test_euclidean_day_distances_match_direct_norms():
+    rng = np.random.default_rng(6)
+    profiles = rng.random((6, 24))
+    condensed = pairwise_day_distances(profiles, metric='euclidean')
+    rows, cols = np.triu_indices(6, k=1)
+    assert condensed == pytest.approx(np.linalg.norm(profiles[rows] - profiles[cols], axis=1))
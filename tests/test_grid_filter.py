@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from grid_filter import to_cell_ids, cell_id, cell_center, make_cell_set, grid_mask
+
+
+def test_float32_coordinates_keep_their_cell():
+    # Compact chunks hold float32 coordinates of the grid cell centers, they must
+    # map to the float64 cell
+    lats = (np.array([7420, 7465, 7499]) + 0.5) * 0.0054931640625
+    lons = (np.array([2600, 2641, 2679]) + 0.5) * 0.010986328125
+    ids64 = to_cell_ids(lats, lons)
+    ids32 = to_cell_ids(lats.astype(np.float32), lons.astype(np.float32))
+    assert np.array_equal(ids64, ids32)
+
+def test_cell_center_inverts_cell_id():
+    for lat, lon in [(41.006469, 28.987426), (40.5, -73.25), (-33.9, 151.2), (0.0, 0.0)]:
+        assert cell_center(cell_id(lat, lon)) == (lat, lon)
+
+def test_nearby_points_get_distinct_ids():
+    ids = to_cell_ids([41.0, 41.0, 41.000001], [29.0, 29.000001, 29.0])
+    assert len(np.unique(ids)) == 3
+
+def test_grid_mask_matches_tuple_lookup():
+    points = [(41.0064697265625, 28.9874267578125), (40.98724365234375, 29.0313720703125)]
+    chunk = pd.DataFrame({'LATITUDE': [points[0][0], 41.2, points[1][0]],
+                          'LONGITUDE': [points[0][1], 29.0, points[1][1]]})
+    mask = grid_mask(chunk, make_cell_set(points))
+    expected = [(lat, lon) in set(points) for lat, lon in zip(chunk['LATITUDE'], chunk['LONGITUDE'])]
+    assert mask.tolist() == expected
+    assert len(make_cell_set([])) == 0
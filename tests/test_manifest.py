@@ -0,0 +1,95 @@
+import os
+from contextlib import ExitStack
+import pytest
+import manifest
+from manifest import pending_scans, record_scans, load_manifest
+from segment_writer import SegmentWriter
+
+HEADER = b'A,B\n'
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Two raw files whose rows were extracted into one segment output."""
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    (raw / 'april.csv').write_text('april raw\n')
+    (raw / 'may.csv').write_text('may raw\n')
+    out = tmp_path / 'out'
+    out.mkdir()
+    april_rows, may_rows = b'1,april\n2,april\n', b'3,may\n'
+    (out / 'seg.csv').write_bytes(HEADER + april_rows + may_rows)
+
+    april_end = len(HEADER) + len(april_rows)
+    record_scans(str(out), {str(raw / 'april.csv'): {'seg': 2}, str(raw / 'may.csv'): {'seg': 1}},
+                 {'seg': str(out / 'seg.csv')},
+                 {str(raw / 'april.csv'): {'seg': [len(HEADER), april_end]},
+                  str(raw / 'may.csv'): {'seg': [april_end, april_end + len(may_rows)]}})
+    return tmp_path
+
+def inputs(root):
+    return [str(root / 'raw' / 'april.csv'), str(root / 'raw' / 'may.csv')]
+
+def outputs(root):
+    return {'seg': str(root / 'out' / 'seg.csv')}
+
+def test_nothing_to_do_when_unchanged(folder):
+    assert pending_scans(str(folder / 'out'), inputs(folder), outputs(folder)) == {}
+
+def test_new_segment_scans_every_file(folder):
+    paths = dict(outputs(folder), other=str(folder / 'out' / 'other.csv'))
+    assert pending_scans(str(folder / 'out'), inputs(folder), paths) == {path: ['other'] for path in inputs(folder)}
+
+def test_interrupted_append_is_truncated(folder):
+    output = folder / 'out' / 'seg.csv'
+    recorded = output.read_bytes()
+    with open(output, 'ab') as f:
+        f.write(b'9,half a ro')
+    assert pending_scans(str(folder / 'out'), inputs(folder), outputs(folder)) == {}
+    assert output.read_bytes() == recorded
+
+def test_changed_file_has_its_rows_cut_out(folder):
+    (folder / 'raw' / 'april.csv').write_text('april raw, corrected\n')
+    work = pending_scans(str(folder / 'out'), inputs(folder), outputs(folder))
+    assert work == {str(folder / 'raw' / 'april.csv'): ['seg']}
+    assert (folder / 'out' / 'seg.csv').read_bytes() == HEADER + b'3,may\n'
+
+    # The rows of may moved to the front, so does their range
+    files = load_manifest(str(folder / 'out'))['files']
+    assert str(folder / 'raw' / 'april.csv') not in files
+    assert files[str(folder / 'raw' / 'may.csv')]['ranges']['seg'] == [len(HEADER), len(HEADER) + 6]
+
+def test_shrunk_output_is_rebuilt(folder):
+    (folder / 'out' / 'seg.csv').write_bytes(HEADER)
+    work = pending_scans(str(folder / 'out'), inputs(folder), outputs(folder))
+    assert work == {path: ['seg'] for path in inputs(folder)}
+
+def test_failing_commit_rolls_the_append_back(folder, monkeypatch):
+    out = str(folder / 'out')
+    output = folder / 'out' / 'seg.csv'
+    before_bytes = output.read_bytes()
+    before_manifest = load_manifest(out)
+    (folder / 'raw' / 'june.csv').write_text('june raw\n')
+    june = str(folder / 'raw' / 'june.csv')
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(manifest, 'save_manifest', fail)
+
+    with pytest.raises(OSError):
+        with ExitStack() as writers:
+            writer = writers.enter_context(SegmentWriter(str(output), append=True))
+            start = writer.tell()
+            writer.append_part(str(_part(folder)), ['A', 'B'], 1)
+            writer.close()
+            record_scans(out, {june: {'seg': 1}}, outputs(folder), {june: {'seg': [start, writer.tell()]}})
+
+    assert output.read_bytes() == before_bytes
+    assert load_manifest(out) == before_manifest
+    monkeypatch.undo()
+    assert pending_scans(out, inputs(folder) + [june], outputs(folder)) == {june: ['seg']}
+
+def _part(folder):
+    part = folder / 'june.part'
+    part.write_bytes(b'4,june\n')
+    return part
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from schema import compact_frame, read_traffic_csv, write_traffic_csv, parse_times, COUNT_DTYPE
+
+
+def raw_frame():
+    return pd.DataFrame({
+        'DATE_TIME': ['2024-09-01 00:00:00', '2024-09-01 01:00:00'],
+        'LATITUDE': [41.0064697265625, 40.98724365234375],
+        'LONGITUDE': [28.9874267578125, 29.0313720703125],
+        'GEOHASH': ['sxk9', 'sxk3'],
+        'AVERAGE_SPEED': [45, 60],
+        'NUMBER_OF_VEHICLES': [120, 7],
+    })
+
+def test_compact_types():
+    df = compact_frame(raw_frame())
+    assert pd.api.types.is_datetime64_any_dtype(df['DATE_TIME'])
+    assert df['NUMBER_OF_VEHICLES'].dtype == COUNT_DTYPE
+    assert df['LATITUDE'].dtype == np.float32
+    assert isinstance(df['GEOHASH'].dtype, pd.CategoricalDtype)
+
+def test_values_that_do_not_fit_keep_their_type():
+    df = raw_frame()
+    df['NUMBER_OF_VEHICLES'] = [70000, 1]
+    df['LATITUDE'] = [41.1, 40.9]
+    df = compact_frame(df)
+    assert df['NUMBER_OF_VEHICLES'].dtype == np.int64
+    assert df['LATITUDE'].dtype == np.float64
+
+def test_write_and_read_back(tmp_path):
+    path = str(tmp_path / 'frame.csv')
+    df = compact_frame(raw_frame())
+    write_traffic_csv(df, path)
+    back = read_traffic_csv(path)
+    pd.testing.assert_frame_equal(back, df, check_categorical=False)
+    # float32 coordinates are written at float64 precision
+    assert '41.0064697265625' in open(path).read()
+
+def test_other_time_layouts_are_parsed():
+    times = parse_times(pd.Series(['2024-09-01 00:00:00', '2024-09-01 01:30', '2024-09-01T02:00:00']))
+    assert times.tolist() == [pd.Timestamp('2024-09-01 00:00'), pd.Timestamp('2024-09-01 01:30'),
+                              pd.Timestamp('2024-09-01 02:00')]
@@ -0,0 +1,74 @@
+import os
+from contextlib import ExitStack
+import pandas as pd
+import pytest
+from segment_writer import SegmentWriter
+from schema import read_traffic_csv
+
+
+def frame(hours, start='2024-09-01'):
+    times = pd.date_range(start, periods=hours, freq='h')
+    return pd.DataFrame({'DATE_TIME': times, 'LATITUDE': 41.0064697265625, 'LONGITUDE': 28.9874267578125,
+                         'NUMBER_OF_VEHICLES': range(hours)})
+
+def test_output_only_appears_on_close(tmp_path):
+    path = str(tmp_path / 'segment.csv')
+    writer = SegmentWriter(path, buffer_rows=2)
+    writer.write(frame(5))
+    assert not os.path.exists(path)
+    writer.close()
+    assert os.listdir(tmp_path) == ['segment.csv']
+
+def test_blocks_flushed_separately_read_back_the_same(tmp_path):
+    # Blocks of only midnight values must keep their time part
+    path = str(tmp_path / 'segment.csv')
+    df = frame(48)
+    with SegmentWriter(path, buffer_rows=1) as writer:
+        for day in (df.iloc[[0]], df.iloc[1:24], df.iloc[[24]], df.iloc[25:]):
+            writer.write(day)
+    back = read_traffic_csv(path)
+    assert back['DATE_TIME'].tolist() == df['DATE_TIME'].tolist()
+    assert back['NUMBER_OF_VEHICLES'].tolist() == df['NUMBER_OF_VEHICLES'].tolist()
+
+def test_failed_run_leaves_nothing(tmp_path):
+    path = str(tmp_path / 'segment.csv')
+    with pytest.raises(RuntimeError):
+        with SegmentWriter(path, buffer_rows=2) as writer:
+            writer.write(frame(5))
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+def test_abort_after_close_truncates_appended_rows(tmp_path):
+    path = str(tmp_path / 'segment.csv')
+    with SegmentWriter(path) as writer:
+        writer.write(frame(3))
+    before = open(path, 'rb').read()
+
+    with pytest.raises(RuntimeError):
+        with ExitStack() as writers:
+            writer = writers.enter_context(SegmentWriter(path, append=True))
+            writer.write(frame(4, start='2024-09-02'))
+            writer.close()
+            assert os.path.getsize(path) > len(before)
+            raise RuntimeError
+    assert open(path, 'rb').read() == before
+
+def test_abort_after_close_deletes_a_file_append_created(tmp_path):
+    path = str(tmp_path / 'segment.csv')
+    writer = SegmentWriter(path, append=True)
+    writer.write(frame(3))
+    writer.close()
+    assert os.path.exists(path)
+    writer.abort()
+    assert not os.path.exists(path)
+
+def test_appended_rows_follow_the_header_order(tmp_path):
+    path = str(tmp_path / 'segment.csv')
+    with SegmentWriter(path) as writer:
+        writer.write(frame(2))
+    with SegmentWriter(path, append=True) as writer:
+        writer.write(frame(2, start='2024-09-02')[['NUMBER_OF_VEHICLES', 'LONGITUDE', 'DATE_TIME', 'LATITUDE']])
+    back = pd.read_csv(path)
+    assert back.columns.tolist() == ['DATE_TIME', 'LATITUDE', 'LONGITUDE', 'NUMBER_OF_VEHICLES']
+    assert back['NUMBER_OF_VEHICLES'].tolist() == [0, 1, 0, 1]
+    assert back['DATE_TIME'].iloc[2] == '2024-09-02 00:00:00'
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+from series_store import write_series, append_series, load_series, day_matrix, hourly_profile, open_series
+
+
+def rows(start, hours, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=hours, freq='h').repeat(2)
+    return pd.DataFrame({'DATE_TIME': times,
+                         'NUMBER_OF_VEHICLES': rng.integers(1, 100, len(times)),
+                         'AVERAGE_SPEED': rng.integers(10, 90, len(times))})
+
+def test_series_are_whole_days_with_nan_for_missing_hours(tmp_path):
+    df = rows('2024-09-01 05:00', 10)
+    write_series(str(tmp_path), 'seg.csv', df)
+    values, first = load_series(str(tmp_path), 'seg.csv')
+    assert first == pd.Timestamp('2024-09-01') and len(values) == 24
+    assert np.isnan(values[:5]).all() and np.isnan(values[15:]).all()
+    assert values[5] == df['NUMBER_OF_VEHICLES'].iloc[:2].sum()
+
+def test_append_equals_full_write(tmp_path):
+    first, second = rows('2024-09-01', 50, seed=1), rows('2024-09-02 20:00', 60, seed=2)
+    write_series(str(tmp_path / 'a'), 'seg.csv', first)
+    append_series(str(tmp_path / 'a'), 'seg.csv', second)
+    write_series(str(tmp_path / 'b'), 'seg.csv', pd.concat([first, second]))
+    _, appended = open_series(str(tmp_path / 'a'), 'seg.csv')
+    _, full = open_series(str(tmp_path / 'b'), 'seg.csv')
+    np.testing.assert_allclose(appended, full, rtol=1e-6)
+
+def test_profile_matches_direct_grouping(tmp_path):
+    df = rows('2024-09-02', 24 * 14, seed=3)
+    write_series(str(tmp_path), 'seg.csv', df)
+    matrix, days = day_matrix(str(tmp_path), 'seg.csv')
+    assert matrix.shape == (14, 24)
+
+    weekdays = df[df['DATE_TIME'].dt.dayofweek < 5]
+    expected = weekdays.groupby(weekdays['DATE_TIME'].dt.hour)['NUMBER_OF_VEHICLES'].sum().to_numpy()
+    assert hourly_profile(str(tmp_path), 'seg.csv', weekdays=range(5)) == pytest.approx(expected)
+    assert hourly_profile(str(tmp_path), 'missing.csv') is None